@@ -0,0 +1,25 @@
+"""add reindex job failures
+
+Revision ID: 3d9f6b2e8a41
+Revises: c41d7e9a2b56
+Create Date: 2026-10-18 09:14:22.640113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3d9f6b2e8a41"
+down_revision = "c41d7e9a2b56"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "reindex_jobs", sa.Column("failed_entry_ids", sa.JSON(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("reindex_jobs", "failed_entry_ids")
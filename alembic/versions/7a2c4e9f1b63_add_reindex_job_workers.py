@@ -0,0 +1,26 @@
+"""add reindex job workers
+
+Revision ID: 7a2c4e9f1b63
+Revises: 3d9f6b2e8a41
+Create Date: 2026-10-18 11:02:47.318520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "7a2c4e9f1b63"
+down_revision = "3d9f6b2e8a41"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "reindex_jobs",
+        sa.Column("workers", sa.Integer(), nullable=False, server_default="1"),
+    )
+
+
+def downgrade():
+    op.drop_column("reindex_jobs", "workers")
@@ -0,0 +1,45 @@
+"""add reindex jobs
+
+Revision ID: 8e5c3a1f0b27
+Revises: 5bb29472d33f
+Create Date: 2026-10-17 10:12:40.112387
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_utils import UUIDType
+
+# revision identifiers, used by Alembic.
+revision = "8e5c3a1f0b27"
+down_revision = "5bb29472d33f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "reindex_jobs",
+        sa.Column("id", UUIDType, nullable=False),
+        sa.Column("resource_id", sa.String(length=32), nullable=False),
+        sa.Column("index_name", sa.String(length=100), nullable=False),
+        sa.Column("history_mark", sa.Integer(), nullable=False),
+        sa.Column("chunk_size", sa.Integer(), nullable=False),
+        sa.Column(
+            "status",
+            sa.Enum("RUNNING", "FAILED", "FINISHED", "ABANDONED"),
+            nullable=False,
+        ),
+        sa.Column("last_entry_id", sa.String(length=100), nullable=True),
+        sa.Column("indexed", sa.Integer(), nullable=False),
+        sa.Column("started_at", sa.Float(), nullable=False),
+        sa.Column("updated_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_reindex_jobs_resource_id", "reindex_jobs", ["resource_id"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("ix_reindex_jobs_resource_id", table_name="reindex_jobs")
+    op.drop_table("reindex_jobs")
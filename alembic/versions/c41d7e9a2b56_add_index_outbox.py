@@ -0,0 +1,31 @@
+"""add index outbox
+
+Revision ID: c41d7e9a2b56
+Revises: 8e5c3a1f0b27
+Create Date: 2026-10-17 21:52:08.530219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c41d7e9a2b56"
+down_revision = "8e5c3a1f0b27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "index_outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("resource_id", sa.String(length=32), nullable=False),
+        sa.Column("entry_id", sa.String(length=100), nullable=False),
+        sa.Column("op", sa.Enum("ADDED", "UPDATED", "DELETED"), nullable=False),
+        sa.Column("created_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade():
+    op.drop_table("index_outbox")
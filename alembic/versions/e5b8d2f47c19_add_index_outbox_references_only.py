@@ -0,0 +1,26 @@
+"""add index outbox references only
+
+Revision ID: e5b8d2f47c19
+Revises: 7a2c4e9f1b63
+Create Date: 2026-10-18 14:36:12.904127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "e5b8d2f47c19"
+down_revision = "7a2c4e9f1b63"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "index_outbox",
+        sa.Column("references_only", sa.Boolean(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade():
+    op.drop_column("index_outbox", "references_only")
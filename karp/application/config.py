@@ -58,6 +58,25 @@ TEST_ELASTICSEARCH_ENABLED = config(
 )
 
 SEARCH_CONTEXT = config("SEARCH_CONTEXT", default=None)
+
+# Directory to keep generated entry validators in, shared between workers
+VALIDATOR_CACHE_DIR = config("VALIDATOR_CACHE_DIR", cast=Path, default=None)
+# File to keep the graph of references between resources in, shared between workers.
+# Without it each process rebuilds its graph when it notices that another
+# process has changed a resource, which can take a few seconds
+REFERENCE_GRAPH_PATH = config("REFERENCE_GRAPH_PATH", cast=Path, default=None)
+# Write entry changes to an outbox that `karp-cli index-worker` indexes,
+# instead of indexing them while handling the request
+INDEX_OUTBOX = config("INDEX_OUTBOX", cast=bool, default=False)
+# The most entries referring to, or referred to by, changed entries that are
+# reindexed at once, 0 for no limit. With INDEX_OUTBOX the rest are left to the
+# index worker, which doesn't reindex their related entries in turn, otherwise
+# they are reindexed in chunks of this size
+INDEX_REFERENCE_FANOUT_LIMIT = config(
+    "INDEX_REFERENCE_FANOUT_LIMIT", cast=int, default=0
+)
+# The most plugin results to memoize, for plugins that declare the fields they read
+PLUGIN_CACHE_SIZE = config("PLUGIN_CACHE_SIZE", cast=int, default=10000)
 AUTH_CONTEXT = config("AUTH_CONTEXT", default=None)
 
 TEST_ES_HOME = config("TEST_ES_HOME", cast=Path, default=None)
@@ -20,6 +20,7 @@ def bootstrap(
     index_uow: unit_of_work.IndexUnitOfWork = None,
     entry_uow_factory: unit_of_work.EntryUowFactory = None,
     raise_on_all_errors: bool = False,
+    outbox_uow: unit_of_work.OutboxUnitOfWork = None,
 ) -> messagebus.MessageBus:
     setup_logging()
     load_infrastructure()
@@ -33,6 +34,8 @@ def bootstrap(
         entry_uow_factory = unit_of_work.DefaultEntryUowFactory()
     if index_uow is None:
         index_uow = unit_of_work.IndexUnitOfWork.create(config.SEARCH_CONTEXT)
+    if outbox_uow is None:
+        outbox_uow = sql_unit_of_work.SqlOutboxUnitOfWork()
     bus = messagebus.MessageBus(
         resource_uow=resource_uow,
         entry_uows=entry_uows,
@@ -40,6 +43,8 @@ def bootstrap(
         index_uow=index_uow,
         entry_uow_factory=entry_uow_factory,
         raise_on_all_errors=raise_on_all_errors,
+        index_outbox=config.INDEX_OUTBOX,
+        outbox_uow=outbox_uow,
     )
     bus.handle(events.AppStarted())  # needed? ?
     return bus
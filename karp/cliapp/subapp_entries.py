@@ -12,6 +12,7 @@ import json_streams
 # from karp.application.services import entries
 from karp.domain import commands
 from karp.errors import ResourceAlreadyPublished
+from karp.infrastructure.sql import compression
 
 from .utility import cli_error_handler, cli_timer
 from . import app_config
@@ -25,7 +26,14 @@ subapp = typer.Typer()
 @subapp.command("import")
 @cli_error_handler
 @cli_timer
-def import_resource(resource_id: str, version: Optional[int], data: Path):
+def import_resource(
+    resource_id: str,
+    version: Optional[int],
+    data: Path,
+    chunk_size: int = typer.Option(
+        1000, "--chunk-size", help="Number of entries written per database batch."
+    ),
+):
     cmd = commands.AddEntries(
         resource_id=resource_id,
         entries=tqdm(
@@ -33,6 +41,7 @@ def import_resource(resource_id: str, version: Optional[int], data: Path):
         ),
         user="local admin",
         message="imported through cli",
+        chunk_size=chunk_size,
     )
     app_config.bus.handle(cmd)
     typer.echo(f"Successfully imported entries to {resource_id}")
@@ -47,5 +56,75 @@ def update_entries(resource_id: str, data: Path):
     )
 
 
+@subapp.command("create-indexes")
+@cli_error_handler
+@cli_timer
+def create_indexes(resource_id: Optional[str] = typer.Argument(None)):
+    """Add missing secondary indexes to the entry tables of existing resources."""
+    cmd = commands.CreateMissingIndexes(resource_id=resource_id)
+    app_config.bus.handle(cmd)
+    typer.echo(f"Created missing indexes for {resource_id or 'all resources'}")
+
+
+@subapp.command("migrate-body-storage")
+@cli_error_handler
+@cli_timer
+def migrate_body_storage(
+    resource_id: str,
+    chunk_size: int = typer.Option(
+        1000, "--chunk-size", help="Number of history rows to rewrite per batch."
+    ),
+    source_compression: Optional[str] = typer.Option(
+        None,
+        "--source-compression",
+        help="The body_compression the bodies are stored with, if they are compressed.",
+    ),
+    source_dictionary: Optional[Path] = typer.Option(
+        None,
+        "--source-dictionary",
+        help="The body_compression_dictionary the bodies are stored with.",
+    ),
+):
+    """Rewrite the stored entry bodies of a resource to match its settings.
+
+    Use after changing `body_compression` in the resource's
+    `entry_repository_settings`, then restart running servers. Give the old
+    codec and dictionary if the bodies were compressed with a dictionary
+    that the new settings don't use.
+    """
+    source_settings = None
+    if source_dictionary is not None and source_compression is None:
+        raise typer.BadParameter("--source-dictionary requires --source-compression")
+    if source_compression is not None:
+        source_settings = {"body_compression": source_compression}
+        if source_dictionary is not None:
+            source_settings["body_compression_dictionary"] = str(source_dictionary)
+    cmd = commands.MigrateEntryBodyStorage(
+        resource_id=resource_id, chunk_size=chunk_size, source_settings=source_settings
+    )
+    app_config.bus.handle(cmd)
+    typer.echo(f"Migrated body storage for {resource_id}")
+
+
+@subapp.command("train-body-dictionary")
+@cli_error_handler
+@cli_timer
+def train_body_dictionary(
+    data: Path,
+    output: Path,
+    size: int = typer.Option(16384, "--size", help="Dictionary size in bytes."),
+):
+    """Train a compression dictionary from sample entries.
+
+    Point `body_compression_dictionary` in the resource's
+    `entry_repository_settings` to the written file.
+    """
+    dictionary = compression.train_dictionary(
+        json_streams.load_from_file(data), dict_size=size
+    )
+    output.write_bytes(dictionary)
+    typer.echo(f"Wrote {len(dictionary)} byte dictionary to {output}")
+
+
 def init_app(app):
     app.add_typer(subapp, name="entries")
@@ -0,0 +1,55 @@
+import logging
+import time
+
+import typer
+
+from karp.domain import commands
+
+from .utility import cli_error_handler
+
+from . import app_config
+
+logger = logging.getLogger("karp")
+
+
+@cli_error_handler
+def index_worker(
+    batch_size: int = typer.Option(
+        1000, "--batch-size", help="Number of outbox events indexed per batch."
+    ),
+    poll_interval: float = typer.Option(
+        1.0,
+        "--poll-interval",
+        help="Seconds to wait when the outbox is empty or indexing failed.",
+    ),
+    once: bool = typer.Option(
+        False, "--once", help="Exit when the outbox is empty instead of waiting."
+    ),
+):
+    """Index the entry changes written to the index outbox.
+
+    Run it when INDEX_OUTBOX is set. Events are removed from the outbox only
+    after they are indexed, so a failed batch is retried.
+    """
+    cmd = commands.IndexOutboxEvents(batch_size=batch_size)
+    indexed = 0
+    while True:
+        try:
+            num_events = app_config.bus.handle(cmd)
+        except Exception:
+            if once:
+                raise
+            logger.exception("Indexing outbox events failed, retrying")
+            time.sleep(poll_interval)
+            continue
+        indexed += num_events
+        if num_events:
+            continue
+        if once:
+            break
+        time.sleep(poll_interval)
+    typer.echo(f"Indexed {indexed} outbox events")
+
+
+def init_app(app):
+    app.command("index-worker")(index_worker)
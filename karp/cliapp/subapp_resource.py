@@ -1,4 +1,5 @@
 import logging
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional
 
@@ -9,6 +10,7 @@ from tabulate import tabulate
 from json_streams import jsonlib
 
 from karp.domain import commands
+from karp.services import resource_views
 
 # from karp.application import ctx
 # from karp.application.services import resources
@@ -85,13 +87,126 @@ def publish(resource_id: str):
 @subapp.command()
 @cli_error_handler
 @cli_timer
-def reindex(resource_id: str):
-    cmd = commands.ReindexResource(resource_id=resource_id)
+def reindex(
+    resource_id: str,
+    workers: int = typer.Option(
+        1, "--workers", help="Number of processes transforming entries."
+    ),
+    chunk_size: int = typer.Option(
+        1000, "--chunk-size", help="Number of entries per chunk."
+    ),
+    since_history_id: Optional[int] = typer.Option(
+        None,
+        "--since-history-id",
+        help="Only reindex entries changed after this history id.",
+    ),
+    since_time: Optional[str] = typer.Option(
+        None,
+        "--since-time",
+        help="Only reindex entries changed at or after this time "
+        "(Unix timestamp or ISO 8601 date).",
+    ),
+):
+    if since_history_id is not None and since_time is not None:
+        raise typer.BadParameter(
+            "Give at most one of --since-history-id and --since-time"
+        )
+    if since_history_id is not None or since_time is not None:
+        cmd = commands.ReindexChangedEntries(
+            resource_id=resource_id,
+            since_history_id=since_history_id,
+            since_timestamp=_parse_time(since_time) if since_time else None,
+        )
+        app_config.bus.handle(cmd)
+        typer.echo(f"Successfully reindexed changed entries in {resource_id}")
+        return
+    cmd = commands.ReindexResource(
+        resource_id=resource_id,
+        workers=workers,
+        chunk_size=chunk_size,
+    )
     app_config.bus.handle(cmd)
 
     typer.echo(f"Successfully reindexed all data in {resource_id}")
 
 
+@subapp.command("reindex-jobs")
+@cli_error_handler
+@cli_timer
+def list_reindex_jobs(resource_id: Optional[str] = typer.Argument(None)):
+    jobs = resource_views.get_reindex_jobs(app_config.bus.ctx, resource_id)
+    if not jobs:
+        typer.echo("No reindex jobs.")
+        raise typer.Exit()
+    typer.echo(
+        tabulate(
+            [
+                [
+                    job.id,
+                    job.resource_id,
+                    job.status.value,
+                    job.index_name,
+                    job.indexed,
+                    job.last_entry_id,
+                    datetime.fromtimestamp(job.updated_at, timezone.utc).isoformat(
+                        timespec="seconds"
+                    ),
+                ]
+                for job in jobs
+            ],
+            headers=[
+                "job_id",
+                "resource_id",
+                "status",
+                "index",
+                "indexed",
+                "last entry_id",
+                "updated",
+            ],
+        )
+    )
+
+
+@subapp.command("resume-reindex")
+@cli_error_handler
+@cli_timer
+def resume_reindex(
+    job_id: str,
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        help="Number of processes transforming entries, defaults to that of the job.",
+    ),
+):
+    app_config.bus.handle(commands.ResumeReindexJob(job_id=job_id, workers=workers))
+    typer.echo(f"Successfully resumed and finished reindex job {job_id}")
+
+
+@subapp.command("abandon-reindex")
+@cli_error_handler
+@cli_timer
+def abandon_reindex(job_id: str):
+    """Abandon an unfinished reindex job and delete its partial index."""
+    app_config.bus.handle(commands.AbandonReindexJob(job_id=job_id))
+    typer.echo(f"Abandoned reindex job {job_id}")
+
+
+def _parse_time(time: str) -> float:
+    try:
+        return float(time)
+    except ValueError:
+        pass
+    try:
+        date = datetime.fromisoformat(time)
+    except ValueError:
+        raise typer.BadParameter(
+            f"'{time}' is neither a timestamp nor a date", param_hint="--since-time"
+        )
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
 # @cli.command("reindex")
 # @click.option("--resource_id", default=None, help="", required=True)
 # @cli_error_handler
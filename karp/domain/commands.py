@@ -67,6 +67,50 @@ class PublishResource(Command):
 
 class ReindexResource(Command):
     resource_id: str
+    workers: int = 1
+    chunk_size: int = 1000
+
+
+class ResumeReindexJob(Command):
+    job_id: unique_id.UniqueId
+    workers: typing.Optional[int] = None
+
+
+class AbandonReindexJob(Command):
+    job_id: unique_id.UniqueId
+
+
+class ReindexChangedEntries(Command):
+    """Reindex the entries changed after a history id or at/after a timestamp."""
+
+    resource_id: str
+    since_history_id: typing.Optional[int] = None
+    since_timestamp: typing.Optional[float] = None
+
+    @pydantic.root_validator
+    def one_mark(cls, values):
+        if (values.get("since_history_id") is None) == (
+            values.get("since_timestamp") is None
+        ):
+            raise ValueError("Give exactly one of since_history_id and since_timestamp")
+        return values
+
+
+class IndexOutboxEvents(Command):
+    """Index the entries of the oldest batch_size events in the index outbox."""
+
+    batch_size: int = 1000
+
+
+class CreateMissingIndexes(Command):
+    resource_id: typing.Optional[str] = None
+
+
+class MigrateEntryBodyStorage(Command):
+    resource_id: str
+    chunk_size: int = 1000
+    # The body_compression settings the bodies are stored with, if they differ
+    source_settings: typing.Optional[typing.Dict] = None
 
 
 # Entry commands
@@ -85,6 +129,7 @@ class AddEntries(Command):
     entries: typing.Iterable[typing.Dict]
     user: str
     message: str
+    chunk_size: int = 1000
 
 
 class DeleteEntry(Command):
@@ -74,6 +74,34 @@ class ResourceNotPublished(DomainError):
         super().__init__(f"Resource '{resource_id}' is not published.", **kwargs)
 
 
+class ReindexJobNotFound(DomainError):
+    """Raised when a reindex job is missing."""
+
+    def __init__(self, job_id, **kwargs):
+        super().__init__(f"Reindex job '{job_id}' not found.", **kwargs)
+
+
+class ReindexJobNotResumable(DomainError):
+    """Raised when a reindex job is finished or abandoned."""
+
+    def __init__(self, job_id, status, **kwargs):
+        super().__init__(f"Reindex job '{job_id}' is {status}.", **kwargs)
+
+
+class IndexingFailed(DomainError):
+    """Raised when the index rejects some of the entries written to it."""
+
+    def __init__(self, resource_id, entry_ids, **kwargs):
+        self.resource_id = resource_id
+        self.entry_ids = list(entry_ids)
+        super().__init__(
+            f"Failed to index {len(self.entry_ids)} entries of '{resource_id}': "
+            + ", ".join(self.entry_ids[:10])
+            + (", ..." if len(self.entry_ids) > 10 else ""),
+            **kwargs,
+        )
+
+
 class RepositoryError(DomainError):
     def __init__(self, message: str, **kwargs):
         if "code" not in kwargs:
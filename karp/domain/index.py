@@ -74,7 +74,14 @@ class Index(abc.ABC):
         return index_cls()
 
     @abc.abstractmethod
-    def create_index(self, resource_id: str, config: Dict):
+    def create_index(
+        self, resource_id: str, config: Dict, *, make_current: bool = True
+    ) -> Optional[str]:
+        """Create a new index and return its name.
+
+        With make_current=False writes keep going to the current index until
+        `switch_index` is called.
+        """
         pass
 
     @abc.abstractmethod
@@ -82,7 +89,20 @@ class Index(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def add_entries(self, resource_id: str, entries: typing.Iterable[IndexEntry]):
+    def add_entries(
+        self,
+        resource_id: str,
+        entries: typing.Iterable[IndexEntry],
+        *,
+        refresh: bool = True,
+        index_name: Optional[str] = None,
+    ):
+        """Add entries, refresh=False leaves making them searchable to publish.
+
+        The entries are added to the current index of the resource, or to
+        index_name if given. Raises errors.IndexingFailed with the ids of
+        the entries that the index rejected, after adding the others.
+        """
         pass
 
     @abc.abstractmethod
@@ -92,9 +112,28 @@ class Index(abc.ABC):
         *,
         entry_id: Optional[str] = None,
         # entry: Optional[Entry] = None,
+        index_name: Optional[str] = None,
     ):
         pass
 
+    def switch_index(self, resource_id: str, index_name: str):
+        """Make index_name the current and published index of the resource."""
+        self.publish_index(resource_id)
+
+    def delete_index(self, resource_id: str, index_name: str):
+        """Delete index_name, that must not be the current index of the resource."""
+        pass
+
+    def writer_metrics(self) -> Optional[Dict]:
+        """Return the metrics of buffered writes, None if writes aren't buffered."""
+        return None
+
+    def index_name_max_age(self) -> float:
+        """Return how many seconds after `create_index` with make_current=False
+        other processes may keep writing to the index it is to replace, past
+        `switch_index`."""
+        return 0.0
+
     def create_empty_object(self) -> IndexEntry:
         return IndexEntry()
 
@@ -1,4 +1,6 @@
 from .models.entity import Entity
 from .models.entry import Entry, EntryStatus, EntryOp, create_entry
+from .models.outbox import OutboxEvent
+from .models.reindex_job import ReindexJob, ReindexJobStatus
 from .models.resource import Resource, create_resource
 from .models.user import User
@@ -0,0 +1,48 @@
+"""Entry changes waiting in the outbox to be indexed."""
+from typing import Optional
+
+import attr
+
+from karp.domain import events
+from karp.domain.models.entry import EntryOp
+from karp.utility import time
+
+
+_OPS = {
+    events.EntryAdded: EntryOp.ADDED,
+    events.EntryUpdated: EntryOp.UPDATED,
+    events.EntryDeleted: EntryOp.DELETED,
+}
+
+
+@attr.s(auto_attribs=True)
+class OutboxEvent:
+    """A change of entry_id in resource_id that the index worker hasn't indexed.
+
+    Outbox events are stored in the same transaction as the change itself, and
+    id is assigned when it is stored, in the order the changes were made.
+
+    An event with references_only is not a change of the entry, but a related
+    entry that was left to the index worker to reindex, see
+    INDEX_REFERENCE_FANOUT_LIMIT. Its own related entries are not reindexed.
+    """
+
+    resource_id: str
+    entry_id: str
+    op: EntryOp
+    created_at: float = attr.Factory(time.utc_now)
+    references_only: bool = False
+    id: Optional[int] = None
+
+    @classmethod
+    def from_event(cls, evt: events.Event) -> Optional["OutboxEvent"]:
+        """Return the outbox event of an entry event, None for other events."""
+        op = _OPS.get(type(evt))
+        if op is None:
+            return None
+        return cls(
+            resource_id=evt.resource_id,
+            entry_id=evt.entry_id,
+            op=op,
+            created_at=evt.timestamp,
+        )
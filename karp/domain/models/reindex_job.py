@@ -0,0 +1,60 @@
+"""Reindex runs of a resource, with a checkpoint to resume from."""
+import enum
+from typing import List, Optional
+
+import attr
+
+from karp.utility import time, unique_id
+
+
+class ReindexJobStatus(enum.Enum):
+    RUNNING = "running"
+    FAILED = "failed"
+    FINISHED = "finished"
+    ABANDONED = "abandoned"
+
+
+@attr.s(auto_attribs=True)
+class ReindexJob:
+    """A reindex of resource_id into the new index index_name.
+
+    Entries are indexed in entry_id order and last_entry_id is the last entry
+    known to be indexed, so a resumed job continues after it. history_mark is
+    the history high-water mark from when the job started, the changes after
+    it are replayed before the job switches to the new index. The entries
+    that the index rejected are kept in failed_entry_ids, and the job doesn't
+    switch to the new index until they are indexed. workers is the number of
+    processes transforming the entries.
+    """
+
+    resource_id: str
+    index_name: str
+    history_mark: int
+    chunk_size: int = 1000
+    workers: int = 1
+    id: unique_id.UniqueId = attr.Factory(unique_id.make_unique_id)
+    status: ReindexJobStatus = ReindexJobStatus.RUNNING
+    last_entry_id: Optional[str] = None
+    indexed: int = 0
+    failed_entry_ids: List[str] = attr.Factory(list)
+    started_at: float = attr.Factory(time.utc_now)
+    updated_at: float = attr.Factory(time.utc_now)
+
+    @property
+    def is_resumable(self) -> bool:
+        return self.status in (ReindexJobStatus.RUNNING, ReindexJobStatus.FAILED)
+
+    def checkpoint(self, last_entry_id: str, num_entries: int):
+        self.last_entry_id = last_entry_id
+        self.indexed += num_entries
+        self.updated_at = time.utc_now()
+
+    def set_status(self, status: ReindexJobStatus):
+        self.status = status
+        self.updated_at = time.utc_now()
+
+    def record_failures(self, entry_ids: List[str]):
+        self.failed_entry_ids.extend(
+            entry_id for entry_id in entry_ids if entry_id not in self.failed_entry_ids
+        )
+        self.updated_at = time.utc_now()
@@ -2,7 +2,7 @@ import abc
 from karp.utility.unique_id import UniqueId
 import logging
 import typing
-from typing import Dict, List, Optional, Union, Tuple
+from typing import Dict, List, Optional, Set, Union, Tuple
 import uuid
 
 from . import errors, model
@@ -101,6 +101,56 @@ class ResourceRepository(Repository[model.Resource]):
     def _get_published_resources(self) -> typing.Iterable[model.Resource]:
         raise NotImplementedError()
 
+    def history_stamp(self) -> Optional[int]:
+        """Return a value that changes whenever a resource is changed.
+
+        Lets processes notice changes made by other processes, None if the
+        repository can't tell.
+        """
+        return None
+
+    def put_reindex_job(self, job: model.ReindexJob):
+        """Add or update the stored reindex job."""
+        raise NotImplementedError()
+
+    def reindex_job_by_id(self, job_id) -> Optional[model.ReindexJob]:
+        raise NotImplementedError()
+
+    def reindex_jobs(self, resource_id: Optional[str] = None) -> List[model.ReindexJob]:
+        """Return the reindex jobs, of resource_id if given, oldest first."""
+        raise NotImplementedError()
+
+
+class OutboxRepository(abc.ABC):
+    """The entry changes in the index outbox, waiting to be indexed.
+
+    Events are added by the entry repositories, in the transaction of the
+    change itself, see `EntryRepository.put_outbox_events`. The related
+    entries left to the index worker are added here.
+    """
+
+    @abc.abstractmethod
+    def put_outbox_events(self, outbox_events: typing.Iterable[model.OutboxEvent]):
+        """Add events to the index outbox."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def pending_entry_ids(
+        self, resource_id: str, entry_ids: typing.Iterable[str]
+    ) -> Set[str]:
+        """Return the ids of entry_ids that have events in the index outbox."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def outbox_events(self, limit: int) -> List[model.OutboxEvent]:
+        """Return at most limit events from the index outbox, oldest first."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete_outbox_events(self, ids: typing.Iterable[int]):
+        """Remove the events that are indexed from the index outbox."""
+        raise NotImplementedError()
+
 
 class EntryRepository(Repository[model.Entry]):
     # class Repository:
@@ -230,6 +280,15 @@ class EntryRepository(Repository[model.Entry]):
     def entry_ids(self) -> List[str]:
         raise NotImplementedError()
 
+    def put_many(self, entries: typing.Iterable[model.Entry]):
+        entries = list(entries)
+        self._put_many(entries)
+        self.seen.update(entries)
+
+    def _put_many(self, entries: List[model.Entry]):
+        for entry in entries:
+            self._put(entry)
+
     def by_entry_id(
         self, entry_id: str, *, version: Optional[int] = None
     ) -> model.Entry:
@@ -245,6 +304,83 @@ class EntryRepository(Repository[model.Entry]):
     ) -> Optional[model.Entry]:
         raise NotImplementedError()
 
+    def by_entry_ids(self, entry_ids: typing.Iterable[str]) -> Dict[str, model.Entry]:
+        """Fetch the current version of several entries at once.
+
+        Entry ids that don't exist are left out of the result.
+        """
+        entries = self._by_entry_ids(list(dict.fromkeys(entry_ids)))
+        self.seen.update(entries.values())
+        return entries
+
+    def _by_entry_ids(self, entry_ids: List[str]) -> Dict[str, model.Entry]:
+        entries = {}
+        for entry_id in entry_ids:
+            entry = self._by_entry_id(entry_id)
+            if entry:
+                entries[entry_id] = entry
+        return entries
+
+    def by_referenceable_values(
+        self,
+        field_name: str,
+        values: typing.Iterable,
+        filters: Optional[Dict] = None,
+    ) -> Dict[typing.Any, List[model.Entry]]:
+        """Fetch the entries whose referenceable field has any of values.
+
+        The entries are grouped by the value they matched, values without any
+        matching entry are left out.
+        """
+        result = self._by_referenceable_values(
+            field_name, list(dict.fromkeys(values)), filters or {}
+        )
+        for entries in result.values():
+            self.seen.update(entries)
+        return result
+
+    def _by_referenceable_values(
+        self, field_name: str, values: List, filters: Dict
+    ) -> Dict[typing.Any, List[model.Entry]]:
+        result = {}
+        for value in values:
+            entries = self.by_referenceable({**filters, field_name: value})
+            if entries:
+                result[value] = entries
+        return result
+
+    def put_outbox_events(self, outbox_events: typing.Iterable[model.OutboxEvent]):
+        """Add events to the index outbox, in the transaction of the entries."""
+        raise NotImplementedError()
+
+    def history_high_water_mark(self) -> int:
+        """Return the id of the latest history row, 0 if there is none."""
+        raise NotImplementedError()
+
+    def history_id_before(self, timestamp: float) -> int:
+        """Return the id of the latest history row older than timestamp, or 0."""
+        raise NotImplementedError()
+
+    def changes_since(
+        self, history_id: int
+    ) -> typing.Tuple[List[model.Entry], List[str]]:
+        """Find the entries changed after the history row history_id.
+
+        Returns the current version of the changed entries and the entry_ids
+        of the changed entries that are discarded.
+        """
+        raise NotImplementedError()
+
+    def create_missing_indexes(self) -> List[str]:
+        """Create secondary indexes missing in the storage and return their names."""
+        return []
+
+    def migrate_body_storage(
+        self, chunk_size: int = 1000, *, source_settings: Optional[Dict] = None
+    ) -> Dict:
+        """Rewrite stored bodies in the configured format and return statistics."""
+        return {}
+
     # @abc.abstractmethod
     def teardown(self):
         """Use for testing purpose."""
@@ -265,10 +401,41 @@ class EntryRepository(Repository[model.Entry]):
         to_version: Optional[int] = None,
         offset: int = 0,
         limit: int = 100,
-    ) -> Tuple[List[model.Entry], int]:
-        return [], 0
+        cursor: Optional[int] = None,
+        with_total: bool = True,
+    ) -> Tuple[List[model.Entry], Optional[int], Optional[int]]:
+        """Return a page of history, the total (if asked for) and the next cursor.
+
+        If cursor is given the page starts after that history row and offset is
+        ignored. The next cursor is None when there are no more rows.
+        """
+        return [], 0 if with_total else None, None
+
+    def get_history_with_diffs(
+        self, **kwargs
+    ) -> Tuple[
+        List[Tuple[model.Entry, Optional[List[Dict]]]], Optional[int], Optional[int]
+    ]:
+        """Like get_history, but pairs each entry with its stored diff.
+
+        The diff is None when the repository doesn't store diffs.
+        """
+        entries, total, next_cursor = self.get_history(**kwargs)
+        return [(entry, None) for entry in entries], total, next_cursor
 
     @abc.abstractmethod
     def all_entries(self) -> typing.Iterable[model.Entry]:
         """Return all entries."""
         return []
+
+    def iter_entries(
+        self, chunk_size: int = 1000, *, after_entry_id: Optional[str] = None
+    ) -> typing.Iterator[model.Entry]:
+        """Iterate over all current entries, fetching chunk_size entries at a time.
+
+        The entries are ordered by entry_id, starting after after_entry_id.
+        """
+        entries = sorted(self.all_entries(), key=lambda entry: entry.entry_id)
+        for entry in entries:
+            if after_entry_id is None or entry.entry_id > after_entry_id:
+                yield entry
@@ -1,7 +1,10 @@
+import itertools
 import logging
 import re
 import json
-from typing import Any, Dict, List, Optional, Set, Tuple, Union
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 from datetime import datetime
 
 import elasticsearch
@@ -15,11 +18,14 @@ from karp.domain import index
 from karp.domain.models.entry import Entry
 from karp.domain.models.resource import Resource
 from karp.domain.errors import (
+    ConsistencyError,
+    IndexingFailed,
     UnsupportedField,
     # IncompleteQuery,
     # UnsupportedQuery,
 )
 from .es_query import EsQuery
+from .es6_index_writer import Es6IndexWriter, shared_writer
 from . import es_config
 
 logger = logging.getLogger("karp")
@@ -28,20 +34,62 @@ KARP_CONFIGINDEX = "karp_config"
 KARP_CONFIGINDEX_TYPE = "configs"
 
 
-class Es6Index(index.Index, index_type="es6_index"):
-    def __init__(self, es: Optional[elasticsearch.Elasticsearch] = None):
-        if es is None:
+_default_es: Optional[elasticsearch.Elasticsearch] = None
+_default_es_lock = threading.Lock()
+
+
+def _default_client() -> elasticsearch.Elasticsearch:
+    """Return the client of ELASTICSEARCH_HOST, that the indices of a process share."""
+    global _default_es
+    with _default_es_lock:
+        if _default_es is None:
             logger.info(
                 "Connecting to Elasticsearch with url=%s", es_config.ELASTICSEARCH_HOST
             )
-            es = elasticsearch.Elasticsearch(
+            _default_es = elasticsearch.Elasticsearch(
                 hosts=es_config.ELASTICSEARCH_HOST,
                 sniff_on_start=True,
                 sniff_on_connection_fail=True,
                 sniffer_timeout=60,
                 sniff_timeout=10,
             )
-        self.es: elasticsearch.Elasticsearch = es
+        return _default_es
+
+
+class Es6Index(index.Index, index_type="es6_index"):
+    def __init__(
+        self,
+        es: Optional[elasticsearch.Elasticsearch] = None,
+        *,
+        bulk_chunk_size: Optional[int] = None,
+        bulk_max_bytes: Optional[int] = None,
+        bulk_threads: Optional[int] = None,
+        writer_max_delay_ms: Optional[float] = None,
+        writer_max_docs: Optional[int] = None,
+        index_name_ttl: Optional[float] = None,
+    ):
+        self.es: elasticsearch.Elasticsearch = es or _default_client()
+        self.bulk_chunk_size = (
+            bulk_chunk_size or es_config.ELASTICSEARCH_BULK_CHUNK_SIZE
+        )
+        self.bulk_max_bytes = bulk_max_bytes or es_config.ELASTICSEARCH_BULK_MAX_BYTES
+        self.bulk_threads = bulk_threads or es_config.ELASTICSEARCH_BULK_THREADS
+        if writer_max_delay_ms is None:
+            writer_max_delay_ms = es_config.ELASTICSEARCH_WRITER_MAX_DELAY_MS
+        self.writer: Optional[Es6IndexWriter] = None
+        if writer_max_delay_ms > 0:
+            self.writer = shared_writer(
+                self.es,
+                max_delay=writer_max_delay_ms / 1000,
+                max_docs=writer_max_docs or es_config.ELASTICSEARCH_WRITER_MAX_DOCS,
+            )
+        self.index_name_ttl = (
+            es_config.ELASTICSEARCH_INDEX_NAME_TTL
+            if index_name_ttl is None
+            else index_name_ttl
+        )
+        # The current index of each resource, and when it was looked up
+        self._index_names: Dict[str, Tuple[str, float]] = {}
         if not self.es.indices.exists(index=KARP_CONFIGINDEX):
             self.es.indices.create(
                 index=KARP_CONFIGINDEX,
@@ -63,7 +111,7 @@ class Es6Index(index.Index, index_type="es6_index"):
         self.analyzed_fields: Dict[str, List[str]] = analyzed_fields
         self.sortable_fields: Dict[str, Dict[str, List[str]]] = sortable_fields
 
-    def create_index(self, resource_id, config):
+    def create_index(self, resource_id, config, *, make_current: bool = True):
         print("creating es mapping ...")
         mapping = _create_es_mapping(config)
 
@@ -91,9 +139,28 @@ class Es6Index(index.Index, index_type="es6_index"):
             print("failed to create index")
             raise RuntimeError("failed to create index")
         print("index created")
-        self._set_index_name_for_resource(resource_id, index_name)
+        if make_current:
+            self._set_index_name_for_resource(resource_id, index_name)
+        else:
+            self._set_pending_index_name(resource_id, index_name)
         return index_name
 
+    def _set_pending_index_name(self, resource_id: str, index_name: Optional[str]):
+        """Mark that index_name is being built to replace the current index.
+
+        While it is marked, the processes writing to the resource look up the
+        current index before each write instead of caching it.
+        """
+        self.es.update(
+            index=KARP_CONFIGINDEX,
+            id=resource_id,
+            doc_type=KARP_CONFIGINDEX_TYPE,
+            body={"doc": {"pending_index_name": index_name}},
+            # Without a current index there are no writes to redirect
+            ignore=404,
+        )
+        self._index_names.pop(resource_id, None)
+
     def _set_index_name_for_resource(self, resource_id: str, index_name: str):
         self.es.index(
             index=KARP_CONFIGINDEX,
@@ -101,38 +168,181 @@ class Es6Index(index.Index, index_type="es6_index"):
             doc_type=KARP_CONFIGINDEX_TYPE,
             body={"index_name": index_name},
         )
+        self._index_names[resource_id] = (index_name, time.monotonic())
 
-    def _get_index_name_for_resource(self, resource_id: str) -> str:
+    def _get_index_name_for_resource(
+        self, resource_id: str, *, cached: bool = True
+    ) -> str:
+        """Return the current index of the resource.
+
+        The index name is looked up again when it is older than
+        `index_name_ttl`, or when cached is false. It isn't cached while a
+        new index of the resource is being built, so that writes go to the
+        new index as soon as `switch_index` is done.
+        """
+        if cached and resource_id in self._index_names:
+            index_name, looked_up_at = self._index_names[resource_id]
+            if time.monotonic() - looked_up_at < self.index_name_ttl:
+                return index_name
+        index_config = self._get_index_config(resource_id)
+        index_name = index_config["index_name"]
+        if index_config.get("pending_index_name"):
+            self._index_names.pop(resource_id, None)
+        else:
+            self._index_names[resource_id] = (index_name, time.monotonic())
+        return index_name
+
+    def _get_index_config(self, resource_id: str) -> Dict:
         res = self.es.get(
             index=KARP_CONFIGINDEX, id=resource_id, doc_type=KARP_CONFIGINDEX_TYPE
         )
-        return res["_source"]["index_name"]
+        return res["_source"]
+
+    def index_name_max_age(self) -> float:
+        return self.index_name_ttl
 
     def publish_index(self, resource_id: str):
+        self._flush_writer()
         if self.es.indices.exists_alias(name=resource_id):
             self.es.indices.delete_alias(name=resource_id, index="*")
 
-        index_name = self._get_index_name_for_resource(resource_id)
+        # Another process may have created the index
+        index_name = self._get_index_name_for_resource(resource_id, cached=False)
+        # Entries added without refresh become searchable here
+        self.es.indices.refresh(index=index_name)
         self.on_publish_resource(resource_id, index_name)
         print(f"publishing '{resource_id}' => '{index_name}'")
         self.es.indices.put_alias(name=resource_id, index=index_name)
 
-    def add_entries(self, resource_id: str, entries: List[index.IndexEntry]):
-        index_name = self._get_index_name_for_resource(resource_id)
-        index_to_es = []
-        for entry in entries:
-            assert isinstance(entry, index.IndexEntry)
-            # entry.update(metadata.to_dict())
-            index_to_es.append(
-                {
-                    "_index": index_name,
-                    "_id": entry.id,
-                    "_type": "entry",
-                    "_source": entry.entry,
-                }
+    def switch_index(self, resource_id: str, index_name: str):
+        """Move the alias of resource_id to index_name in one request.
+
+        The config pointer, that writes go through, is moved right after, so
+        entries written in between end up in the old index and have to be
+        replayed by the caller.
+        """
+        self._flush_writer()
+        self.es.indices.refresh(index=index_name)
+        self.on_publish_resource(resource_id, index_name)
+        actions = [{"add": {"index": index_name, "alias": resource_id}}]
+        if self.es.indices.exists_alias(name=resource_id):
+            actions.insert(0, {"remove": {"index": "*", "alias": resource_id}})
+        print(f"switching '{resource_id}' => '{index_name}'")
+        self.es.indices.update_aliases(body={"actions": actions})
+        self._set_index_name_for_resource(resource_id, index_name)
+
+    def delete_index(self, resource_id: str, index_name: str):
+        index_config = self._get_index_config(resource_id)
+        if index_name == index_config["index_name"]:
+            raise ConsistencyError(
+                f"Can't delete '{index_name}', the current index of '{resource_id}'"
+            )
+        if index_name == index_config.get("pending_index_name"):
+            self._set_pending_index_name(resource_id, None)
+        print(f"deleting index '{index_name}'")
+        self.es.indices.delete(index=index_name, ignore=404)
+
+    def add_entries(
+        self,
+        resource_id: str,
+        entries: Iterable[index.IndexEntry],
+        *,
+        refresh: bool = True,
+        index_name: Optional[str] = None,
+    ):
+        """Index entries as they are read from the iterable.
+
+        The entries are sent in chunks of at most `bulk_chunk_size` entries and
+        `bulk_max_bytes` bytes, by `bulk_threads` threads. Entries that fail
+        don't stop the indexing, the failures are logged as they come in and
+        IndexingFailed is raised with the ids of all of them at the end. The
+        index is refreshed once at the end if refresh is true, by the bulk
+        request itself when the entries fit in one chunk, so that a write of a
+        few entries is a single request.
+
+        With a writer, a few entries for the current index are buffered with
+        the other small writes instead, and are searchable after the flush.
+        With refresh the call waits for the flush, without it returns at once
+        and failures are only logged.
+        """
+        buffered = index_name is None and self.writer is not None
+        if index_name is None:
+            index_name = self._get_index_name_for_resource(resource_id)
+        if buffered:
+            entries = iter(entries)
+            head = list(itertools.islice(entries, self.writer.max_docs + 1))
+            if len(head) <= self.writer.max_docs:
+                failed = self.writer.submit(
+                    (_index_action(index_name, entry) for entry in head),
+                    wait=refresh,
+                )
+                if failed:
+                    raise IndexingFailed(resource_id, _failed_ids(failed))
+                return
+            # Buffered writes of the same entries must not land after these
+            self.writer.flush()
+            entries = itertools.chain(head, entries)
+        bulk_kwargs = {
+            "chunk_size": self.bulk_chunk_size,
+            "max_chunk_bytes": self.bulk_max_bytes,
+            "raise_on_error": False,
+            "raise_on_exception": False,
+        }
+        if refresh:
+            entries = iter(entries)
+            head = list(itertools.islice(entries, self.bulk_chunk_size + 1))
+            if 0 < len(head) <= self.bulk_chunk_size:
+                # The bulk request of the only chunk refreshes the index
+                bulk_kwargs["refresh"] = "true"
+                refresh = False
+            entries = itertools.chain(head, entries)
+        actions = (_index_action(index_name, entry) for entry in entries)
+        if self.bulk_threads > 1:
+            results = elasticsearch.helpers.parallel_bulk(
+                self.es, actions, thread_count=self.bulk_threads, **bulk_kwargs
+            )
+        else:
+            results = elasticsearch.helpers.streaming_bulk(
+                self.es, actions, **bulk_kwargs
             )
 
-        elasticsearch.helpers.bulk(self.es, index_to_es, refresh=True)
+        failed_ids = []
+        new_errors = []
+        num_results = 0
+        for ok, item in results:
+            num_results += 1
+            if not ok:
+                new_errors.append(item)
+            if num_results % self.bulk_chunk_size == 0:
+                failed_ids.extend(self._report_errors(index_name, new_errors))
+                new_errors = []
+        failed_ids.extend(self._report_errors(index_name, new_errors))
+
+        if refresh:
+            self.es.indices.refresh(index=index_name)
+        if failed_ids:
+            raise IndexingFailed(resource_id, failed_ids)
+
+    def _flush_writer(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def writer_metrics(self) -> Optional[Dict]:
+        return self.writer.metrics.snapshot() if self.writer is not None else None
+
+    def _report_errors(self, index_name: str, errors: List[Dict]) -> List[str]:
+        """Log the failed bulk items, return the ids of their entries."""
+        if not errors:
+            return []
+        failed_ids = _failed_ids(errors)
+        logger.error(
+            "Failed to index %d entries in '%s': %s, first error: %s",
+            len(failed_ids),
+            index_name,
+            ", ".join(failed_ids),
+            errors[0],
+        )
+        return failed_ids
 
     def delete_entry(
         self,
@@ -140,11 +350,29 @@ class Es6Index(index.Index, index_type="es6_index"):
         *,
         entry_id: Optional[str] = None,
         entry: Optional[Entry] = None,
+        index_name: Optional[str] = None,
     ):
         if not entry and not entry_id:
             raise ValueError("Must give either 'entry' or 'entry_id'.")
         if entry:
             entry_id = entry.entry_id
+        if index_name:
+            # Replaying a delete, the entry may never have been indexed there
+            self.es.delete(index=index_name, doc_type="entry", id=entry_id, ignore=404)
+            return
+        if self.writer is not None:
+            self.writer.submit(
+                [
+                    {
+                        "_op_type": "delete",
+                        "_index": self._get_index_name_for_resource(resource_id),
+                        "_type": "entry",
+                        "_id": entry_id,
+                    }
+                ],
+                wait=True,
+            )
+            return
         self.es.delete(
             index=resource_id,
             doc_type="entry",
@@ -485,6 +713,20 @@ class Es6Index(index.Index, index_type="es6_index"):
 #             return [prop_name]
 
 
+def _failed_ids(items: List[Dict]) -> List[str]:
+    return [str(next(iter(item.values())).get("_id")) for item in items]
+
+
+def _index_action(index_name: str, entry: index.IndexEntry) -> Dict:
+    assert isinstance(entry, index.IndexEntry)
+    return {
+        "_index": index_name,
+        "_id": entry.id,
+        "_type": "entry",
+        "_source": entry.entry,
+    }
+
+
 def _create_es_mapping(config):
     es_mapping = {"dynamic": False, "properties": {}}
 
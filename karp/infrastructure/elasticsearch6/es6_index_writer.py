@@ -0,0 +1,300 @@
+"""Micro-batching of the small index writes that entry changes make.
+
+Each entry change used to be one bulk request with a forced refresh. The
+writer buffers the index and delete actions for up to `max_delay` seconds or
+`max_docs` documents, keeps only the latest action per document and sends
+what is buffered as one bulk request that also refreshes the shards it wrote
+to. Callers that need to read their writes wait for the flush, the others
+return as soon as the actions are buffered.
+
+The indices of a process share one writer, and its thread, per client, see
+`shared_writer`.
+
+The indices have `refresh_interval: -1`, so `refresh=wait_for` would wait for
+a refresh that never comes, and each flush refreshes instead.
+"""
+import atexit
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+import elasticsearch
+
+logger = logging.getLogger("karp")
+
+# (index name, document id)
+DocKey = Tuple[str, str]
+
+
+class IndexWriterMetrics:
+    """Counters and recent flush latencies and batch sizes of a writer.
+
+    The flush latency is the time from the first action of a batch being
+    buffered until its bulk request has returned.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.failed_flushes = 0
+        self._latencies: Deque[float] = collections.deque(maxlen=window)
+        self._batch_sizes: Deque[int] = collections.deque(maxlen=window)
+
+    def record_submit(self, num_actions: int, num_coalesced: int):
+        with self._lock:
+            self.submitted += num_actions
+            self.coalesced += num_coalesced
+
+    def record_flush(
+        self, batch_size: int, num_failed: int, latency: float, ok: bool = True
+    ):
+        with self._lock:
+            self.flushes += 1
+            if ok:
+                self.written += batch_size - num_failed
+                self.failed += num_failed
+            else:
+                self.failed += batch_size
+                self.failed_flushes += 1
+            self._latencies.append(latency)
+            self._batch_sizes.append(batch_size)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            batch_sizes = list(self._batch_sizes)
+            return {
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "flushes": self.flushes,
+                "written": self.written,
+                "failed": self.failed,
+                "failed_flushes": self.failed_flushes,
+                "flush_latency_ms": {
+                    "p50": _percentile(latencies, 0.5) * 1000,
+                    "p95": _percentile(latencies, 0.95) * 1000,
+                    "max": (latencies[-1] if latencies else 0.0) * 1000,
+                },
+                "batch_size": {
+                    "mean": sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+                    "max": max(batch_sizes, default=0),
+                },
+            }
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[
+        min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    ]
+
+
+class Es6IndexWriter:
+    def __init__(
+        self,
+        es: elasticsearch.Elasticsearch,
+        *,
+        max_delay: float,
+        max_docs: int,
+    ):
+        self.es = es
+        self.max_delay = max_delay
+        self.max_docs = max_docs
+        self.metrics = IndexWriterMetrics()
+        self._cond = threading.Condition()
+        self._pending: Dict[DocKey, Dict] = {}
+        # The futures of the callers waiting for the flush, with their documents
+        self._waiters: List[Tuple[Future, Set[DocKey]]] = []
+        self._first_at: Optional[float] = None
+        self._flush_now = False
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="es6-index-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, actions: Iterable[Dict], *, wait: bool = False) -> List[Dict]:
+        """Buffer bulk actions, replacing earlier actions on the same documents.
+
+        With wait, block until the actions are written and searchable and
+        return the items that failed, otherwise return at once. Failures are
+        logged either way.
+        """
+        future = self._submit(actions, wait=wait)
+        return future.result() if future else []
+
+    def flush(self):
+        """Write what is buffered at once and wait until it is searchable."""
+        self._submit([], wait=True, now=True).result()
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        atexit.unregister(self.close)
+        with _shared_writers_lock:
+            for key, writer in list(_shared_writers.items()):
+                if writer is self:
+                    del _shared_writers[key]
+
+    def _submit(
+        self, actions: Iterable[Dict], *, wait: bool, now: bool = False
+    ) -> Optional[Future]:
+        num_actions = 0
+        num_coalesced = 0
+        keys = set()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The index writer is closed")
+            for action in actions:
+                key = (action["_index"], action["_id"])
+                if key in self._pending:
+                    num_coalesced += 1
+                self._pending[key] = action
+                keys.add(key)
+                num_actions += 1
+            future = None
+            if wait:
+                future = Future()
+                self._waiters.append((future, keys))
+            if self._first_at is None and (self._pending or self._waiters):
+                self._first_at = time.monotonic()
+            self._flush_now = self._flush_now or now
+            self._cond.notify()
+        self.metrics.record_submit(num_actions, num_coalesced)
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._first_at is None and not self._closed:
+                    self._cond.wait()
+                if self._first_at is None:
+                    return
+                deadline = self._first_at + self.max_delay
+                while (
+                    len(self._pending) < self.max_docs
+                    and not self._flush_now
+                    and not self._closed
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                pending, waiters, first_at = (
+                    self._pending,
+                    self._waiters,
+                    self._first_at,
+                )
+                self._pending, self._waiters, self._first_at = {}, [], None
+                self._flush_now = False
+            self._flush(list(pending.values()), waiters, first_at)
+
+    def _flush(
+        self,
+        actions: List[Dict],
+        waiters: List[Tuple[Future, Set[DocKey]]],
+        first_at: float,
+    ):
+        if not actions:
+            for future, _ in waiters:
+                future.set_result([])
+            return
+        failed = []
+        try:
+            response = self.es.bulk(body=_bulk_body(actions), refresh="true")
+            if response.get("errors"):
+                failed = [
+                    item for item in response["items"] if not _item_succeeded(item)
+                ]
+        except Exception as err:  # pylint: disable=broad-except
+            self.metrics.record_flush(
+                len(actions), 0, time.monotonic() - first_at, ok=False
+            )
+            logger.exception("Failed to write %d buffered index actions", len(actions))
+            for future, _ in waiters:
+                future.set_exception(err)
+            return
+        self.metrics.record_flush(
+            len(actions), len(failed), time.monotonic() - first_at
+        )
+        if failed:
+            logger.error(
+                "Failed to write %d of %d buffered index actions, first error: %s",
+                len(failed),
+                len(actions),
+                failed[0],
+            )
+        logger.debug(
+            "Wrote %d buffered index actions for %d waiting callers",
+            len(actions),
+            len(waiters),
+        )
+        for future, keys in waiters:
+            future.set_result([item for item in failed if _item_key(item) in keys])
+
+
+# The shared writers, by the id of their client and their settings
+_shared_writers: Dict[Tuple[int, float, int], Es6IndexWriter] = {}
+_shared_writers_lock = threading.Lock()
+
+
+def shared_writer(
+    es: elasticsearch.Elasticsearch, *, max_delay: float, max_docs: int
+) -> Es6IndexWriter:
+    """Return the writer of es with these settings, starting it if there is none.
+
+    The writer is closed at exit, or when its close method is called, after
+    which the next call starts a new one.
+    """
+    # A writer keeps its client alive, so the id isn't reused while it's open
+    key = (id(es), max_delay, max_docs)
+    with _shared_writers_lock:
+        writer = _shared_writers.get(key)
+        if writer is None:
+            writer = Es6IndexWriter(es, max_delay=max_delay, max_docs=max_docs)
+            _shared_writers[key] = writer
+        return writer
+
+
+def _bulk_body(actions: List[Dict]) -> List[Dict]:
+    body = []
+    for action in actions:
+        op_type = action.get("_op_type", "index")
+        body.append(
+            {
+                op_type: {
+                    "_index": action["_index"],
+                    "_type": action["_type"],
+                    "_id": action["_id"],
+                }
+            }
+        )
+        if op_type != "delete":
+            body.append(action["_source"])
+    return body
+
+
+def _item_succeeded(item: Dict) -> bool:
+    op_type, result = next(iter(item.items()))
+    # Deleting a document that isn't indexed is fine
+    return result.get("status", 500) < 300 or (
+        op_type == "delete" and result.get("status") == 404
+    )
+
+
+def _item_key(item: Dict) -> DocKey:
+    result = next(iter(item.values()))
+    return result.get("_index"), result.get("_id")
@@ -7,3 +7,27 @@ config = StarletteConfig(".env")
 ELASTICSEARCH_HOST = config(
     "ELASTICSEARCH_HOST", cast=CommaSeparatedStrings, default=None
 )
+
+# Limits of the chunks that entries are sent to Elasticsearch in
+ELASTICSEARCH_BULK_CHUNK_SIZE = config(
+    "ELASTICSEARCH_BULK_CHUNK_SIZE", cast=int, default=500
+)
+ELASTICSEARCH_BULK_MAX_BYTES = config(
+    "ELASTICSEARCH_BULK_MAX_BYTES", cast=int, default=100 * 1024 * 1024
+)
+# Number of threads sending chunks, 1 sends them one at a time
+ELASTICSEARCH_BULK_THREADS = config("ELASTICSEARCH_BULK_THREADS", cast=int, default=1)
+# Buffer the index writes of entry changes for up to this many milliseconds,
+# or until this many documents are buffered, and send them as one bulk request.
+# 0 sends every change at once.
+ELASTICSEARCH_WRITER_MAX_DELAY_MS = config(
+    "ELASTICSEARCH_WRITER_MAX_DELAY_MS", cast=float, default=0
+)
+ELASTICSEARCH_WRITER_MAX_DOCS = config(
+    "ELASTICSEARCH_WRITER_MAX_DOCS", cast=int, default=500
+)
+# Seconds that the current index of a resource is cached, so writes don't look
+# it up every time. It isn't cached while a reindex job builds a new index
+ELASTICSEARCH_INDEX_NAME_TTL = config(
+    "ELASTICSEARCH_INDEX_NAME_TTL", cast=float, default=5
+)
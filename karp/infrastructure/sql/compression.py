@@ -0,0 +1,190 @@
+"""Compressed storage of entry bodies."""
+import json
+import zlib
+from typing import Dict, Iterable, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from karp.domain import errors
+from karp.infrastructure.sql import db
+
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class BodyCodec:
+    """Compress and decompress serialized entry bodies.
+
+    Values are recognized by their own header, so bodies stored plain or with
+    the other codec can still be read, e.g. while a table is being migrated.
+    """
+
+    name: str
+
+    def __init__(self, level: Optional[int] = None, dictionary: Optional[bytes] = None):
+        self.level = level
+        self.dictionary = dictionary
+        self._zstd_decompressor = None
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def decompress(self, data: Union[bytes, str]) -> bytes:
+        if isinstance(data, str):
+            return data.encode("utf-8")
+        data = bytes(data)
+        if data.startswith(ZSTD_MAGIC):
+            if self._zstd_decompressor is None:
+                self._zstd_decompressor = _zstd_decompressor(self.dictionary)
+            return self._zstd_decompressor.decompress(data)
+        if _is_zlib(data):
+            return _zlib_decompress(data, self.dictionary)
+        return data
+
+
+class ZlibCodec(BodyCodec):
+    name = "zlib"
+
+    def compress(self, data: bytes) -> bytes:
+        level = self.level if self.level is not None else zlib.Z_DEFAULT_COMPRESSION
+        if self.dictionary:
+            compressor = zlib.compressobj(level, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(level)
+        return compressor.compress(data) + compressor.flush()
+
+
+class ZstdCodec(BodyCodec):
+    name = "zstd"
+
+    def __init__(self, level: Optional[int] = None, dictionary: Optional[bytes] = None):
+        if zstandard is None:
+            raise errors.ConfigurationError(
+                "body_compression 'zstd' requires the 'zstandard' package"
+            )
+        super().__init__(level=level, dictionary=dictionary)
+        kwargs = {"level": level if level is not None else 3}
+        if dictionary:
+            kwargs["dict_data"] = zstandard.ZstdCompressionDict(dictionary)
+        self._compressor = zstandard.ZstdCompressor(**kwargs)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+
+CODECS = {codec.name: codec for codec in (ZlibCodec, ZstdCodec)}
+
+
+def codec_from_settings(settings: Dict) -> Optional[BodyCodec]:
+    """Create the codec declared in an entry repository's settings, if any.
+
+    Recognized settings are `body_compression` ("zlib" or "zstd"),
+    `body_compression_level` and `body_compression_dictionary`, a path to a
+    (trained) dictionary for the resource.
+    """
+    codec_name = settings.get("body_compression")
+    if not codec_name:
+        return None
+    if codec_name not in CODECS:
+        raise errors.ConfigurationError(
+            f"Unknown body_compression '{codec_name}', expected one of {list(CODECS)}"
+        )
+    dictionary = None
+    dictionary_path = settings.get("body_compression_dictionary")
+    if dictionary_path:
+        with open(dictionary_path, "rb") as fp:
+            dictionary = fp.read()
+    return CODECS[codec_name](
+        level=settings.get("body_compression_level"), dictionary=dictionary
+    )
+
+
+def decode_body(value: Union[bytes, str], codec: Optional[BodyCodec] = None) -> Dict:
+    """Decode a stored body, whether it is compressed or plain json."""
+    if isinstance(value, (dict, list)):
+        return value
+    return json.loads((codec or _PLAIN).decompress(value))
+
+
+def encode_body(body: Dict, codec: Optional[BodyCodec] = None) -> Union[bytes, str]:
+    """Encode a body for storage, plain json if no codec is given."""
+    data = json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+    if codec is None:
+        return data
+    return codec.compress(data.encode("utf-8"))
+
+
+def train_dictionary(bodies: Iterable[Dict], dict_size: int = 16384) -> bytes:
+    """Train a dictionary for a resource from a sample of its bodies.
+
+    The result can be used by both codecs, zlib uses it as a preset dictionary.
+    """
+    if zstandard is None:
+        raise errors.ConfigurationError(
+            "training a dictionary requires the 'zstandard' package"
+        )
+    samples = [encode_body(body).encode("utf-8") for body in bodies]
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+
+class CompressedJson(db.TypeDecorator):
+    """Json stored compressed in a binary column."""
+
+    impl = db.LargeBinary
+    cache_ok = True
+
+    def __init__(self, codec: BodyCodec):
+        super().__init__()
+        self.codec = codec
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "mysql":
+            return dialect.type_descriptor(db.LONGBLOB())
+        return dialect.type_descriptor(db.LargeBinary())
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_body(value, self.codec)
+
+    def result_processor(self, dialect, coltype):
+        # Bypass the binary processor, rows not yet migrated may hold text.
+        def process(value):
+            if value is None:
+                return None
+            return decode_body(value, self.codec)
+
+        return process
+
+
+def _is_zlib(data: bytes) -> bool:
+    # RFC 1950: deflate method and a header checksum divisible by 31
+    return (
+        len(data) >= 2 and data[0] & 0x0F == 8 and (data[0] << 8 | data[1]) % 31 == 0
+    )
+
+
+def _zlib_decompress(data: bytes, dictionary: Optional[bytes]) -> bytes:
+    if dictionary:
+        decompressor = zlib.decompressobj(zdict=dictionary)
+    else:
+        decompressor = zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def _zstd_decompressor(dictionary: Optional[bytes]):
+    if zstandard is None:
+        raise errors.ConfigurationError(
+            "reading zstd compressed bodies requires the 'zstandard' package"
+        )
+    if dictionary:
+        return zstandard.ZstdDecompressor(
+            dict_data=zstandard.ZstdCompressionDict(dictionary)
+        )
+    return zstandard.ZstdDecompressor()
+
+
+_PLAIN = BodyCodec()
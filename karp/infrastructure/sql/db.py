@@ -20,14 +20,18 @@ from sqlalchemy import (
     and_,
     or_,
     JSON,
+    LargeBinary,
+    inspect,
 )
 from sqlalchemy import exc
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.sql import insert, delete, update
+from sqlalchemy.sql import insert, delete, update, select, bindparam
+from sqlalchemy.dialects.mysql import LONGBLOB
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import mapper, aliased, relationship
 from sqlalchemy.orm.session import Session, sessionmaker
 from sqlalchemy.schema import (
+    Index,
     UniqueConstraint,
     ForeignKeyConstraint,
     PrimaryKeyConstraint,
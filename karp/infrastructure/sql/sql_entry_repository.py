@@ -1,11 +1,14 @@
 """SQL repository for entries."""
 from karp.domain.errors import NonExistingField, RepositoryError
+import collections
 import logging
+import time
 from typing import Dict, List, Optional, Tuple
 import typing
 from uuid import UUID
 
 import regex
+from sb_json_tools import jsondiff
 
 from karp.domain.models.entry import (
     Entry,
@@ -15,11 +18,12 @@ from karp.domain.models.entry import (
     # EntryRepository,
     # create_entry_repository,
 )
-from karp.domain import errors, repository
+from karp.domain import errors, model, repository
 
-from karp.infrastructure.sql import db
+from karp.infrastructure.sql import compression, db
 from karp.infrastructure.sql import sql_models
 from karp.infrastructure.sql.sql_repository import SqlRepository
+from karp.utility import json_delta
 
 from karp import errors as karp_errors
 
@@ -30,6 +34,12 @@ DUPLICATE_PATTERN = r"Duplicate entry '(.+)' for key '(\w+)'"
 DUPLICATE_PROG = regex.compile(DUPLICATE_PATTERN)
 NO_PROPERTY_PATTERN = regex.compile(r"has no property '(\w+)'")
 
+# Max number of values in one IN-clause
+IN_CLAUSE_CHUNK_SIZE = 500
+
+# Versions between full bodies when storing history as deltas
+DEFAULT_SNAPSHOT_INTERVAL = 10
+
 
 class SqlEntryRepository(
     repository.EntryRepository, SqlRepository, repository_type="sql_v1", is_default=True
@@ -43,6 +53,7 @@ class SqlEntryRepository(
         # mapped_class: Any
         *,
         session: db.Session,
+        snapshot_interval: Optional[int] = None,
     ):
         if not session:
             raise TypeError("session can't be None")
@@ -53,6 +64,8 @@ class SqlEntryRepository(
         self.resource_config = resource_config
         # self.mapped_class = mapped_class
         self.resource_id = resource_id
+        # Store deltas, with a full body every snapshot_interval versions
+        self.snapshot_interval = snapshot_interval
 
     @classmethod
     def from_dict(
@@ -64,41 +77,66 @@ class SqlEntryRepository(
     ):
         if not session:
             raise TypeError("session can't be None")
+        history_model, runtime_model = cls._get_models(settings, resource_config)
+        sql_models.create_tables(session.bind, cls._tables(runtime_model))
+        return cls(
+            history_model=history_model,
+            runtime_model=runtime_model,
+            resource_config=resource_config,
+            resource_id=settings["resource_id"],
+            session=session,
+            snapshot_interval=cls._snapshot_interval(settings),
+        )
+
+    @classmethod
+    def create_tables(cls, settings: Dict, resource_config: typing.Dict, *, bind):
+        """Create the tables for a resource, if they are missing."""
+        _, runtime_model = cls._get_models(settings, resource_config)
+        sql_models.create_tables(bind, cls._tables(runtime_model))
+
+    @classmethod
+    def _get_models(cls, settings: Dict, resource_config: typing.Dict):
         try:
             table_name = settings.get("table_name") or settings["resource_id"]
         except KeyError:
             raise ValueError("Missing 'table_name' in settings.")
 
-        # history_model = db.get_table(table_name)
-        # if history_model is None:
-        #     history_model = create_history_entry_table(table_name)
-        # history_model.create(bind=db.engine, checkfirst=True)
-
-        history_model = sql_models.get_or_create_entry_history_model(table_name)
-
-        # runtime_table = db.get_table(runtime_table_name)
-        # if runtime_table is None:
-        #     runtime_table = create_entry_runtime_table(
-        #         runtime_table_name, history_model, settings["config"]
-        #     )
-
-        if session:
-            history_model.__table__.create(bind=session.bind, checkfirst=True)
-        # runtime_table.create(bind=db.engine, checkfirst=True)
+        history_model = sql_models.get_or_create_entry_history_model(
+            table_name,
+            body_codec=compression.codec_from_settings(settings),
+            delta_history=cls._snapshot_interval(settings) is not None,
+        )
         runtime_model = sql_models.get_or_create_entry_runtime_model(
             table_name, history_model, resource_config
         )
-        if session:
-            runtime_model.__table__.create(bind=session.bind, checkfirst=True)
-            for child_model in runtime_model.child_tables.values():
-                child_model.__table__.create(bind=session.bind, checkfirst=True)
-        return cls(
-            history_model=history_model,
-            runtime_model=runtime_model,
-            resource_config=resource_config,
-            resource_id=settings["resource_id"],
-            session=session,
+        return history_model, runtime_model
+
+    @staticmethod
+    def _snapshot_interval(settings: Dict) -> Optional[int]:
+        history_storage = settings.get("history_storage", "full")
+        if history_storage == "full":
+            return None
+        if history_storage != "delta":
+            raise errors.ConfigurationError(
+                f"Unknown history_storage '{history_storage}', "
+                "expected 'full' or 'delta'"
+            )
+        snapshot_interval = settings.get(
+            "history_snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL
         )
+        if snapshot_interval < 1:
+            raise errors.ConfigurationError("history_snapshot_interval must be >= 1")
+        return snapshot_interval
+
+    @staticmethod
+    def _tables(runtime_model) -> List[db.Table]:
+        # The history table must come first, the runtime table refers to it.
+        history_table = next(iter(runtime_model.__table__.foreign_keys)).column.table
+        return [
+            history_table,
+            runtime_model.__table__,
+            *(child.__table__ for child in runtime_model.child_tables.values()),
+        ]
 
     @classmethod
     def _create_repository_settings(
@@ -122,6 +160,30 @@ class SqlEntryRepository(
         except db.exc.DBAPIError as exc:
             raise errors.RepositoryError("db failure") from exc
 
+    def _put_many(self, entries: List[Entry]):
+        self._check_has_session()
+        if not entries:
+            return
+
+        history_ids = self._insert_history_many(entries)
+
+        runtime_rows = []
+        child_rows = collections.defaultdict(list)
+        for entry in entries:
+            runtime_row, entry_child_rows = self._entry_to_runtime_rows(
+                history_ids[entry.id], entry
+            )
+            runtime_rows.append(runtime_row)
+            for field_name, rows in entry_child_rows.items():
+                child_rows[field_name].extend(rows)
+        try:
+            self._session.execute(db.insert(self.runtime_model.__table__), runtime_rows)
+            for field_name, rows in child_rows.items():
+                child_model = self.runtime_model.child_tables[field_name]
+                self._session.execute(db.insert(child_model.__table__), rows)
+        except db.exc.DBAPIError as exc:
+            raise errors.RepositoryError("db failure") from exc
+
     def _update(self, entry: Entry):
         self._check_has_session()
         history_id = self._insert_history(entry)
@@ -160,7 +222,7 @@ class SqlEntryRepository(
     def delete(self, entry: Entry):
         self._check_has_session()
 
-        self._insert_history(entry)
+        history_id = self._insert_history(entry)
 
         db_entry = (
             self._session.query(self.runtime_model)
@@ -169,19 +231,51 @@ class SqlEntryRepository(
         )
         if not db_entry:
             raise errors.RepositoryError(f"Could not find {entry.entry_id}")
+        db_entry.history_id = history_id
         db_entry.discarded = True
 
     def _insert_history(self, entry: Entry):
         self._check_has_session()
         try:
             ins_stmt = db.insert(self.history_model)
-            history_dict = self._entry_to_history_dict(entry)
+            history_dict = self._entry_to_history_dict(
+                entry, previous=self._previous_versions([entry]).get(entry.id)
+            )
             ins_stmt = ins_stmt.values(**history_dict)
             result = self._session.execute(ins_stmt)
             return result.lastrowid or result.returned_defaults["history_id"]
         except db.exc.DBAPIError as exc:
             raise errors.RepositoryError("db failure") from exc
 
+    def _insert_history_many(self, entries: List[Entry]) -> Dict[UUID, int]:
+        """Insert history rows with one executemany and return their history_ids.
+
+        The generated history_ids are read back with one query keyed on the
+        entity ids, since not every supported backend can return them from an
+        executemany.
+        """
+        self._check_has_session()
+        previous_versions = self._previous_versions(entries)
+        history_rows = []
+        for entry in entries:
+            history_row = self._entry_to_history_dict(
+                entry, previous=previous_versions.get(entry.id)
+            )
+            del history_row["history_id"]
+            history_rows.append(history_row)
+        try:
+            self._session.execute(db.insert(self.history_model.__table__), history_rows)
+            query = (
+                self._session.query(
+                    self.history_model.id, db.func.max(self.history_model.history_id)
+                )
+                .filter(self.history_model.id.in_([entry.id for entry in entries]))
+                .group_by(self.history_model.id)
+            )
+            return dict(query.all())
+        except db.exc.DBAPIError as exc:
+            raise errors.RepositoryError("db failure") from exc
+
     def entry_ids(self) -> List[str]:
         self._check_has_session()
         query = self._session.query(self.runtime_model).filter_by(discarded=False)
@@ -192,19 +286,122 @@ class SqlEntryRepository(
         self, entry_id: str, *, version: Optional[int] = None
     ) -> Optional[Entry]:
         self._check_has_session()
-        query = self._session.query(self.history_model)
-        # query = query.join(
-        #     self.runtime_table,
-        #     self.history_model.c.history_id == self.runtime_table.c.history_id,
-        # )
-        query = query.filter_by(entry_id=entry_id)
         if version:
-            query = query.filter_by(version=version)
+            query = self._session.query(self.history_model).filter_by(
+                entry_id=entry_id, version=version
+            )
         else:
-            query = query.order_by(self.history_model.version.desc())
+            query = self._current_entries_query().filter(
+                self.runtime_model.entry_id == entry_id
+            )
         row = query.first()
         return self._history_row_to_entry(row) if row else None
 
+    def _by_entry_ids(self, entry_ids: List[str]) -> Dict[str, Entry]:
+        self._check_has_session()
+        entries = {}
+        for start in range(0, len(entry_ids), IN_CLAUSE_CHUNK_SIZE):
+            query = self._current_entries_query().filter(
+                self.runtime_model.entry_id.in_(
+                    entry_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                )
+            )
+            for entry in self._history_rows_to_entries(query.all()):
+                entries[entry.entry_id] = entry
+        return entries
+
+    def _by_referenceable_values(
+        self, field_name: str, values: List, filters: Dict
+    ) -> Dict[typing.Any, List[Entry]]:
+        self._check_has_session()
+        child_cls = self.runtime_model.child_tables.get(field_name)
+        if child_cls is not None:
+            column = getattr(child_cls, field_name)
+        else:
+            column = getattr(self.runtime_model, field_name, None)
+        if column is None:
+            raise NonExistingField(field_name)
+        matches = []
+        rows = {}
+        for start in range(0, len(values), IN_CLAUSE_CHUNK_SIZE):
+            query = self._session.query(column, self.history_model).join(
+                self.runtime_model,
+                self.runtime_model.history_id == self.history_model.history_id,
+            )
+            if child_cls is not None:
+                query = query.join(
+                    child_cls, child_cls.entry_id == self.runtime_model.entry_id
+                )
+            query = query.filter(
+                column.in_(values[start : start + IN_CLAUSE_CHUNK_SIZE]),
+                *(
+                    getattr(self.runtime_model, key) == value
+                    for key, value in filters.items()
+                ),
+            ).order_by(self.runtime_model.entry_id)
+            for value, row in query:
+                matches.append((value, row.history_id))
+                rows[row.history_id] = row
+        entries = dict(zip(rows, self._history_rows_to_entries(list(rows.values()))))
+        result = collections.defaultdict(list)
+        for value, history_id in matches:
+            result[value].append(entries[history_id])
+        return dict(result)
+
+    def _current_entries_query(self):
+        """Query the history rows that the runtime table points to."""
+        return self._session.query(self.history_model).join(
+            self.runtime_model,
+            self.runtime_model.history_id == self.history_model.history_id,
+        )
+
+    def put_outbox_events(self, outbox_events: typing.Iterable[model.OutboxEvent]):
+        self._check_has_session()
+        rows = [sql_models.OutboxEventDTO.to_dict(evt) for evt in outbox_events]
+        if rows:
+            self._session.execute(db.insert(sql_models.OutboxEventDTO.__table__), rows)
+
+    def history_high_water_mark(self) -> int:
+        self._check_has_session()
+        return (
+            self._session.query(db.func.max(self.history_model.history_id)).scalar()
+            or 0
+        )
+
+    def history_id_before(self, timestamp: float) -> int:
+        self._check_has_session()
+        return (
+            self._session.query(db.func.max(self.history_model.history_id))
+            .filter(self.history_model.last_modified < timestamp)
+            .scalar()
+            or 0
+        )
+
+    def changes_since(self, history_id: int) -> Tuple[List[Entry], List[str]]:
+        self._check_has_session()
+        # Deletes and moves leave the runtime row pointing to an older history
+        # row, so the changes are found by entity id
+        changed_ids = (
+            self._session.query(self.history_model.id)
+            .filter(self.history_model.history_id > history_id)
+            .distinct()
+            .subquery()
+        )
+        changed = self.runtime_model.id.in_(db.select(changed_ids.c.id))
+        discarded_entry_ids = [
+            row.entry_id
+            for row in self._session.query(self.runtime_model.entry_id)
+            .filter(changed, self.runtime_model.discarded == True)  # noqa: E712
+            .order_by(self.runtime_model.entry_id)
+        ]
+        rows = (
+            self._current_entries_query()
+            .filter(changed, self.runtime_model.discarded == False)  # noqa: E712
+            .order_by(self.runtime_model.entry_id)
+            .all()
+        )
+        return self._history_rows_to_entries(rows), discarded_entry_ids
+
     def _by_id(
         self,
         id: str,
@@ -234,6 +431,129 @@ class SqlEntryRepository(
         row = query.first()
         return self._history_row_to_entry(row) if row else None
 
+    def create_missing_indexes(self) -> List[str]:
+        """Add the declared history indexes that an existing table lacks.
+
+        History tables created before the indexes were declared don't get
+        them from `create(checkfirst=True)`, so they are added here one by one.
+        """
+        self._check_has_session()
+        bind = self._session.bind
+        history_table = self.history_model.__table__
+        existing = {
+            index["name"] for index in db.inspect(bind).get_indexes(history_table.name)
+        }
+        created = []
+        for index in sorted(history_table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            logger.info("Creating index '%s' on '%s'", index.name, history_table.name)
+            index.create(bind=bind)
+            created.append(index.name)
+        return created
+
+    def migrate_body_storage(
+        self, chunk_size: int = 1000, *, source_settings: Optional[Dict] = None
+    ) -> Dict:
+        """Rewrite all stored bodies in the format given by the settings.
+
+        The stored values are decoded with the codec of source_settings, the
+        settings the bodies were written with, or with the configured codec
+        if not given. Plain values are recognized either way, so this
+        converts plain tables to compressed, between codecs and dictionaries
+        and back to plain. The delta and diff columns of delta history are
+        rewritten as well.
+        """
+        self._check_has_session()
+        table_name = self.history_model.__tablename__
+        history_table = self.history_model.__table__
+        codec = getattr(history_table.c.body.type, "codec", None)
+        if source_settings is not None:
+            source_codec = compression.codec_from_settings(source_settings)
+        else:
+            source_codec = codec
+        column_names = [
+            name for name in ("body", "delta", "diff") if name in history_table.c
+        ]
+        # Untyped body columns, values are passed through as stored
+        raw_table = db.Table(
+            table_name,
+            db.MetaData(),
+            db.Column("history_id", db.Integer, primary_key=True),
+            *(db.Column(name) for name in column_names),
+        )
+        if codec is not None:
+            self._alter_body_columns(table_name, column_names, compressed=True)
+
+        stats = {
+            "rows": 0,
+            "size_before": 0,
+            "size_after": 0,
+            "read_seconds_before": 0.0,
+            "read_seconds_after": 0.0,
+        }
+        last_history_id = 0
+        while True:
+            rows = self._session.execute(
+                db.select(raw_table)
+                .where(raw_table.c.history_id > last_history_id)
+                .order_by(raw_table.c.history_id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            updates = []
+            for row in rows:
+                update = {"b_history_id": row.history_id}
+                for name in column_names:
+                    value = row._mapping[name]
+                    if value is None:
+                        update[f"b_{name}"] = None
+                        continue
+                    start = time.perf_counter()
+                    body = compression.decode_body(value, source_codec)
+                    stats["read_seconds_before"] += time.perf_counter() - start
+                    new_value = compression.encode_body(body, codec)
+                    start = time.perf_counter()
+                    compression.decode_body(new_value, codec)
+                    stats["read_seconds_after"] += time.perf_counter() - start
+                    stats["size_before"] += _stored_size(value)
+                    stats["size_after"] += _stored_size(new_value)
+                    update[f"b_{name}"] = new_value
+                updates.append(update)
+            self._session.execute(
+                db.update(raw_table)
+                .where(raw_table.c.history_id == db.bindparam("b_history_id"))
+                .values({name: db.bindparam(f"b_{name}") for name in column_names}),
+                updates,
+            )
+            stats["rows"] += len(rows)
+            last_history_id = rows[-1].history_id
+
+        if codec is None:
+            self._alter_body_columns(table_name, column_names, compressed=False)
+        return stats
+
+    def _alter_body_columns(
+        self, table_name: str, column_names: List[str], *, compressed: bool
+    ):
+        dialect = self._session.bind.dialect.name
+        if dialect == "sqlite":
+            # column types are only affinities in sqlite
+            return
+        if dialect != "mysql":
+            raise errors.RepositoryError(
+                f"Migrating body storage is not supported for '{dialect}'"
+            )
+        column_type = "LONGBLOB" if compressed else "JSON"
+        history_table = self.history_model.__table__
+        modifications = ", ".join(
+            f"MODIFY `{name}` {column_type} "
+            + ("NULL" if history_table.c[name].nullable else "NOT NULL")
+            for name in column_names
+        )
+        self._session.execute(db.text(f"ALTER TABLE `{table_name}` {modifications}"))
+
     def history_by_entry_id(self, entry_id: str) -> List[Entry]:
         self._check_has_session()
         query = self._session.query(self.history_model)
@@ -259,10 +579,36 @@ class SqlEntryRepository(
         # )
 
     def all_entries(self) -> typing.Iterable[Entry]:
+        return self.iter_entries()
+
+    def iter_entries(
+        self, chunk_size: int = 1000, *, after_entry_id: Optional[str] = None
+    ) -> typing.Iterator[Entry]:
+        """Stream the current version of all non-discarded entries.
+
+        Entries are read in chunks ordered by entry_id, each chunk starting
+        after the last entry_id of the previous one, so memory use is bounded
+        by chunk_size regardless of the size of the resource. The first chunk
+        starts after after_entry_id if given.
+        """
         self._check_has_session()
-
-        query = self._session.query(self.history_model).filter_by(discarded=False)
-        return [self._history_row_to_entry(db_entry) for db_entry in query.all()]
+        query = (
+            self._current_entries_query()
+            .filter(self.runtime_model.discarded == False)  # noqa: E712
+            .order_by(self.runtime_model.entry_id)
+        )
+        last_entry_id = after_entry_id
+        while True:
+            chunk_query = query
+            if last_entry_id is not None:
+                chunk_query = chunk_query.filter(
+                    self.runtime_model.entry_id > last_entry_id
+                )
+            rows = chunk_query.limit(chunk_size).all()
+            yield from self._history_rows_to_entries(rows)
+            if len(rows) < chunk_size:
+                return
+            last_entry_id = rows[-1].entry_id
 
     def by_referenceable(self, filters: Optional[Dict] = None, **kwargs) -> List[Entry]:
         self._check_has_session()
@@ -324,7 +670,7 @@ class SqlEntryRepository(
         # print(f"result = {result}")
         # return result
         # return query.all()
-        return [self._history_row_to_entry(db_entry) for _, db_entry in query.all()]
+        return self._history_rows_to_entries([db_entry for _, db_entry in query.all()])
 
     def get_history(
         self,
@@ -336,6 +682,46 @@ class SqlEntryRepository(
         to_version: Optional[int] = None,
         offset: int = 0,
         limit: int = 100,
+        cursor: Optional[int] = None,
+        with_total: bool = True,
+    ) -> Tuple[List[Entry], Optional[int], Optional[int]]:
+        rows, total, next_cursor = self._get_history_rows(
+            user_id=user_id,
+            entry_id=entry_id,
+            from_date=from_date,
+            to_date=to_date,
+            from_version=from_version,
+            to_version=to_version,
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+            with_total=with_total,
+        )
+        return self._history_rows_to_entries(rows), total, next_cursor
+
+    def get_history_with_diffs(self, **kwargs):
+        if self.snapshot_interval is None:
+            return super().get_history_with_diffs(**kwargs)
+        rows, total, next_cursor = self._get_history_rows(**kwargs)
+        entries = self._history_rows_to_entries(rows)
+        return (
+            [(entry, row.diff) for entry, row in zip(entries, rows)],
+            total,
+            next_cursor,
+        )
+
+    def _get_history_rows(
+        self,
+        user_id: Optional[str] = None,
+        entry_id: Optional[str] = None,
+        from_date: Optional[float] = None,
+        to_date: Optional[float] = None,
+        from_version: Optional[int] = None,
+        to_version: Optional[int] = None,
+        offset: int = 0,
+        limit: int = 100,
+        cursor: Optional[int] = None,
+        with_total: bool = True,
     ):
         self._check_has_session()
         query = self._session.query(self.history_model)
@@ -352,9 +738,16 @@ class SqlEntryRepository(
         elif to_date is not None:
             query = query.filter(self.history_model.last_modified <= to_date)
 
-        paged_query = query.limit(limit).offset(offset)
-        total = query.count()
-        return [self._history_row_to_entry(row) for row in paged_query.all()], total
+        total = query.count() if with_total else None
+
+        query = query.order_by(self.history_model.history_id)
+        if cursor is not None:
+            paged_query = query.filter(self.history_model.history_id > cursor)
+        else:
+            paged_query = query.offset(offset)
+        rows = paged_query.limit(limit).all()
+        next_cursor = rows[-1].history_id if rows and len(rows) == limit else None
+        return rows, total, next_cursor
 
     def _entry_to_history_row(
         self, entry: Entry
@@ -374,7 +767,11 @@ class SqlEntryRepository(
         )
 
     def _entry_to_history_dict(
-        self, entry: Entry, history_id: Optional[int] = None
+        self,
+        entry: Entry,
+        history_id: Optional[int] = None,
+        *,
+        previous: Optional[Tuple[Dict, int]] = None,
     ) -> Dict:
         return {
             "history_id": history_id,
@@ -388,13 +785,125 @@ class SqlEntryRepository(
             "message": entry.message,
             "op": entry.op,
             "discarded": entry.discarded,
+            **self._entry_to_delta_dict(entry, previous),
         }
 
-    def _history_row_to_entry(self, row) -> Entry:
+    def _previous_versions(self, entries: List[Entry]) -> Dict[UUID, Tuple[Dict, int]]:
+        """Return the body and snapshot version of the stored version of entries.
+
+        The latest stored version of each entry, before its new version is
+        inserted, is read with one query per chunk of entries.
+        """
+        if self.snapshot_interval is None:
+            return {}
+        ids = [entry.id for entry in entries if entry.version > 1]
+        rows = []
+        for start in range(0, len(ids), IN_CLAUSE_CHUNK_SIZE):
+            latest = (
+                self._session.query(
+                    self.history_model.id,
+                    db.func.max(self.history_model.version).label("version"),
+                )
+                .filter(
+                    self.history_model.id.in_(ids[start : start + IN_CLAUSE_CHUNK_SIZE])
+                )
+                .group_by(self.history_model.id)
+                .subquery()
+            )
+            rows.extend(
+                self._session.query(self.history_model).join(
+                    latest,
+                    db.and_(
+                        self.history_model.id == latest.c.id,
+                        self.history_model.version == latest.c.version,
+                    ),
+                )
+            )
+        return {
+            row.id: (previous.body, row.snapshot_version)
+            for row, previous in zip(rows, self._history_rows_to_entries(rows))
+        }
+
+    def _entry_to_delta_dict(
+        self, entry: Entry, previous: Optional[Tuple[Dict, int]]
+    ) -> Dict:
+        """Decide whether to store the body or the delta for this version.
+
+        previous is the body and snapshot version of the stored version before
+        entry, see `_previous_versions`.
+        """
+        if self.snapshot_interval is None:
+            return {}
+        if previous is None:
+            return {
+                "delta": None,
+                "diff": jsondiff.compare({}, entry.body),
+                "snapshot_version": entry.version,
+            }
+        previous_body, previous_snapshot_version = previous
+        result = {"diff": jsondiff.compare(previous_body, entry.body)}
+        if entry.version - previous_snapshot_version >= self.snapshot_interval:
+            result.update(delta=None, snapshot_version=entry.version)
+        else:
+            result.update(
+                body=None,
+                delta=json_delta.make_delta(previous_body, entry.body),
+                snapshot_version=previous_snapshot_version,
+            )
+        return result
+
+    def _history_rows_to_entries(self, rows) -> List[Entry]:
+        bodies = self._reconstruct_bodies([row for row in rows if row.body is None])
+        return [
+            self._history_row_to_entry(row, body=bodies.get(row.history_id))
+            for row in rows
+        ]
+
+    def _reconstruct_bodies(self, rows) -> Dict[int, Dict]:
+        """Recreate the bodies of delta rows from their snapshots.
+
+        The versions from each row's snapshot up to the row are read with one
+        query per chunk of rows, then the deltas are applied in order.
+        """
+        if not rows:
+            return {}
+        chain_conditions = [
+            db.and_(
+                self.history_model.id == row.id,
+                self.history_model.version.between(row.snapshot_version, row.version),
+            )
+            for row in rows
+        ]
+        chains = collections.defaultdict(dict)
+        for start in range(0, len(chain_conditions), IN_CLAUSE_CHUNK_SIZE):
+            query = self._session.query(
+                self.history_model.id,
+                self.history_model.version,
+                self.history_model.body,
+                self.history_model.delta,
+            ).filter(db.or_(*chain_conditions[start : start + IN_CLAUSE_CHUNK_SIZE]))
+            for chain_row in query.all():
+                chains[chain_row.id][chain_row.version] = chain_row
+
+        bodies = {}
+        for row in rows:
+            chain = chains[row.id]
+            body = chain[row.snapshot_version].body
+            for version in range(row.snapshot_version + 1, row.version + 1):
+                if version in chain:
+                    body = json_delta.apply_delta(body, chain[version].delta)
+            bodies[row.history_id] = body
+        return bodies
+
+    def _history_row_to_entry(self, row, body: Optional[Dict] = None) -> Entry:
         print(f"row = {row!r}")
+        if row.body is not None:
+            body = row.body
+        elif body is None:
+            body = self._reconstruct_bodies([row])[row.history_id]
         return Entry(
             entry_id=row.entry_id,
-            body=row.body,
+            body=body,
             message=row.message,
             status=row.status,
             op=row.op,
@@ -427,6 +936,38 @@ class SqlEntryRepository(
                 _entry[field_name] = field_val
         return _entry
 
+    def _entry_to_runtime_rows(
+        self, history_id: int, entry: Entry
+    ) -> Tuple[Dict, Dict[str, List[Dict]]]:
+        """Split an entry into a runtime row and rows for the child tables.
+
+        Unlike `_entry_to_runtime_dict` every runtime row gets the same keys,
+        so that the rows can be inserted with executemany.
+        """
+        runtime_row = {
+            "entry_id": entry.entry_id,
+            "history_id": history_id,
+            "id": entry.id,
+            "discarded": entry.discarded,
+        }
+        child_rows = {}
+        for field_name in self.resource_config.get("referenceable", ()):
+            field_val = entry.body.get(field_name)
+            if self.resource_config["fields"][field_name].get("collection"):
+                child_rows[field_name] = [
+                    {"entry_id": entry.entry_id, field_name: elem}
+                    for elem in field_val or ()
+                ]
+            else:
+                runtime_row[field_name] = field_val
+        return runtime_row, child_rows
+
+
+def _stored_size(value) -> int:
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(value)
+
 
 # ===== Value objects =====
 # class SqlEntryRepositorySettings(EntryRepositorySettings):
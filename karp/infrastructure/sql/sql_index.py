@@ -7,7 +7,9 @@ from karp.domain.models.entry import Entry
 
 
 class SqlSearchService(index.Index, index_type="sql_search_service", is_default=True):
-    def create_index(self, resource_id: str, resource_config: Dict):
+    def create_index(
+        self, resource_id: str, resource_config: Dict, *, make_current: bool = True
+    ):
         pass
 
     def publish_index(self, resource_id: str):
@@ -25,7 +27,14 @@ class SqlSearchService(index.Index, index_type="sql_search_service", is_default=
     def statistics(self):
         pass
 
-    def add_entries(self, resource_id, entries: List[index.IndexEntry]):
+    def add_entries(
+        self,
+        resource_id,
+        entries: List[index.IndexEntry],
+        *,
+        refresh: bool = True,
+        index_name: Optional[str] = None,
+    ):
         pass
 
     def delete_entry(
@@ -33,6 +42,7 @@ class SqlSearchService(index.Index, index_type="sql_search_service", is_default=
         resource: Resource,
         *,
         entry: Optional[Entry] = None,
-        entry_id: Optional[str] = None
+        entry_id: Optional[str] = None,
+        index_name: Optional[str] = None,
     ):
         pass
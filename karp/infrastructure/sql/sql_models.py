@@ -1,10 +1,11 @@
-from typing import Dict
+from typing import Dict, Iterable, Optional, Set, Tuple
+import weakref
 
 from karp.domain import model
 from karp.domain.models.entry import EntryOp, EntryStatus
 from karp.domain.models.resource import ResourceOp
 
-from karp.infrastructure.sql import db
+from karp.infrastructure.sql import compression, db
 
 
 class ResourceDTO(db.Base):
@@ -91,6 +92,85 @@ class ResourceDTO(db.Base):
         )
 
 
+class ReindexJobDTO(db.Base):
+    __tablename__ = "reindex_jobs"
+    id = db.Column(db.UUIDType, primary_key=True)
+    resource_id = db.Column(db.String(32), nullable=False, index=True)
+    index_name = db.Column(db.String(100), nullable=False)
+    history_mark = db.Column(db.Integer, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    workers = db.Column(db.Integer, nullable=False, default=1)
+    status = db.Column(db.Enum(model.ReindexJobStatus), nullable=False)
+    last_entry_id = db.Column(db.String(100), nullable=True)
+    indexed = db.Column(db.Integer, nullable=False)
+    failed_entry_ids = db.Column(db.JSON, nullable=True)
+    started_at = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+    def to_entity(self) -> model.ReindexJob:
+        return model.ReindexJob(
+            id=self.id,
+            resource_id=self.resource_id,
+            index_name=self.index_name,
+            history_mark=self.history_mark,
+            chunk_size=self.chunk_size,
+            workers=self.workers or 1,
+            status=self.status,
+            last_entry_id=self.last_entry_id,
+            indexed=self.indexed,
+            failed_entry_ids=list(self.failed_entry_ids or []),
+            started_at=self.started_at,
+            updated_at=self.updated_at,
+        )
+
+    @staticmethod
+    def from_entity(job: model.ReindexJob) -> "ReindexJobDTO":
+        return ReindexJobDTO(
+            id=job.id,
+            resource_id=job.resource_id,
+            index_name=job.index_name,
+            history_mark=job.history_mark,
+            chunk_size=job.chunk_size,
+            workers=job.workers,
+            status=job.status,
+            last_entry_id=job.last_entry_id,
+            indexed=job.indexed,
+            failed_entry_ids=list(job.failed_entry_ids),
+            started_at=job.started_at,
+            updated_at=job.updated_at,
+        )
+
+
+class OutboxEventDTO(db.Base):
+    __tablename__ = "index_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    resource_id = db.Column(db.String(32), nullable=False)
+    entry_id = db.Column(db.String(100), nullable=False)
+    op = db.Column(db.Enum(EntryOp), nullable=False)
+    created_at = db.Column(db.Float, nullable=False)
+    references_only = db.Column(db.Boolean, nullable=False, default=False)
+
+    def to_entity(self) -> model.OutboxEvent:
+        return model.OutboxEvent(
+            id=self.id,
+            resource_id=self.resource_id,
+            entry_id=self.entry_id,
+            op=self.op,
+            created_at=self.created_at,
+            references_only=self.references_only,
+        )
+
+    @staticmethod
+    def to_dict(outbox_event: model.OutboxEvent) -> Dict:
+        return {
+            "resource_id": outbox_event.resource_id,
+            "entry_id": outbox_event.entry_id,
+            "op": outbox_event.op,
+            "created_at": outbox_event.created_at,
+            "references_only": outbox_event.references_only,
+        }
+
+
 class BaseRuntimeEntry:
     entry_id = db.Column(
         # db.String(100, collation="utf8mb4_swedish_ci"), primary_key=True
@@ -140,7 +220,11 @@ class BaseHistoryEntry:
 # Dynamic models
 
 
-def get_or_create_entry_history_model(resource_id: str) -> BaseHistoryEntry:
+def get_or_create_entry_history_model(
+    resource_id: str,
+    body_codec: Optional[compression.BodyCodec] = None,
+    delta_history: bool = False,
+) -> BaseHistoryEntry:
     history_table_name = create_history_table_name(resource_id)
     if history_table_name in class_cache:
         history_model = class_cache[history_table_name]
@@ -149,9 +233,21 @@ def get_or_create_entry_history_model(resource_id: str) -> BaseHistoryEntry:
 
     attributes = {
         "__tablename__": history_table_name,
-        "__table_args__": None,  # (BaseHistoryEntry.__table_args__,),
+        "__table_args__": create_history_table_indexes(history_table_name),
         # "mysql_character_set": "utf8mb4",
     }
+    if body_codec is not None:
+        body_type = compression.CompressedJson(body_codec)
+    else:
+        body_type = db.JSON(none_as_null=True)
+    if body_codec is not None or delta_history:
+        attributes["body"] = db.Column(body_type, nullable=delta_history)
+    if delta_history:
+        # Versions between snapshots store the delta from the previous version
+        # instead of the body, plus the diff to show in the history.
+        attributes["delta"] = db.Column(body_type, nullable=True)
+        attributes["diff"] = db.Column(body_type, nullable=True)
+        attributes["snapshot_version"] = db.Column(db.Integer, nullable=False)
 
     sqlalchemy_class = type(history_table_name, (db.Base, BaseHistoryEntry), attributes)
     # sqlalchemy_class.__table__.create(bind=db.engine, checkfirst=True)
@@ -241,6 +337,33 @@ def get_or_create_entry_runtime_model(
 
 class_cache = {}
 
+# Tables known to exist, per engine, so they are only checked once per process
+_created_tables: "weakref.WeakKeyDictionary[db.Engine, Set[str]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def create_tables(bind, tables: Iterable[db.Table]) -> None:
+    """Create the given tables unless this process already has done so."""
+    engine = bind.engine
+    created_tables = _created_tables.setdefault(engine, set())
+    for table in tables:
+        if table.name in created_tables:
+            continue
+        table.create(bind=engine, checkfirst=True)
+        created_tables.add(table.name)
+
+
+@db.event.listens_for(db.Table, "after_drop")
+def _forget_dropped_table(table: db.Table, connection, **kw):
+    """Create a dropped table again the next time it is used.
+
+    Called for each table dropped with `Table.drop` or `MetaData.drop_all`.
+    """
+    created_tables = _created_tables.get(connection.engine)
+    if created_tables is not None:
+        created_tables.discard(table.name)
+
 
 # Helpers
 
@@ -251,3 +374,17 @@ def create_runtime_table_name(resource_id: str) -> str:
 
 def create_history_table_name(resource_id: str) -> str:
     return resource_id
+
+
+def create_history_table_indexes(history_table_name: str) -> Tuple[db.Index, ...]:
+    """Secondary indexes for the columns the entry repository filters on."""
+    return (
+        db.Index(f"{history_table_name}_entry_id_version_ix", "entry_id", "version"),
+        db.Index(f"{history_table_name}_id_last_modified_ix", "id", "last_modified"),
+        db.Index(f"{history_table_name}_last_modified_ix", "last_modified"),
+        db.Index(
+            f"{history_table_name}_last_modified_by_ix",
+            "last_modified_by",
+            "history_id",
+        ),
+    )
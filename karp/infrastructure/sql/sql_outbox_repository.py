@@ -0,0 +1,55 @@
+"""SQL Outbox Repository"""
+import typing
+from typing import List, Set
+
+from karp.domain import model, repository
+
+from . import db, sql_models
+from .sql_entry_repository import IN_CLAUSE_CHUNK_SIZE
+from .sql_repository import SqlRepository
+
+
+class SqlOutboxRepository(SqlRepository, repository.OutboxRepository):
+    def __init__(self, session: db.Session):
+        repository.OutboxRepository.__init__(self)
+        SqlRepository.__init__(self, session=session)
+
+    def put_outbox_events(self, outbox_events: typing.Iterable[model.OutboxEvent]):
+        self._check_has_session()
+        rows = [sql_models.OutboxEventDTO.to_dict(evt) for evt in outbox_events]
+        if rows:
+            self._session.execute(db.insert(sql_models.OutboxEventDTO.__table__), rows)
+
+    def pending_entry_ids(
+        self, resource_id: str, entry_ids: typing.Iterable[str]
+    ) -> Set[str]:
+        self._check_has_session()
+        entry_ids = list(entry_ids)
+        pending = set()
+        for start in range(0, len(entry_ids), IN_CLAUSE_CHUNK_SIZE):
+            query = self._session.query(sql_models.OutboxEventDTO.entry_id).filter(
+                sql_models.OutboxEventDTO.resource_id == resource_id,
+                sql_models.OutboxEventDTO.entry_id.in_(
+                    entry_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                ),
+            )
+            pending.update(entry_id for (entry_id,) in query.distinct())
+        return pending
+
+    def outbox_events(self, limit: int) -> List[model.OutboxEvent]:
+        self._check_has_session()
+        query = self._session.query(sql_models.OutboxEventDTO)
+        return [
+            event_dto.to_entity()
+            for event_dto in query.order_by(sql_models.OutboxEventDTO.id).limit(limit)
+        ]
+
+    def delete_outbox_events(self, ids: typing.Iterable[int]):
+        self._check_has_session()
+        ids = list(ids)
+        for start in range(0, len(ids), IN_CLAUSE_CHUNK_SIZE):
+            self._session.query(sql_models.OutboxEventDTO).filter(
+                sql_models.OutboxEventDTO.id.in_(
+                    ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                )
+            ).delete(synchronize_session=False)
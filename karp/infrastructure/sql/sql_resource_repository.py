@@ -1,8 +1,12 @@
 """SQL Resource Repository"""
 import logging
-from typing import Optional, List, Tuple, Dict, Union
+import threading
+import time
+from typing import Optional, List, Set, Tuple, Dict, Union
 from uuid import UUID
 import typing
+import weakref
+from copy import deepcopy
 
 from karp.domain.errors import RepositoryStatusError, IntegrityError
 from karp.domain.models.resource import (
@@ -17,12 +21,107 @@ from .sql_repository import SqlRepository
 
 _logger = logging.getLogger("karp")
 
+# Seconds between checks for resource changes made by other processes
+RESOURCE_CACHE_STAMP_TTL = 5.0
+
+
+class ResourceCache:
+    """Resources read from one database, keyed by (resource_id, version).
+
+    Changes made in this process are invalidated explicitly. Changes made by
+    other processes are detected by comparing the highest history_id of the
+    resources table, which is checked at most every `stamp_ttl` seconds.
+    """
+
+    def __init__(self, stamp_ttl: float = RESOURCE_CACHE_STAMP_TTL):
+        self.stamp_ttl = stamp_ttl
+        self._lock = threading.Lock()
+        self._resources: Dict[Tuple[str, int], Resource] = {}
+        self._latest_versions: Dict[str, int] = {}
+        self._stamp = None
+        self._stamp_checked_at = None
+
+    def get(self, resource_id: str, version: Optional[int]) -> Optional[Resource]:
+        with self._lock:
+            if version is None:
+                version = self._latest_versions.get(resource_id)
+            resource = self._resources.get((resource_id, version))
+        return _copy_resource(resource) if resource else None
+
+    def add(self, resource: Resource, *, is_latest: bool):
+        with self._lock:
+            self._resources[(resource.resource_id, resource.version)] = resource
+            if is_latest:
+                self._latest_versions[resource.resource_id] = resource.version
+
+    def invalidate(self, resource_id: str):
+        with self._lock:
+            self._latest_versions.pop(resource_id, None)
+            for key in [key for key in self._resources if key[0] == resource_id]:
+                del self._resources[key]
+
+    def clear(self):
+        with self._lock:
+            self._resources.clear()
+            self._latest_versions.clear()
+
+    def check_stamp(self, session: db.Session):
+        now = time.monotonic()
+        checked_at = self._stamp_checked_at
+        if checked_at is not None and now - checked_at < self.stamp_ttl:
+            return
+        stamp = _history_stamp(session)
+        self._stamp_checked_at = now
+        if stamp != self._stamp:
+            self.clear()
+            self._stamp = stamp
+
+
+def _history_stamp(session: db.Session) -> Optional[int]:
+    return session.query(db.func.max(ResourceDTO.history_id)).scalar()
+
+
+_resource_caches: "weakref.WeakKeyDictionary[db.Engine, ResourceCache]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_resource_cache(bind) -> ResourceCache:
+    """Return the process-wide resource cache for the database of bind."""
+    engine = bind.engine
+    cache = _resource_caches.get(engine)
+    if cache is None:
+        cache = _resource_caches.setdefault(engine, ResourceCache())
+    return cache
+
+
+def _copy_resource(resource: Resource) -> Resource:
+    # A new entity and config for each caller, sharing the json schema
+    copy = Resource(
+        entity_id=resource.id,
+        resource_id=resource.resource_id,
+        version=resource.version,
+        name=resource.name,
+        config=deepcopy(resource.config),
+        is_published=resource.is_published,
+        last_modified=resource.last_modified,
+        last_modified_by=resource.last_modified_by,
+        discarded=resource.discarded,
+        message=resource.message,
+        op=resource.op,
+    )
+    copy._entry_json_schema = resource._entry_json_schema
+    return copy
+
 
 class SqlResourceRepository(SqlRepository, repository.ResourceRepository):
     def __init__(self, session: db.Session):
         repository.ResourceRepository.__init__(self)
         SqlRepository.__init__(self, session=session)
         self.table = sql_models.ResourceDTO
+        self._cache = get_resource_cache(session.bind)
+        # Resources changed in this session, not cached until it is committed
+        self._changed: Set[str] = set()
 
     def check_status(self):
         self._check_has_session()
@@ -56,6 +155,13 @@ class SqlResourceRepository(SqlRepository, repository.ResourceRepository):
         # )
         resource_dto = ResourceDTO.from_entity(resource)
         self._session.add(resource_dto)
+        self._changed.add(resource.resource_id)
+
+    def invalidate_changed(self):
+        """Drop the cached versions of the resources changed, after a commit."""
+        for resource_id in self._changed:
+            self._cache.invalidate(resource_id)
+        self._changed.clear()
 
     _update = _put
 
@@ -80,13 +186,24 @@ class SqlResourceRepository(SqlRepository, repository.ResourceRepository):
         self, resource_id: str, *, version: Optional[int] = None
     ) -> Optional[Resource]:
         self._check_has_session()
+        if resource_id not in self._changed:
+            self._cache.check_stamp(self._session)
+            resource = self._cache.get(resource_id, version or None)
+            if resource:
+                return resource
         query = self._session.query(ResourceDTO).filter_by(resource_id=resource_id)
         if version:
             query = query.filter_by(version=version)
         else:
             query = query.order_by(ResourceDTO.version.desc())
         resource_dto = query.first()
-        return resource_dto.to_entity() if resource_dto else None
+        if not resource_dto:
+            return None
+        resource = resource_dto.to_entity()
+        if resource_id in self._changed:
+            return resource
+        self._cache.add(resource, is_latest=not version)
+        return _copy_resource(resource)
 
     def resources_with_id(self, resource_id: str):
         pass
@@ -154,6 +271,29 @@ class SqlResourceRepository(SqlRepository, repository.ResourceRepository):
             if resource_dto is not None
         ]
 
+    def history_stamp(self) -> Optional[int]:
+        self._check_has_session()
+        return _history_stamp(self._session)
+
+    def put_reindex_job(self, job: model.ReindexJob):
+        self._check_has_session()
+        self._session.merge(sql_models.ReindexJobDTO.from_entity(job))
+
+    def reindex_job_by_id(self, job_id) -> Optional[model.ReindexJob]:
+        self._check_has_session()
+        job_dto = self._session.get(sql_models.ReindexJobDTO, job_id)
+        return job_dto.to_entity() if job_dto else None
+
+    def reindex_jobs(self, resource_id: Optional[str] = None) -> List[model.ReindexJob]:
+        self._check_has_session()
+        query = self._session.query(sql_models.ReindexJobDTO)
+        if resource_id:
+            query = query.filter_by(resource_id=resource_id)
+        return [
+            job_dto.to_entity()
+            for job_dto in query.order_by(sql_models.ReindexJobDTO.started_at)
+        ]
+
     def _resource_to_dict(self, resource: Resource) -> typing.Dict:
         return {
             "history_id": None,
@@ -1,6 +1,6 @@
 import enum
 import logging
-from typing import Dict
+from typing import Dict, Optional
 import typing
 
 import regex
@@ -8,13 +8,17 @@ import regex
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from karp.domain import errors, repository
+from karp.domain import errors, model, repository
 
 from karp.application import config
 
 from karp.services import unit_of_work
 from karp.infrastructure.sql.sql_entry_repository import SqlEntryRepository
-from karp.infrastructure.sql.sql_resource_repository import SqlResourceRepository
+from karp.infrastructure.sql.sql_outbox_repository import SqlOutboxRepository
+from karp.infrastructure.sql.sql_resource_repository import (
+    SqlResourceRepository,
+    get_resource_cache,
+)
 from .sql_index import SqlSearchService
 
 DUPLICATE_PROG = regex.compile(r"Duplicate entry '(.+)' for key '(\w+)'")
@@ -138,6 +142,32 @@ class SqlResourceUnitOfWork(SqlUnitOfWork, unit_of_work.ResourceUnitOfWork):
             raise RuntimeError("No resources")
         return self._resources
 
+    def _commit(self):
+        super()._commit()
+        if self._resources is not None:
+            self._resources.invalidate_changed()
+
+    def invalidate_cached(self, resource_id: str):
+        get_resource_cache(self.session_factory.kw["bind"]).invalidate(resource_id)
+
+
+class SqlOutboxUnitOfWork(SqlUnitOfWork, unit_of_work.OutboxUnitOfWork):
+    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+        super().__init__()
+        self.session_factory = session_factory
+        self._outbox = None
+
+    def __enter__(self):
+        self._session = self.session_factory()
+        self._outbox = SqlOutboxRepository(self._session)
+        return super().__enter__()
+
+    @property
+    def repo(self) -> SqlOutboxRepository:
+        if self._outbox is None:
+            raise RuntimeError("No outbox")
+        return self._outbox
+
 
 class SqlEntryUnitOfWork(
     SqlUnitOfWork,
@@ -150,20 +180,61 @@ class SqlEntryUnitOfWork(
         repo_settings: Dict,
         resource_config: typing.Dict,
         session_factory=DEFAULT_SESSION_FACTORY,
+        index_outbox: Optional[bool] = None,
     ):
         super().__init__()
         self.session_factory = session_factory
         self._entries = None
         self.repo_settings = repo_settings
         self.resource_config = resource_config
+        # Write the entry events to the index outbox when committing
+        self.index_outbox = (
+            config.INDEX_OUTBOX if index_outbox is None else index_outbox
+        )
+        self._outboxed = {}
+        self._create_tables()
+
+    def _create_tables(self):
+        # Provision the schema once, when the unit of work is created for the
+        # resource, so that entering it only checks out a session.
+        session = self.session_factory()
+        try:
+            SqlEntryRepository.create_tables(
+                self.repo_settings, self.resource_config, bind=session.bind
+            )
+        finally:
+            session.close()
 
     def __enter__(self):
         self._session = self.session_factory()
         self._entries = SqlEntryRepository.from_dict(
             self.repo_settings, self.resource_config, session=self._session
         )
+        self._outboxed = {}
         return super().__enter__()
 
+    def _commit(self):
+        if self.index_outbox and self._entries is not None:
+            self._entries.put_outbox_events(self._new_outbox_events())
+        super()._commit()
+
+    def _new_outbox_events(self) -> typing.Iterator[model.OutboxEvent]:
+        """The outbox events of the entry events not written to the outbox yet.
+
+        The entry events stay on the entries until they are collected after
+        the commit, so the ones already written by an earlier commit are
+        skipped.
+        """
+        for entry in self._entries.seen:
+            for evt in entry.events:
+                if id(evt) in self._outboxed:
+                    continue
+                # Keep the event so that its id isn't reused
+                self._outboxed[id(evt)] = evt
+                outbox_event = model.OutboxEvent.from_event(evt)
+                if outbox_event is not None:
+                    yield outbox_event
+
     @property
     def repo(self) -> SqlEntryRepository:
         if self._entries is None:
@@ -41,6 +41,7 @@ def bootstrap_app(container: typing.Optional[AppContainer] = None) -> AppContext
         config.ELASTICSEARCH_HOST
     )
     container.config.debug.from_value(config.DEBUG)
+    container.config.index_outbox.from_value(config.INDEX_OUTBOX)
     container.core.init_resources()
     bus = container.bus()
     bus.handle(events.AppStarted())  # needed? ?
@@ -88,6 +89,7 @@ def bootstrap(
     index_uow: unit_of_work.IndexUnitOfWork = None,
     entry_uow_factory: unit_of_work.EntryUowFactory = None,
     raise_on_all_errors: bool = False,
+    outbox_uow: unit_of_work.OutboxUnitOfWork = None,
 ) -> messagebus.MessageBus:
     setup_logging()
     load_infrastructure()
@@ -101,6 +103,8 @@ def bootstrap(
         entry_uow_factory = unit_of_work.DefaultEntryUowFactory()
     if index_uow is None:
         index_uow = unit_of_work.IndexUnitOfWork.create(config.SEARCH_CONTEXT)
+    if outbox_uow is None:
+        outbox_uow = sql_unit_of_work.SqlOutboxUnitOfWork()
     bus = messagebus.MessageBus(
         resource_uow=resource_uow,
         entry_uows=entry_uows,
@@ -108,6 +112,8 @@ def bootstrap(
         search_service_uow=index_uow,
         entry_uow_factory=entry_uow_factory,
         raise_on_all_errors=raise_on_all_errors,
+        index_outbox=config.INDEX_OUTBOX,
+        outbox_uow=outbox_uow,
     )
     bus.handle(events.AppStarted())  # needed? ?
     return bus
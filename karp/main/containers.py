@@ -37,6 +37,11 @@ class AppContainer(containers.DeclarativeContainer):
         session_factory=db.provided.session_factory,
     )
 
+    outbox_uow = providers.Singleton(
+        sql_unit_of_work.SqlOutboxUnitOfWork,
+        session_factory=db.provided.session_factory,
+    )
+
     entry_uows = providers.Singleton(unit_of_work.EntriesUnitOfWork)
 
     entry_uow_factory = providers.Singleton(unit_of_work.DefaultEntryUowFactory)
@@ -72,6 +77,8 @@ class AppContainer(containers.DeclarativeContainer):
         search_service_uow=search_service_uow.provided,
         entry_uow_factory=entry_uow_factory.provided,
         raise_on_all_errors=config.debug,
+        index_outbox=config.index_outbox,
+        outbox_uow=outbox_uow.provided,
     )
 
 #    jwt_authenticator = providers.Singleton(
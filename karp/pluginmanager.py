@@ -1,9 +1,160 @@
-import pkg_resources
+"""The plugins that compute virtual fields, from the `karp.plugins` entry points.
+
+A plugin is loaded and initialized the first time it is used. It computes a
+field with `apply_plugin_function(resource_id, version, entry)`, and can also
+compute the field of many entries at once with
+`apply_plugin_function_batch(resource_id, version, entries)`, returning the
+results in the order of entries.
+
+A plugin that sets `reads` to the names of the fields its result depends on
+has its results memoized, keyed by the values of those fields, so entries
+that agree on them are computed once. PLUGIN_CACHE_SIZE bounds the number of
+results kept, 0 turns the memoization off.
+"""
+import collections
+import hashlib
+import json
+import logging
+import threading
+import typing
+from typing import Any, Dict, List, Optional
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    from importlib_metadata import entry_points  # type: ignore
+
+from karp.application import config
+from karp.errors import PluginNotFoundError
+
+logger = logging.getLogger("karp")
+
+ENTRY_POINT_GROUP = "karp.plugins"
 
 plugins = {}
 
+_plugins_lock = threading.Lock()
+
 
 def init():
-    for entry_point in pkg_resources.iter_entry_points("karp.plugins"):
-        plugins[entry_point.name] = entry_point.load()
-        plugins[entry_point.name].init()
+    """Load all plugins at once, instead of when they are first used."""
+    for entry_point in _plugin_entry_points():
+        get_plugin(entry_point.name)
+
+
+def get_plugin(plugin_id: str, resource_id: Optional[str] = None):
+    """Return the plugin, loading and initializing it if it isn't yet."""
+    plugin = plugins.get(plugin_id)
+    if plugin is not None:
+        return plugin
+    with _plugins_lock:
+        if plugin_id not in plugins:
+            entry_point = next(
+                (ep for ep in _plugin_entry_points() if ep.name == plugin_id), None
+            )
+            if entry_point is None:
+                raise PluginNotFoundError(plugin_id, resource_id)
+            logger.info("Loading plugin: %s", plugin_id)
+            plugin = entry_point.load()
+            plugin.init()
+            plugins[plugin_id] = plugin
+    return plugins[plugin_id]
+
+
+def _plugin_entry_points():
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        return eps.select(group=ENTRY_POINT_GROUP)
+    return eps.get(ENTRY_POINT_GROUP, [])
+
+
+def apply_plugin_function(
+    plugin_id: str, resource_id: str, version: int, entry: Dict
+) -> Any:
+    return apply_plugin_function_batch(plugin_id, resource_id, version, [entry])[0]
+
+
+def apply_plugin_function_batch(
+    plugin_id: str, resource_id: str, version: int, entries: List[Dict]
+) -> List[Any]:
+    """Compute the field of plugin_id for each of entries.
+
+    Memoized results are reused, and the rest are computed with one call to
+    the batch function of the plugin, or one call per entry if it has none.
+    """
+    plugin = get_plugin(plugin_id, resource_id)
+    reads = getattr(plugin, "reads", None)
+    if reads is None or config.PLUGIN_CACHE_SIZE <= 0:
+        return _apply(plugin, resource_id, version, entries)
+
+    results: List[Any] = [None] * len(entries)
+    # The positions in entries of each key that isn't memoized
+    missing: Dict[tuple, List[int]] = collections.defaultdict(list)
+    for i, entry in enumerate(entries):
+        key = (plugin_id, resource_id, version, _fields_hash(entry, reads))
+        found, result = _cache.get(key)
+        if found:
+            results[i] = result
+        else:
+            missing[key].append(i)
+    if missing:
+        computed = _apply(
+            plugin,
+            resource_id,
+            version,
+            [entries[positions[0]] for positions in missing.values()],
+        )
+        for (key, positions), result in zip(missing.items(), computed):
+            _cache.put(key, result)
+            for i in positions:
+                results[i] = result
+    return results
+
+
+def _apply(plugin, resource_id: str, version: int, entries: List[Dict]) -> List[Any]:
+    batch_function = getattr(plugin, "apply_plugin_function_batch", None)
+    if batch_function is not None:
+        return list(batch_function(resource_id, version, entries))
+    return [
+        plugin.apply_plugin_function(resource_id, version, entry) for entry in entries
+    ]
+
+
+def _fields_hash(entry: Dict, field_names: typing.Iterable[str]) -> str:
+    fields = {field_name: entry.get(field_name) for field_name in field_names}
+    return hashlib.sha1(
+        json.dumps(fields, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class _ResultCache:
+    """The least recently used plugin results, at most PLUGIN_CACHE_SIZE."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: "collections.OrderedDict[tuple, Any]" = collections.OrderedDict()
+
+    def get(self, key: tuple) -> typing.Tuple[bool, Any]:
+        with self._lock:
+            if key not in self._results:
+                return False, None
+            self._results.move_to_end(key)
+            return True, self._results[key]
+
+    def put(self, key: tuple, result: Any):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > config.PLUGIN_CACHE_SIZE:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+_cache = _ResultCache()
+
+
+def clear_cache():
+    _cache.clear()
@@ -1,3 +1,4 @@
+import typing
 from typing import Dict
 
 # from functools import singledispatch
@@ -22,6 +23,8 @@ class Context:
         # auth_service: AuthService,
         index_uow: unit_of_work.IndexUnitOfWork,
         entry_uow_factory: unit_of_work.EntryUowFactory,
+        outbox_uow: typing.Optional[unit_of_work.OutboxUnitOfWork] = None,
+        index_outbox: bool = False,
     ):
         self.resource_uow = resource_uow
         self.entry_uows = entry_uows
@@ -30,6 +33,9 @@ class Context:
         # self.auth_service = auth_service
         self.index_uow = index_uow
         self.entry_uow_factory = entry_uow_factory
+        self.outbox_uow = outbox_uow
+        # The entry changes go to the index outbox, the index worker indexes them
+        self.index_outbox = index_outbox
 
     def __repr__(self):
         return f"Context()"
@@ -26,7 +26,7 @@ from karp.domain import commands, model, errors
 from karp.domain.models.entry import Entry
 
 from karp.utility import unique_id
-from . import context
+from . import context, entry_validators
 
 # from karp.domain.services import indexing
 
@@ -105,7 +105,7 @@ def add_entry(
         raise errors.MissingIdField(
             resource_id=cmd.resource_id, entry=cmd.entry
         ) from err
-    validate_entry = _compile_schema(resource.entry_json_schema)
+    validate_entry = entry_validators.get_validator(resource)
 
     with ctx.entry_uows.get(cmd.resource_id) as uw:
         try:
@@ -176,7 +176,7 @@ def update_entry(
 
     if not resource:
         raise errors.ResourceNotFound(cmd.resource_id)
-    schema = _compile_schema(resource.entry_json_schema)
+    schema = entry_validators.get_validator(resource)
     _validate_entry(schema, cmd.entry)
 
     with ctx.entry_uows.get(cmd.resource_id) as uw:
@@ -276,10 +276,11 @@ def add_entries(
     # resource = get_resource(resource_id, version=resource_version)
     # resource_conf = resource.config
 
-    validate_entry = _compile_schema(resource.entry_json_schema)
+    validate_entry = entry_validators.get_validator(resource)
 
     created_db_entries = []
     with ctx.entry_uows.get(cmd.resource_id) as uw:
+        chunk = []
         for entry_raw in cmd.entries:
             _validate_entry(validate_entry, entry_raw)
 
@@ -289,8 +290,13 @@ def add_entries(
                 message=cmd.message,
                 entity_id=unique_id.make_unique_id(),
             )
-            uw.entries.put(entry)
+            chunk.append(entry)
             created_db_entries.append(entry)
+            if len(chunk) >= cmd.chunk_size:
+                uw.entries.put_many(chunk)
+                chunk = []
+        if chunk:
+            uw.entries.put_many(chunk)
         uw.commit()
 
     # if resource.is_published:
@@ -489,12 +495,46 @@ def _src_entry_to_index_entry(resource: Resource, src_entry: Entry) -> Dict:
 #     return _src_entry_to_index_entry(resource, entry)
 
 
-def _compile_schema(json_schema):
-    try:
-        validate_entry = fastjsonschema.compile(json_schema)
-        return validate_entry
-    except fastjsonschema.JsonSchemaDefinitionException as e:
-        raise RuntimeError(e)
+def create_missing_indexes(cmd: commands.CreateMissingIndexes, ctx: context.Context):
+    if cmd.resource_id:
+        resource_ids = [cmd.resource_id]
+    else:
+        with ctx.resource_uow:
+            resource_ids = list(ctx.resource_uow.repo.resource_ids())
+
+    for resource_id in resource_ids:
+        with ctx.entry_uows.get(resource_id) as uw:
+            created = uw.repo.create_missing_indexes()
+        _logger.info(
+            "Created %d missing indexes for resource '%s': %s",
+            len(created),
+            resource_id,
+            created,
+        )
+
+
+def migrate_entry_body_storage(
+    cmd: commands.MigrateEntryBodyStorage, ctx: context.Context
+):
+    with ctx.entry_uows.get(cmd.resource_id) as uw:
+        stats = uw.repo.migrate_body_storage(
+            chunk_size=cmd.chunk_size, source_settings=cmd.source_settings
+        )
+        uw.commit()
+    if not stats.get("rows"):
+        _logger.info("No bodies to migrate for resource '%s'", cmd.resource_id)
+        return
+    _logger.info(
+        "Migrated %d bodies for resource '%s': %d -> %d bytes (%.1f%%), "
+        "decoding %.3f ms -> %.3f ms per body",
+        stats["rows"],
+        cmd.resource_id,
+        stats["size_before"],
+        stats["size_after"],
+        100.0 * stats["size_after"] / max(stats["size_before"], 1),
+        1000.0 * stats["read_seconds_before"] / stats["rows"],
+        1000.0 * stats["read_seconds_after"] / stats["rows"],
+    )
 
 
 def _validate_entry(schema, json_obj):
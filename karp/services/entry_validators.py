@@ -0,0 +1,82 @@
+"""Compiled json schema validators for entries, cached per resource version."""
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import fastjsonschema  # pyre-ignore
+
+from karp.application import config
+from karp.domain import model
+
+
+logger = logging.getLogger("karp")
+
+# Keyed by the resource's entity id and version
+_validators: Dict[Tuple[str, int], Callable[[Dict], Dict]] = {}
+
+
+def get_validator(resource: model.Resource) -> Callable[[Dict], Dict]:
+    """Return the entry validator of the resource, compiling it only once."""
+    key = (str(resource.id), resource.version)
+    validator = _validators.get(key)
+    if validator is None:
+        validator = compile_validator(resource.entry_json_schema)
+        _validators[key] = validator
+    return validator
+
+
+def warm(resource: model.Resource) -> None:
+    get_validator(resource)
+    logger.debug(
+        "Validator for resource '%s' version %d ready",
+        resource.resource_id,
+        resource.version,
+    )
+
+
+def clear() -> None:
+    _validators.clear()
+
+
+def compile_validator(
+    json_schema: Dict, cache_dir: Optional[Path] = None
+) -> Callable[[Dict], Dict]:
+    """Compile json_schema to a validator.
+
+    If a cache dir is given (default VALIDATOR_CACHE_DIR) the generated source
+    is stored there as a module named by the hash of the schema, and loaded
+    from there when present. Python keeps the bytecode of such modules, so
+    other workers skip both generating and compiling the source.
+    """
+    if cache_dir is None:
+        cache_dir = config.VALIDATOR_CACHE_DIR
+    try:
+        if not cache_dir:
+            return fastjsonschema.compile(json_schema)
+        return _load_or_generate(json_schema, Path(cache_dir))
+    except fastjsonschema.JsonSchemaDefinitionException as e:
+        raise RuntimeError(e)
+
+
+def _load_or_generate(json_schema: Dict, cache_dir: Path) -> Callable[[Dict], Dict]:
+    schema_hash = hashlib.sha256(
+        json.dumps([fastjsonschema.VERSION, json_schema], sort_keys=True).encode(
+            "utf-8"
+        )
+    ).hexdigest()
+    module_name = f"karp_validator_{schema_hash[:32]}"
+    path = cache_dir / f"{module_name}.py"
+    if not path.exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(fastjsonschema.compile_to_code(json_schema))
+        os.replace(tmp_path, path)
+        logger.info("Wrote validator source to '%s'", path)
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.validate
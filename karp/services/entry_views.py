@@ -56,6 +56,14 @@ class EntryHistoryRequest(pydantic.BaseModel):
     to_version: typing.Optional[int] = None
     current_page: int = 0
     page_size: int = 100
+    cursor: typing.Optional[int] = None
+    with_total: typing.Optional[bool] = None
+
+
+class EntryHistoryResponse(pydantic.BaseModel):
+    history: typing.List[typing.Dict]
+    total: typing.Optional[int]
+    next_cursor: typing.Optional[int]
 
 
 def get_history(
@@ -74,8 +82,14 @@ def get_history(
     # with unit_of_work(using=ctx.resource_repo) as uw:
     #     resource = uw.get_active_resource(resource_id)
 
+    # Counting is the expensive part on big history tables, so when paging
+    # with a cursor the total is only computed if explicitly asked for.
+    with_total = history_request.with_total
+    if with_total is None:
+        with_total = history_request.cursor is None
+
     with ctx.entry_uows.get_uow(resource_id) as uw:
-        paged_query, total = uw.repo.get_history(
+        paged_query, total, next_cursor = uw.repo.get_history_with_diffs(
             entry_id=history_request.entry_id,
             user_id=history_request.user_id,
             from_date=history_request.from_date,
@@ -84,10 +98,12 @@ def get_history(
             to_version=history_request.to_version,
             offset=history_request.current_page * history_request.page_size,
             limit=history_request.page_size,
+            cursor=history_request.cursor,
+            with_total=with_total,
         )
     result = []
     previous_body = {}
-    for history_entry in paged_query:
+    for history_entry, history_diff in paged_query:
         # TODO fix this, we should get the diff in another way, probably store the diffs directly in the database
         # entry_version = history_entry.version
         # if entry_version > 1:
@@ -97,7 +113,8 @@ def get_history(
         #     previous_body = previous_entry.body
         # else:
         #     previous_body = {}
-        history_diff = jsondiff.compare(previous_body, history_entry.body)
+        if history_diff is None:
+            history_diff = jsondiff.compare(previous_body, history_entry.body)
         result.append(
             {
                 "timestamp": history_entry.last_modified,
@@ -111,7 +128,7 @@ def get_history(
         )
         previous_body = history_entry.body
 
-    return result, total
+    return EntryHistoryResponse(history=result, total=total, next_cursor=next_cursor)
 
 
 class EntryDiffRequest(pydantic.BaseModel):
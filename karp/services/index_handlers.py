@@ -4,9 +4,11 @@ from karp.services import context
 # from karp.infrastructure.unit_of_work import unit_of_work
 import sys
 import typing
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Set, Tuple, Optional
 import collections
+import itertools
 import logging
+import time
 
 from karp.domain import events, model, errors, index, commands
 from karp.domain.models.entry import Entry, create_entry
@@ -14,7 +16,14 @@ from karp.domain.models.resource import Resource
 from karp.domain.repository import ResourceRepository
 from karp.domain.index import IndexEntry, Index
 
-from karp.services import context, network_handlers
+from karp.application import config
+from karp.utility.time import utc_now
+from karp.services import (
+    context,
+    network_handlers,
+    reindex_pipeline,
+    transform_plan,
+)
 
 # from karp.domain.services import network
 
@@ -50,6 +59,8 @@ logger = logging.getLogger("karp")
 def pre_process_resource(
     resource_id: str,
     ctx: context.Context,
+    *,
+    chunk_size: int = 1000,
 ) -> typing.Iterable[IndexEntry]:
     with ctx.resource_uow as uw:
         resource = uw.repo.by_resource_id(resource_id)
@@ -57,8 +68,12 @@ def pre_process_resource(
             raise errors.ResourceNotFound(resource_id=resource_id)
 
     with ctx.entry_uows.get(resource_id) as uw:
-        for entry in uw.repo.all_entries():
-            yield transform_to_index_entry(resource, entry, ctx)
+        entries = uw.repo.iter_entries(chunk_size=chunk_size)
+        while True:
+            batch = list(itertools.islice(entries, chunk_size))
+            if not batch:
+                break
+            yield from transform_to_index_entries(resource, batch, ctx)
 
     # metadata = resourcemgr.get_all_metadata(resource_obj)
     # fields = resource_obj.config["fields"].items()
@@ -101,17 +116,403 @@ def pre_process_resource(
 
 
 def reindex_resource(cmd: commands.ReindexResource, ctx: context.Context):
+    """Build a new index of the resource in a reindex job, then switch to it.
+
+    Writes keep going to the current index while the new one is built, with
+    `cmd.workers` processes transforming the entries.
+    """
     logger.debug("Reindexing resource '%s'", cmd.resource_id)
     with ctx.resource_uow as resource_uw:
         resource = resource_uw.resources.by_resource_id(cmd.resource_id)
         if not resource:
             raise errors.ResourceNotFound(resource_id=cmd.resource_id)
+    if cmd.workers < 1:
+        raise errors.ConfigurationError(
+            f"workers must be at least 1, got {cmd.workers}"
+        )
+    job = _start_reindex_job(
+        resource, ctx, chunk_size=cmd.chunk_size, workers=cmd.workers
+    )
+    _run_reindex_job(job, resource, ctx)
+
+
+def resume_reindex_job(cmd: commands.ResumeReindexJob, ctx: context.Context):
+    with ctx.resource_uow as resource_uw:
+        job = _get_reindex_job(cmd.job_id, ctx)
+        if not job.is_resumable:
+            raise errors.ReindexJobNotResumable(job.id, job.status.value)
+        resource = resource_uw.repo.by_resource_id(job.resource_id)
+        if not resource:
+            raise errors.ResourceNotFound(resource_id=job.resource_id)
+    if cmd.workers is not None:
+        job.workers = cmd.workers
+    logger.info(
+        "Resuming reindex job %s of '%s' after entry %r with %d workers",
+        job.id,
+        job.resource_id,
+        job.last_entry_id,
+        job.workers,
+    )
+    job.set_status(model.ReindexJobStatus.RUNNING)
+    _save_reindex_job(job, ctx)
+    _run_reindex_job(job, resource, ctx)
+
+
+def abandon_reindex_job(cmd: commands.AbandonReindexJob, ctx: context.Context):
+    with ctx.resource_uow:
+        job = _get_reindex_job(cmd.job_id, ctx)
+    if not job.is_resumable:
+        raise errors.ReindexJobNotResumable(job.id, job.status.value)
     with ctx.index_uow as index_uw:
-        index_uw.repo.create_index(cmd.resource_id, resource.config)
+        index_uw.repo.delete_index(job.resource_id, job.index_name)
+        index_uw.commit()
+    job.set_status(model.ReindexJobStatus.ABANDONED)
+    _save_reindex_job(job, ctx)
+    logger.info("Abandoned reindex job %s of '%s'", job.id, job.resource_id)
+
+
+def _start_reindex_job(
+    resource: model.Resource, ctx: context.Context, *, chunk_size: int, workers: int
+) -> model.ReindexJob:
+    resource_id = resource.resource_id
+    with ctx.entry_uows.get(resource_id) as entries_uw:
+        mark = entries_uw.repo.history_high_water_mark()
+    with ctx.index_uow as index_uw:
+        index_name = index_uw.repo.create_index(
+            resource_id, resource.config, make_current=False
+        )
+        index_uw.commit()
+    job = model.ReindexJob(
+        resource_id=resource_id,
+        index_name=index_name,
+        history_mark=mark,
+        chunk_size=chunk_size,
+        workers=workers,
+    )
+    _save_reindex_job(job, ctx)
+    logger.info(
+        "Started reindex job %s building '%s' for '%s' from history id %d",
+        job.id,
+        index_name,
+        resource_id,
+        mark,
+    )
+    return job
+
+
+def _run_reindex_job(
+    job: model.ReindexJob,
+    resource: model.Resource,
+    ctx: context.Context,
+):
+    """Build the index of job while writes keep going to the current index.
+
+    The entries that failed in an earlier run are retried, and the entries
+    after the checkpoint of the job are loaded, by `job.workers` processes.
+    Afterwards the entries changed since the history mark of the job are
+    replayed to the new index until no more changes come in. Then the alias
+    and the config pointer are switched to the new index, and the writes made
+    during the switch are replayed.
+    """
+    resource_id = resource.resource_id
+    try:
+        with ctx.index_uow as index_uw:
+            _retry_failed_entries(job, resource, ctx, index_uw)
+            if job.workers > 1:
+                _load_reindex_job_with_workers(job, resource, ctx)
+            else:
+                _load_reindex_job(job, resource, ctx, index_uw)
+            mark = job.history_mark
+            if job.failed_entry_ids:
+                raise errors.IndexingFailed(resource_id, job.failed_entry_ids)
+            while True:
+                new_mark = _replay_changes(
+                    resource, ctx, index_uw, job.index_name, mark
+                )
+                if new_mark == mark:
+                    break
+                mark = new_mark
+            # Processes that looked up the current index before the job
+            # started may use it for a while, the others look it up per write
+            wait = index_uw.repo.index_name_max_age() - (utc_now() - job.started_at)
+            if wait > 0:
+                time.sleep(wait)
+            index_uw.repo.switch_index(resource_id, job.index_name)
+            _replay_changes(resource, ctx, index_uw, job.index_name, mark)
+            index_uw.commit()
+    except Exception:
+        job.set_status(model.ReindexJobStatus.FAILED)
+        _save_reindex_job(job, ctx)
+        raise
+    job.set_status(model.ReindexJobStatus.FINISHED)
+    _save_reindex_job(job, ctx)
+
+
+def _retry_failed_entries(
+    job: model.ReindexJob, resource: model.Resource, ctx: context.Context, index_uw
+):
+    if not job.failed_entry_ids:
+        return
+    with ctx.entry_uows.get(job.resource_id) as entries_uw:
+        retried = list(entries_uw.repo.by_entry_ids(job.failed_entry_ids).values())
+    logger.info(
+        "Retrying %d entries that failed to index in job %s",
+        len(job.failed_entry_ids),
+        job.id,
+    )
+    job.failed_entry_ids = []
+    _add_job_entries(job, resource, retried, ctx, index_uw)
+    _save_reindex_job(job, ctx)
+
+
+def _load_reindex_job(
+    job: model.ReindexJob, resource: model.Resource, ctx: context.Context, index_uw
+):
+    """Load the entries after the checkpoint of job into its index."""
+    with ctx.entry_uows.get(job.resource_id) as entries_uw:
+        entries = entries_uw.repo.iter_entries(
+            chunk_size=job.chunk_size, after_entry_id=job.last_entry_id
+        )
+        while True:
+            batch = list(itertools.islice(entries, job.chunk_size))
+            if not batch:
+                break
+            _add_job_entries(job, resource, batch, ctx, index_uw)
+            job.checkpoint(batch[-1].entry_id, len(batch))
+            _save_reindex_job(job, ctx)
+
+
+def _load_reindex_job_with_workers(
+    job: model.ReindexJob, resource: model.Resource, ctx: context.Context
+):
+    """Load the entries after the checkpoint of job with a pool of workers.
+
+    The workers finish chunks out of order, the job is checkpointed after
+    each chunk that all chunks before it are indexed.
+    """
+
+    def checkpoint(last_entry_id: str, num_entries: int, failed_entry_ids):
+        job.record_failures(failed_entry_ids)
+        job.checkpoint(last_entry_id, num_entries)
+        _save_reindex_job(job, ctx)
+
+    report = reindex_pipeline.reindex_resource(
+        resource,
+        ctx,
+        workers=job.workers,
+        chunk_size=job.chunk_size,
+        index_name=job.index_name,
+        after_entry_id=job.last_entry_id,
+        on_chunk_indexed=checkpoint,
+    )
+    logger.info(
+        "Indexed %d entries of '%s' with %d workers in %.1fs (%.0f entries/s)",
+        report["entries"],
+        job.resource_id,
+        job.workers,
+        report["seconds"],
+        report["entries_per_second"],
+    )
+
+
+def _add_job_entries(
+    job: model.ReindexJob,
+    resource: model.Resource,
+    entries: List[model.Entry],
+    ctx: context.Context,
+    index_uw,
+):
+    try:
         index_uw.repo.add_entries(
-            cmd.resource_id, pre_process_resource(cmd.resource_id, ctx)
+            job.resource_id,
+            transform_to_index_entries(resource, entries, ctx),
+            refresh=False,
+            index_name=job.index_name,
         )
+    except errors.IndexingFailed as err:
+        job.record_failures(err.entry_ids)
+
+
+def _get_reindex_job(job_id, ctx: context.Context) -> model.ReindexJob:
+    job = ctx.resource_uow.repo.reindex_job_by_id(job_id)
+    if not job:
+        raise errors.ReindexJobNotFound(job_id)
+    return job
+
+
+def _save_reindex_job(job: model.ReindexJob, ctx: context.Context):
+    with ctx.resource_uow as resource_uw:
+        resource_uw.repo.put_reindex_job(job)
+        resource_uw.commit()
+
+
+def reindex_changed_entries(
+    cmd: commands.ReindexChangedEntries, ctx: context.Context
+) -> int:
+    """Apply the changes since a history id or timestamp to the current index.
+
+    Returns the history id to use as mark for the next incremental reindex.
+    """
+    with ctx.resource_uow as resource_uw:
+        resource = resource_uw.repo.by_resource_id(cmd.resource_id)
+        if not resource:
+            raise errors.ResourceNotFound(resource_id=cmd.resource_id)
+    mark = cmd.since_history_id
+    if mark is None:
+        with ctx.entry_uows.get(cmd.resource_id) as entries_uw:
+            mark = entries_uw.repo.history_id_before(cmd.since_timestamp)
+    with ctx.index_uow as index_uw:
+        new_mark = _replay_changes(resource, ctx, index_uw, None, mark)
         index_uw.commit()
+    logger.info(
+        "Reindexed the changes of '%s' from history id %d to %d",
+        cmd.resource_id,
+        mark,
+        new_mark,
+    )
+    return new_mark
+
+
+def index_outbox_events(cmd: commands.IndexOutboxEvents, ctx: context.Context) -> int:
+    """Index the entries of the oldest events in the index outbox.
+
+    The events are removed from the outbox after the index is updated, so each
+    change is indexed at least once. The events of entries that the index
+    rejects are logged and removed as well. An entry with several events in the batch
+    is indexed once, in its current version. The entries related to it are
+    reindexed too, unless all its events are references only.
+
+    Returns the number of events handled, 0 when the outbox is empty.
+    """
+    if ctx.outbox_uow is None:
+        raise errors.ConfigurationError("No index outbox to index events from")
+    with ctx.outbox_uow as outbox_uw:
+        outbox_events = outbox_uw.repo.outbox_events(cmd.batch_size)
+    if not outbox_events:
+        return 0
+    # The last event of an entry decides whether it is indexed or deleted,
+    # None for the entries with only events that are references only
+    last_ops: Dict[str, Dict[str, Optional[model.EntryOp]]] = collections.defaultdict(
+        dict
+    )
+    for outbox_event in outbox_events:
+        ops = last_ops[outbox_event.resource_id]
+        if outbox_event.references_only:
+            ops.setdefault(outbox_event.entry_id, None)
+        else:
+            ops[outbox_event.entry_id] = outbox_event.op
+    for resource_id, ops in last_ops.items():
+        _index_outbox_entries(resource_id, ops, ctx)
+    with ctx.outbox_uow as outbox_uw:
+        outbox_uw.repo.delete_outbox_events(
+            outbox_event.id for outbox_event in outbox_events
+        )
+        outbox_uw.commit()
+    logger.info(
+        "Indexed %d outbox events of %d entries",
+        len(outbox_events),
+        sum(len(ops) for ops in last_ops.values()),
+    )
+    return len(outbox_events)
+
+
+def _index_outbox_entries(
+    resource_id: str, ops: Dict[str, Optional[model.EntryOp]], ctx: context.Context
+):
+    with ctx.resource_uow as resource_uw:
+        resource = resource_uw.repo.by_resource_id(resource_id)
+    if not resource:
+        logger.warning(
+            "Dropping %d outbox events of missing resource '%s'", len(ops), resource_id
+        )
+        return
+    with ctx.entry_uows.get(resource_id) as entries_uw:
+        entries = entries_uw.repo.by_entry_ids(list(ops))
+        entries_uw.commit()
+    deleted = [entry_id for entry_id, op in ops.items() if op == model.EntryOp.DELETED]
+    changed = [
+        entry
+        for entry_id, entry in entries.items()
+        if ops[entry_id] != model.EntryOp.DELETED
+    ]
+    with ctx.index_uow:
+        for entry_id in deleted:
+            ctx.index_uow.repo.delete_entry(resource_id, entry_id=entry_id)
+        rejected: Set[str] = set()
+        if changed:
+            try:
+                with ctx.resource_uow:
+                    index_entries = transform_to_index_entries(resource, changed, ctx)
+                ctx.index_uow.repo.add_entries(resource_id, index_entries)
+            except errors.IndexingFailed as err:
+                # The index rejects the entries themselves, retrying won't help
+                logger.error("Dropping outbox events: %s", err)
+                rejected = set(err.entry_ids)
+        related = [
+            entry
+            for entry in changed
+            if entry.entry_id not in rejected and ops[entry.entry_id] is not None
+        ] + [entries[entry_id] for entry_id in deleted if entry_id in entries]
+        if related:
+            try:
+                _update_references(resource, related, ctx)
+            except errors.IndexingFailed as err:
+                logger.error("Failed to reindex related entries: %s", err)
+        ctx.index_uow.commit()
+
+
+def _replay_changes(
+    resource: model.Resource,
+    ctx: context.Context,
+    index_uw,
+    index_name: Optional[str],
+    mark: int,
+) -> int:
+    """Apply the changes after history id mark to the index, return the new mark.
+
+    The changes go to index_name, or to the current index of the resource.
+    Each entry is indexed once in its latest version.
+    """
+    resource_id = resource.resource_id
+    with ctx.entry_uows.get(resource_id) as entries_uw:
+        new_mark = entries_uw.repo.history_high_water_mark()
+        if new_mark == mark:
+            return mark
+        entries, discarded_entry_ids = entries_uw.repo.changes_since(mark)
+    logger.info(
+        "Replaying %d changed and %d discarded entries of '%s' to '%s'",
+        len(entries),
+        len(discarded_entry_ids),
+        resource_id,
+        index_name or "the current index",
+    )
+    # The entries referring to a changed entry are reindexed as well, entries
+    # of other resources are kept up to date in their current indices
+    to_index = {}
+    with ctx.entry_uows.get(resource_id) as entries_uw:
+        # The discarded entries are fetched in their last version
+        discarded_entries = entries_uw.repo.by_entry_ids(discarded_entry_ids)
+    with ctx.resource_uow:
+        for field_ref in network_handlers.get_referenced_entries_many(
+            resource, entries + list(discarded_entries.values()), ctx
+        ):
+            if field_ref["resource_id"] == resource_id:
+                to_index[field_ref["entry"].entry_id] = field_ref["entry"]
+    for entry_id in discarded_entry_ids:
+        to_index.pop(entry_id, None)
+    to_index.update((entry.entry_id, entry) for entry in entries)
+    if to_index:
+        index_uw.repo.add_entries(
+            resource_id,
+            transform_to_index_entries(resource, list(to_index.values()), ctx),
+            refresh=index_name is None,
+            index_name=index_name,
+        )
+    for entry_id in discarded_entry_ids:
+        index_uw.repo.delete_entry(
+            resource_id, entry_id=entry_id, index_name=index_name
+        )
+    return new_mark
 
 
 def reindex(
@@ -233,7 +634,7 @@ def add_entries(
                 raise errors.ResourceNotFound(resource_id)
             ctx.index_uow.repo.add_entries(
                 index_name,
-                [transform_to_index_entry(resource, entry, ctx) for entry in entries],
+                transform_to_index_entries(resource, entries, ctx),
             )
             if update_refs:
                 _update_references(resource, entries, ctx)
@@ -266,31 +667,80 @@ def _update_references(
     entries: List[Entry],
     ctx: context.Context,
 ) -> None:
-    add = collections.defaultdict(list)
+    """Reindex the entries that refer to, or are referred to by, entries.
+
+    Each related entry is reindexed once however many of entries it is related
+    to, the entries of each resource are transformed as one batch and added
+    with one bulk request. See INDEX_REFERENCE_FANOUT_LIMIT for large batches.
+    """
+    ref_resources = {}
+    ref_entries = collections.defaultdict(list)
     with ctx.resource_uow:
-        for src_entry in entries:
-            refs = network_handlers.get_referenced_entries(
-                resource, None, src_entry.entry_id, ctx
-            )
-            for field_ref in refs:
-                ref_resource_id = field_ref["resource_id"]
-                ref_resource = ctx.resource_uow.repo.by_resource_id(
-                    ref_resource_id, version=(field_ref["resource_version"])
+        for field_ref in network_handlers.get_referenced_entries_many(
+            resource, entries, ctx
+        ):
+            key = (field_ref["resource_id"], field_ref["resource_version"])
+            if key not in ref_resources:
+                ref_resources[key] = ctx.resource_uow.repo.by_resource_id(
+                    key[0], version=key[1]
                 )
-                if ref_resource:
-                    ref_index_entry = transform_to_index_entry(
-                        # resource_repo,
-                        # indexer,
-                        ref_resource,
-                        field_ref["entry"],
-                        # ref_resource.config["fields"].items(),
+            if ref_resources[key]:
+                ref_entries[key].append(field_ref["entry"])
+        limit = config.INDEX_REFERENCE_FANOUT_LIMIT
+        if limit and ctx.index_outbox and ctx.outbox_uow is not None:
+            ref_entries = _defer_references(ref_entries, limit, ctx)
+            limit = 0
+        for (ref_resource_id, ref_version), batch in ref_entries.items():
+            chunk_size = limit or len(batch)
+            for start in range(0, len(batch), chunk_size):
+                ctx.index_uow.repo.add_entries(
+                    ref_resource_id,
+                    transform_to_index_entries(
+                        ref_resources[(ref_resource_id, ref_version)],
+                        batch[start : start + chunk_size],
                         ctx,
-                    )
-                    # metadata = resourcemgr.get_metadata(ref_resource, field_ref["id"])
-                    add[ref_resource_id].append(ref_index_entry)
+                    ),
+                )
 
-    for ref_resource_id, ref_entries in add.items():
-        ctx.index_uow.repo.add_entries(ref_resource_id, ref_entries)
+
+def _defer_references(
+    ref_entries: Dict[Tuple[str, int], List[Entry]],
+    limit: int,
+    ctx: context.Context,
+) -> Dict[Tuple[str, int], List[Entry]]:
+    """Return the first limit of ref_entries and put the rest in the outbox.
+
+    The entries are put in the outbox as references only, so the index worker
+    doesn't reindex their related entries in turn, and entries that already
+    have events in the outbox are left to those.
+    """
+    kept = {}
+    num_deferred = 0
+    for (ref_resource_id, ref_version), batch in ref_entries.items():
+        kept[(ref_resource_id, ref_version)] = batch[:limit]
+        deferred = batch[limit:]
+        limit -= len(batch) - len(deferred)
+        if not deferred:
+            continue
+        with ctx.outbox_uow as outbox_uw:
+            pending = outbox_uw.repo.pending_entry_ids(
+                ref_resource_id, (entry.entry_id for entry in deferred)
+            )
+            deferred = [entry for entry in deferred if entry.entry_id not in pending]
+            outbox_uw.repo.put_outbox_events(
+                model.OutboxEvent(
+                    resource_id=ref_resource_id,
+                    entry_id=entry.entry_id,
+                    op=model.EntryOp.UPDATED,
+                    references_only=True,
+                )
+                for entry in deferred
+            )
+            outbox_uw.commit()
+        num_deferred += len(deferred)
+    if num_deferred:
+        logger.info("Left %d related entries to the index worker", num_deferred)
+    return {key: batch for key, batch in kept.items() if batch}
 
 
 def transform_to_index_entry(
@@ -300,220 +750,56 @@ def transform_to_index_entry(
     resource: model.Resource,
     src_entry: model.Entry,
     ctx: context.Context,
+    *,
+    prefetched: Optional[transform_plan.PrefetchedRefs] = None,
 ) -> index.IndexEntry:
     """
-    TODO This is very slow (for resources with references) because of db-lookups everywhere in the code
-    TODO We can pre-fetch the needed entries (same code that only looks for refs?) or
-    TODO somehow get the needed entries in bulk after transforming some entries and insert them into
-    TODO the transformed entries afterward. Very tricky.
+    Referenced entries are looked up one field at a time unless they are
+    prefetched, use `transform_to_index_entries` for more than one entry.
+    The fields are transformed by the compiled plan of the resource version.
     """
-    print(f"transforming entry_id={src_entry.entry_id}")
-    index_entry = ctx.index_uow.repo.create_empty_object()
-    index_entry.id = src_entry.entry_id
-    ctx.index_uow.repo.assign_field(index_entry, "_entry_version", src_entry.version)
-    ctx.index_uow.repo.assign_field(
-        index_entry, "_last_modified", src_entry.last_modified
-    )
-    ctx.index_uow.repo.assign_field(
-        index_entry, "_last_modified_by", src_entry.last_modified_by
-    )
-    _transform_to_index_entry(
+    return _transform_with_plan(
+        transform_plan.get_plan(resource),
         resource,
-        # resource_repo,
-        # indexer,
-        src_entry.body,
-        index_entry,
-        resource.config["fields"].items(),
-        ctx,
+        src_entry,
+        transform_plan.TransformEnv(ctx, prefetched),
     )
-    return index_entry
-
 
-def _evaluate_function(
-    # resource_repo: ResourceRepository,
-    # indexer: Index,
-    function_conf: typing.Dict,
-    src_entry: typing.Dict,
-    src_resource: model.Resource,
-    ctx: context.Context,
-):
-    print(f"indexing._evaluate_function src_resource={src_resource.resource_id}")
-    print(f"indexing._evaluate_function src_entry={src_entry}")
-    if "multi_ref" in function_conf:
-        function_conf = function_conf["multi_ref"]
-        target_field = function_conf["field"]
-        if "resource_id" in function_conf:
-            print(
-                f"indexing._evaluate_function: trying to find '{function_conf['resource_id']}'"
-            )
-            target_resource = ctx.resource_uow.repo.by_resource_id(
-                function_conf["resource_id"], version=function_conf["resource_version"]
-            )
-            if target_resource is None:
-                logger.warning(
-                    "Didn't find the resource with resource_id='%s'",
-                    function_conf["resource_id"],
-                )
-                return ctx.index_uow.repo.create_empty_list()
-        else:
-            target_resource = src_resource
-        print(
-            f"indexing._evaluate_function target_resource={target_resource.resource_id}"
-        )
-        if "test" in function_conf:
-            operator, args = list(function_conf["test"].items())[0]
-            if operator in ["equals", "contains"]:
-                filters = {"discarded": False}
-                for arg in args:
-                    if "self" in arg:
-                        filters[target_field] = src_entry[arg["self"]]
-                    else:
-                        raise NotImplementedError()
-                # target_entries = entryread.get_entries_by_column(
-                #     target_resource, filters
-                # )
-                with ctx.entry_uows.get(
-                    target_resource.resource_id
-                ) as target_entries_uw:
-                    target_entries = target_entries_uw.repo.by_referenceable(filters)
-            else:
-                raise NotImplementedError()
-        else:
-            raise NotImplementedError()
-
-        res = ctx.index_uow.repo.create_empty_list()
-        for entry in target_entries:
-            index_entry = ctx.index_uow.repo.create_empty_object()
-            list_of_sub_fields = (("tmp", function_conf["result"]),)
-            _transform_to_index_entry(
-                target_resource,
-                # resource_repo,
-                # indexer,
-                {"tmp": entry.body},
-                index_entry,
-                list_of_sub_fields,
-                ctx,
-            )
-            ctx.index_uow.repo.add_to_list_field(res, index_entry.entry["tmp"])
-    elif "plugin" in function_conf:
-        plugin_id = function_conf["plugin"]
-        import karp.pluginmanager as plugins
 
-        res = plugins.plugins[plugin_id].apply_plugin_function(
-            src_resource.id, src_resource.version, src_entry
-        )
-    else:
-        raise NotImplementedError()
-    return res
-
-
-def _transform_to_index_entry(
+def transform_to_index_entries(
     resource: model.Resource,
-    # resource_repo: ResourceRepository,
-    # indexer: Index,
-    _src_entry: typing.Dict,
-    _index_entry: index.IndexEntry,
-    fields,
+    src_entries: typing.Sequence[model.Entry],
     ctx: context.Context,
-):
-    for field_name, field_conf in fields:
-        if field_conf.get("virtual"):
-            print("found virtual field")
-            res = _evaluate_function(field_conf["function"], _src_entry, resource, ctx)
-            print(f"res = {res}")
-            if res:
-                ctx.index_uow.repo.assign_field(_index_entry, "v_" + field_name, res)
-        elif field_conf.get("ref"):
-            ref_field = field_conf["ref"]
-            if ref_field.get("resource_id"):
-                ref_resource = ctx.resource_uow.repo.by_resource_id(
-                    ref_field["resource_id"], version=ref_field["resource_version"]
-                )
-                # if not ref_resource:
-                #     raise errors.ResourceNotFoundError(
-                #         ref_field["resource_id"], ref_field["resource_version"]
-                #     )
-                if ref_field["field"].get("collection"):
-                    ref_objs = []
-                    if ref_resource:
-                        for ref_id in _src_entry[field_name]:
-                            with ctx.entry_uows.get(
-                                ref_resource.resource_id
-                            ) as ref_resource_entries_uw:
-                                ref_entry_body = (
-                                    ref_resource_entries_uw.repo.by_entry_id(
-                                        str(ref_id)
-                                    )
-                                )
-                                ref_resource_entries_uw.commit()
-                            if ref_entry_body:
-                                ref_entry = {field_name: ref_entry_body.body}
-                                ref_index_entry = (
-                                    ctx.index_uow.repo.create_empty_object()
-                                )
-                                list_of_sub_fields = ((field_name, ref_field["field"]),)
-                                _transform_to_index_entry(
-                                    resource,
-                                    # resource_repo,
-                                    # indexer,
-                                    ref_entry,
-                                    ref_index_entry,
-                                    list_of_sub_fields,
-                                    ctx,
-                                )
-                                ref_objs.append(ref_index_entry.entry[field_name])
-                    ctx.index_uow.repo.assign_field(
-                        _index_entry, "v_" + field_name, ref_objs
-                    )
-                else:
-                    raise NotImplementedError()
-            else:
-                ref_id = _src_entry.get(field_name)
-                if not ref_id:
-                    continue
-                if not ref_field["field"].get("collection", False):
-                    ref_id = [ref_id]
-
-                for elem in ref_id:
-                    with ctx.entry_uows.get(
-                        resource.resource_id
-                    ) as resource_entries_uw:
-                        ref = resource_entries_uw.repo.by_entry_id(str(elem))
-                        resource_entries_uw.commit()
-                    if ref:
-                        ref_entry = {field_name: ref.body}
-                        ref_index_entry = ctx.index_uow.repo.create_empty_object()
-                        list_of_sub_fields = ((field_name, ref_field["field"]),)
-                        _transform_to_index_entry(
-                            resource,
-                            # resource_repo,
-                            # indexer,
-                            ref_entry,
-                            ref_index_entry,
-                            list_of_sub_fields,
-                            ctx,
-                        )
-                        ctx.index_uow.repo.assign_field(
-                            _index_entry,
-                            "v_" + field_name,
-                            ref_index_entry.entry[field_name],
-                        )
-
-        if field_conf["type"] == "object":
-            print("found field with type 'object'")
-            field_content = ctx.index_uow.repo.create_empty_object()
-            if field_name in _src_entry:
-                _transform_to_index_entry(
-                    resource,
-                    # resource_repo,
-                    # indexer,
-                    _src_entry[field_name],
-                    field_content,
-                    field_conf["fields"].items(),
-                    ctx,
-                )
-        else:
-            field_content = _src_entry.get(field_name)
+) -> List[index.IndexEntry]:
+    """Transform a batch of entries, fetching the entries they refer to up front.
 
-        if field_content:
-            ctx.index_uow.repo.assign_field(_index_entry, field_name, field_content)
+    The refs, collection refs and multi_refs of the whole batch are collected
+    first and fetched with one query per target resource (and field), so the
+    number of queries doesn't grow with the number of references.
+    """
+    plan = transform_plan.get_plan(resource)
+    env = transform_plan.TransformEnv(ctx, transform_plan.PrefetchedRefs())
+    for src_entry in src_entries:
+        plan.collect(resource, src_entry.body, env)
+    env.prefetched.fetch(ctx)
+    return [
+        _transform_with_plan(plan, resource, src_entry, env)
+        for src_entry in src_entries
+    ]
+
+
+def _transform_with_plan(
+    plan: transform_plan.TransformPlan,
+    resource: model.Resource,
+    src_entry: model.Entry,
+    env: transform_plan.TransformEnv,
+) -> index.IndexEntry:
+    index_entry = env.index_repo.create_empty_object()
+    index_entry.id = src_entry.entry_id
+    env.index_repo.assign_field(index_entry, "_entry_version", src_entry.version)
+    env.index_repo.assign_field(index_entry, "_last_modified", src_entry.last_modified)
+    env.index_repo.assign_field(
+        index_entry, "_last_modified_by", src_entry.last_modified_by
+    )
+    plan.apply(resource, src_entry.body, index_entry, env)
+    return index_entry
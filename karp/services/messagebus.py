@@ -9,6 +9,7 @@ from karp.services import (
     resource_handlers,
     index_handlers,
     infrastructure_handlers,
+    network_handlers,
 )
 
 from . import context, unit_of_work, auth_service as authenticator
@@ -29,6 +30,8 @@ class MessageBus:
         search_service_uow: unit_of_work.IndexUnitOfWork,
         entry_uow_factory: unit_of_work.EntryUowFactory,
         raise_on_all_errors: bool = False,
+        index_outbox: bool = False,
+        outbox_uow: typing.Optional[unit_of_work.OutboxUnitOfWork] = None,
     ):
         self.ctx = context.Context(
             resource_uow=resource_uow,
@@ -36,23 +39,35 @@ class MessageBus:
             # auth_service=auth_service,
             index_uow=search_service_uow,
             entry_uow_factory=entry_uow_factory,
+            outbox_uow=outbox_uow,
+            index_outbox=index_outbox,
         )
         self.raise_on_all_errors = raise_on_all_errors
+        # The entry events are in the index outbox, the index worker indexes them
+        self.index_outbox = index_outbox
         self.queue = []
 
     def handle(self, message: Message):
+        """Handle message and the events it leads to.
+
+        Returns the result of the handler when message is a command.
+        """
+        result = None
         self.queue = [message]
         while self.queue:
             message = self.queue.pop(0)
             if isinstance(message, events.Event):
                 self._handle_event(message)
             elif isinstance(message, commands.Command):
-                self._handle_command(message)
+                result = self._handle_command(message)
             else:
                 raise Exception(f"{message} was not an Event or Command")
+        return result
 
     def _handle_event(self, event: events.Event):
         for handler in EVENT_HANDLERS[type(event)]:
+            if self.index_outbox and handler in OUTBOX_INDEX_HANDLERS:
+                continue
             try:
                 logger.debug("handling event %s with handler %s", event, handler)
                 handler(event, ctx=self.ctx)
@@ -67,8 +82,9 @@ class MessageBus:
         logger.debug("handling command %s", command)
         try:
             handler = COMMAND_HANDLERS[type(command)]
-            handler(command, ctx=self.ctx)
+            result = handler(command, ctx=self.ctx)
             self.queue.extend(self.ctx.collect_new_events())
+            return result
         except Exception:
             logger.exception("Exception handling command %s", command)
             raise
@@ -76,15 +92,37 @@ class MessageBus:
 
 EVENT_HANDLERS: Dict[Type[events.Event], List[Callable]] = {
     events.AppStarted: [resource_handlers.setup_existing_resources],
-    events.ResourceCreated: [index_handlers.create_index],
+    events.ResourceCreated: [
+        resource_handlers.invalidate_cached_resource,
+        network_handlers.invalidate_reference_graph,
+        index_handlers.create_index,
+    ],
     events.ResourceLoaded: [],
-    events.ResourcePublished: [index_handlers.publish_index],
-    events.ResourceUpdated: [],
+    events.ResourceDiscarded: [
+        resource_handlers.invalidate_cached_resource,
+        network_handlers.invalidate_reference_graph,
+    ],
+    events.ResourcePublished: [
+        resource_handlers.invalidate_cached_resource,
+        network_handlers.invalidate_reference_graph,
+        index_handlers.publish_index,
+    ],
+    events.ResourceUpdated: [
+        resource_handlers.invalidate_cached_resource,
+        network_handlers.invalidate_reference_graph,
+    ],
     events.EntryAdded: [index_handlers.add_entry],
     events.EntryDeleted: [index_handlers.delete_entry],
     events.EntryUpdated: [index_handlers.update_entry],
 }
 
+# Replaced by the index worker when the entry events go to the index outbox
+OUTBOX_INDEX_HANDLERS = {
+    index_handlers.add_entry,
+    index_handlers.delete_entry,
+    index_handlers.update_entry,
+}
+
 COMMAND_HANDLERS: Dict[Type[commands.Command], Callable] = {
     commands.CreateResource: resource_handlers.create_resource,
     commands.PublishResource: resource_handlers.publish_resource,
@@ -93,5 +131,11 @@ COMMAND_HANDLERS: Dict[Type[commands.Command], Callable] = {
     commands.AddEntries: entry_handlers.add_entries,
     commands.DeleteEntry: entry_handlers.delete_entry,
     commands.ReindexResource: index_handlers.reindex_resource,
+    commands.ReindexChangedEntries: index_handlers.reindex_changed_entries,
+    commands.ResumeReindexJob: index_handlers.resume_reindex_job,
+    commands.AbandonReindexJob: index_handlers.abandon_reindex_job,
+    commands.IndexOutboxEvents: index_handlers.index_outbox_events,
+    commands.CreateMissingIndexes: entry_handlers.create_missing_indexes,
+    commands.MigrateEntryBodyStorage: entry_handlers.migrate_entry_body_storage,
     commands.UpdateEntry: entry_handlers.update_entry,
 }
@@ -6,9 +6,9 @@ from karp.domain.models.entry import Entry
 from typing import Dict, Any, Iterator, Optional, Tuple, List
 import json
 
-from karp.domain import model
+from karp.domain import events, model
 from karp.domain.repository import ResourceRepository
-from karp.services import context
+from karp.services import context, reference_graph
 
 # from karp.resourcemgr import get_resource
 # import karp.resourcemgr.entryread as entryread
@@ -52,83 +52,105 @@ def get_referenced_entries(
         # src_body = json.loads(src_entry.body)
         for (ref_resource_id, ref_resource_version, field_name, field) in resource_refs:
             ids = src_entry.body.get(field_name)
+            if ids is None:
+                continue
             if not field.get("collection", False):
                 ids = [ids]
             ref_resource = ctx.resource_uow.repo.by_resource_id(ref_resource_id)
             if ref_resource:
                 with ctx.entry_uows.get(ref_resource.resource_id) as entries_uw:
-                    for ref_entry_id in ids:
-                        entry = entries_uw.repo.by_entry_id(
-                            ref_entry_id, version=ref_resource_version
-                        )
-                        if entry:
-                            yield _create_ref(
-                                ref_resource_id, ref_resource_version, entry
-                            )
+                    ref_entries = entries_uw.repo.by_entry_ids(
+                        str(ref_entry_id) for ref_entry_id in ids
+                    )
+                for ref_entry_id in ids:
+                    entry = ref_entries.get(str(ref_entry_id))
+                    if entry:
+                        yield _create_ref(ref_resource_id, ref_resource_version, entry)
+
+
+def get_referenced_entries_many(
+    resource: model.Resource,
+    src_entries: typing.Iterable[Entry],
+    ctx: context.Context,
+) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+    """
+    Finds the entries that refer to, or are referred to by, any of src_entries.
+
+    Like `get_referenced_entries`, but with one query per referring field and
+    one per referred resource for all of src_entries, and each entry is found
+    once however many of src_entries it is related to. Discarded referring
+    entries are left out.
+    """
+    src_entries = list(src_entries)
+    resource_refs, resource_backrefs = get_refs(resource.resource_id, ctx=ctx)
+    entry_ids = [src_entry.entry_id for src_entry in src_entries]
+    seen = set()
+
+    def unseen_refs(ref_resource_id, ref_resource_version, entries):
+        for entry in entries:
+            key = (ref_resource_id, entry.entry_id)
+            if key not in seen:
+                seen.add(key)
+                yield _create_ref(ref_resource_id, ref_resource_version, entry)
+
+    with ctx.resource_uow:
+        for (
+            ref_resource_id,
+            ref_resource_version,
+            field_name,
+            _,
+        ) in resource_backrefs:
+            with ctx.entry_uows.get(ref_resource_id) as entries_uw:
+                matches = entries_uw.repo.by_referenceable_values(
+                    field_name, entry_ids, {"discarded": False}
+                )
+            for entries in matches.values():
+                yield from unseen_refs(ref_resource_id, ref_resource_version, entries)
+
+        # The referred entry ids of each resource, in order and without duplicates
+        ref_ids = collections.defaultdict(dict)
+        for ref_resource_id, ref_resource_version, field_name, field in resource_refs:
+            for src_entry in src_entries:
+                ids = src_entry.body.get(field_name)
+                if ids is None:
+                    continue
+                if not field.get("collection", False):
+                    ids = [ids]
+                ref_ids[(ref_resource_id, ref_resource_version)].update(
+                    (str(ref_entry_id), None) for ref_entry_id in ids
+                )
+        for (ref_resource_id, ref_resource_version), ids in ref_ids.items():
+            if not ctx.resource_uow.repo.by_resource_id(ref_resource_id):
+                continue
+            with ctx.entry_uows.get(ref_resource_id) as entries_uw:
+                ref_entries = entries_uw.repo.by_entry_ids(ids)
+            yield from unseen_refs(
+                ref_resource_id,
+                ref_resource_version,
+                (
+                    ref_entries[ref_entry_id]
+                    for ref_entry_id in ids
+                    if ref_entry_id in ref_entries
+                ),
+            )
 
 
 def get_refs(
     resource_id, ctx: context.Context, version=None
 ) -> Tuple[List[Tuple[str, int, str, Dict]], List[Tuple[str, int, str, Dict]]]:
     """
-    Goes through all other resource configs finding resources and fields that refer to this resource
+    Finds the resources and fields that this resource refers to, and that refer to
+    this resource, using the reference graph of the published resources.
     """
-    resource_backrefs = collections.defaultdict(lambda: collections.defaultdict(dict))
-    resource_refs = collections.defaultdict(lambda: collections.defaultdict(dict))
-
     with ctx.resource_uow as uw:
         src_resource = uw.repo.by_resource_id(resource_id, version=version)
+        graph = reference_graph.get_graph(uw)
+
+    return graph.refs(src_resource, version)
+
 
-        all_other_resources = [
-            resource
-            for resource in uw.repo.get_published_resources()
-            if resource.resource_id != resource_id
-            # or resource_def.version != version
-        ]
-
-    for field_name, field in src_resource.config["fields"].items():
-        if "ref" in field:
-            if "resource_id" not in field["ref"]:
-                resource_backrefs[resource_id][version][field_name] = field
-                resource_refs[resource_id][version][field_name] = field
-            else:
-                resource_refs[field["ref"]["resource_id"]][
-                    field["ref"]["resource_version"]
-                ][field_name] = field
-        elif "function" in field and "multi_ref" in field["function"]:
-            virtual_field = field["function"]["multi_ref"]
-            ref_field = virtual_field["field"]
-            if "resource_id" in virtual_field:
-                resource_backrefs[virtual_field["resource_id"]][
-                    virtual_field["resource_version"]
-                ][ref_field] = None
-            else:
-                resource_backrefs[resource_id][version][ref_field] = None
-
-    for other_resource in all_other_resources:
-        # other_resource = get_resource(
-        #     resource_def.resource_id, version=resource_def.version
-        # )
-        for field_name, field in other_resource.config["fields"].items():
-            ref = field.get("ref")
-            if (
-                ref
-                and ref.get("resource_id") == resource_id
-                and ref.get("resource_version") == version
-            ):
-                resource_backrefs[other_resource.resource_id][other_resource.version][
-                    field_name
-                ] = field
-
-    def flatten_dict(ref_dict):
-        ref_list = []
-        for ref_resource_id, versions in ref_dict.items():
-            for ref_version, field_names in versions.items():
-                for field_name, field in field_names.items():
-                    ref_list.append((ref_resource_id, ref_version, field_name, field))
-        return ref_list
-
-    return flatten_dict(resource_refs), flatten_dict(resource_backrefs)
+def invalidate_reference_graph(evt: events.Event, ctx: context.Context):
+    reference_graph.invalidate(ctx.resource_uow)
 
 
 def _create_ref(
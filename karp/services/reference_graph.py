@@ -0,0 +1,234 @@
+"""Graph of the references between resources, built from their configs."""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from karp.application import config
+from karp.domain import model
+from karp.services import unit_of_work
+
+
+logger = logging.getLogger("karp")
+
+# (resource_id, resource_version, field_name, field)
+Ref = Tuple[str, Optional[int], str, Optional[Dict]]
+
+# Seconds between checks for resource changes made by other processes
+REFERENCE_GRAPH_STAMP_TTL = 5.0
+
+
+class ReferenceGraph:
+    """The fields of published resources that refer to other resources.
+
+    Fields are indexed by the (resource_id, resource_version) they refer to,
+    so finding the fields referring to a resource doesn't need to walk the
+    config of every published resource.
+    """
+
+    def __init__(
+        self, incoming: Optional[Dict[Tuple[str, Optional[int]], List[Ref]]] = None
+    ):
+        self._incoming = incoming or {}
+        self._refs: Dict[Tuple, Tuple[List[Ref], List[Ref]]] = {}
+        self._lock = threading.Lock()
+        self.mtime: Optional[float] = None
+        # The history stamp of the resources the graph is built from
+        self.stamp: Optional[int] = None
+        self.stamp_checked_at: Optional[float] = None
+
+    @classmethod
+    def from_resources(cls, resources: Iterable[model.Resource]) -> "ReferenceGraph":
+        incoming = collections.defaultdict(list)
+        for resource in resources:
+            for field_name, field in resource.config["fields"].items():
+                ref = field.get("ref")
+                if ref and "resource_id" in ref:
+                    incoming[(ref["resource_id"], ref.get("resource_version"))].append(
+                        (resource.resource_id, resource.version, field_name, field)
+                    )
+        return cls(dict(incoming))
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ReferenceGraph":
+        graph = cls(
+            {
+                (item["resource_id"], item["resource_version"]): [
+                    tuple(ref) for ref in item["referring_fields"]
+                ]
+                for item in data["incoming"]
+            }
+        )
+        graph.stamp = data.get("stamp")
+        return graph
+
+    def to_dict(self) -> Dict:
+        return {
+            "stamp": self.stamp,
+            "incoming": [
+                {
+                    "resource_id": resource_id,
+                    "resource_version": resource_version,
+                    "referring_fields": [list(ref) for ref in refs],
+                }
+                for (resource_id, resource_version), refs in self._incoming.items()
+            ],
+        }
+
+    def referring_fields(
+        self, resource_id: str, resource_version: Optional[int]
+    ) -> List[Ref]:
+        """Fields of published resources referring to the given resource version."""
+        return self._incoming.get((resource_id, resource_version), [])
+
+    def refs(
+        self, resource: model.Resource, version: Optional[int]
+    ) -> Tuple[List[Ref], List[Ref]]:
+        """The refs and backrefs of resource, see `network_handlers.get_refs`."""
+        key = (str(resource.id), resource.resource_id, resource.version, version)
+        result = self._refs.get(key)
+        if result is None:
+            result = self._collect_refs(resource, version)
+            with self._lock:
+                self._refs[key] = result
+        return result
+
+    def _collect_refs(
+        self, resource: model.Resource, version: Optional[int]
+    ) -> Tuple[List[Ref], List[Ref]]:
+        resource_id = resource.resource_id
+        resource_backrefs = collections.defaultdict(
+            lambda: collections.defaultdict(dict)
+        )
+        resource_refs = collections.defaultdict(lambda: collections.defaultdict(dict))
+
+        for field_name, field in resource.config["fields"].items():
+            if "ref" in field:
+                if "resource_id" not in field["ref"]:
+                    resource_backrefs[resource_id][version][field_name] = field
+                    resource_refs[resource_id][version][field_name] = field
+                else:
+                    resource_refs[field["ref"]["resource_id"]][
+                        field["ref"]["resource_version"]
+                    ][field_name] = field
+            elif "function" in field and "multi_ref" in field["function"]:
+                virtual_field = field["function"]["multi_ref"]
+                ref_field = virtual_field["field"]
+                if "resource_id" in virtual_field:
+                    resource_backrefs[virtual_field["resource_id"]][
+                        virtual_field["resource_version"]
+                    ][ref_field] = None
+                else:
+                    resource_backrefs[resource_id][version][ref_field] = None
+
+        for (
+            other_resource_id,
+            other_version,
+            field_name,
+            field,
+        ) in self.referring_fields(resource_id, version):
+            if other_resource_id != resource_id:
+                resource_backrefs[other_resource_id][other_version][field_name] = field
+
+        return _flatten(resource_refs), _flatten(resource_backrefs)
+
+
+# One graph for each resource unit of work, i.e. for each resource database
+_graphs: "weakref.WeakKeyDictionary[unit_of_work.ResourceUnitOfWork, ReferenceGraph]"
+_graphs = weakref.WeakKeyDictionary()
+
+
+def get_graph(resource_uow: unit_of_work.ResourceUnitOfWork) -> ReferenceGraph:
+    """Return the reference graph of the resources in resource_uow.
+
+    The graph is built once from the published resources and kept until
+    `invalidate` is called, so resource_uow must be entered. Changes made by
+    other processes are detected by comparing the history stamp of the
+    resources, which is checked at most every REFERENCE_GRAPH_STAMP_TTL
+    seconds. If REFERENCE_GRAPH_PATH is set the graph is also stored there,
+    and reloaded when another process has rebuilt or invalidated it.
+    """
+    path = config.REFERENCE_GRAPH_PATH
+    graph = _graphs.get(resource_uow)
+    if path:
+        mtime = _mtime(path)
+        if graph is not None and graph.mtime != mtime:
+            graph = None
+        if graph is None and mtime is not None:
+            graph = _load(path)
+    if graph is not None and not _is_current(graph, resource_uow):
+        graph = None
+    if graph is None:
+        stamp = resource_uow.repo.history_stamp()
+        graph = ReferenceGraph.from_resources(
+            resource_uow.repo.get_published_resources()
+        )
+        graph.stamp = stamp
+        graph.stamp_checked_at = time.monotonic()
+        if path:
+            graph.mtime = _save(graph, path)
+    _graphs[resource_uow] = graph
+    return graph
+
+
+def invalidate(resource_uow: unit_of_work.ResourceUnitOfWork) -> None:
+    _graphs.pop(resource_uow, None)
+    path = config.REFERENCE_GRAPH_PATH
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _is_current(
+    graph: ReferenceGraph, resource_uow: unit_of_work.ResourceUnitOfWork
+) -> bool:
+    now = time.monotonic()
+    checked_at = graph.stamp_checked_at
+    if checked_at is not None and now - checked_at < REFERENCE_GRAPH_STAMP_TTL:
+        return True
+    graph.stamp_checked_at = now
+    return resource_uow.repo.history_stamp() == graph.stamp
+
+
+def _flatten(ref_dict) -> List[Ref]:
+    ref_list = []
+    for ref_resource_id, versions in ref_dict.items():
+        for ref_version, field_names in versions.items():
+            for field_name, field in field_names.items():
+                ref_list.append((ref_resource_id, ref_version, field_name, field))
+    return ref_list
+
+
+def _mtime(path: Path) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _load(path: Path) -> Optional[ReferenceGraph]:
+    try:
+        with open(path) as fp:
+            graph = ReferenceGraph.from_dict(json.load(fp))
+            graph.mtime = os.fstat(fp.fileno()).st_mtime
+    except FileNotFoundError:
+        return None
+    return graph
+
+
+def _save(graph: ReferenceGraph, path: Path) -> float:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as fp:
+        json.dump(graph.to_dict(), fp)
+    os.replace(tmp_path, path)
+    logger.info("Wrote reference graph to '%s'", path)
+    return _mtime(path)
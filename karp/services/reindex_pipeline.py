@@ -0,0 +1,220 @@
+"""Reindexing a resource with a pool of worker processes.
+
+The entries are read in chunks from the entry repository, transformed to
+index entries by worker processes and added to the index by a pool of
+threads, so that reading, transforming and indexing overlap.
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from karp.domain import errors, index, model
+from karp.services import context
+
+
+logger = logging.getLogger("karp")
+
+# Number of chunks read ahead of the workers, per worker
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+_worker_ctx: Optional[context.Context] = None
+
+
+def default_worker_context() -> context.Context:
+    """Bootstrap the application in a worker, with its own connections."""
+    from karp import bootstrap
+
+    return bootstrap.bootstrap().ctx
+
+
+def reindex_resource(
+    resource: model.Resource,
+    ctx: context.Context,
+    *,
+    workers: int,
+    chunk_size: int = 1000,
+    context_factory: Callable[[], context.Context] = default_worker_context,
+    index_name: Optional[str] = None,
+    after_entry_id: Optional[str] = None,
+    on_chunk_indexed: Optional[Callable[[str, int, List[str]], None]] = None,
+) -> Dict:
+    """Reindex resource using `workers` processes to transform the entries.
+
+    context_factory is called once in each worker process to create the
+    context used to look up referenced entries, it must be picklable.
+    If index_name is given the entries are added to that, already created,
+    index instead of a new current index.
+    Only the entries after after_entry_id are indexed, if it is given.
+    on_chunk_indexed is called, in this process, with the id of the last
+    entry of each chunk, the number of entries and the ids of the rejected
+    entries, once the chunk and all chunks read before it are indexed, so
+    that indexing can be resumed after that entry.
+    Returns the number of indexed entries, the ids of the entries that the
+    index rejected and the elapsed time.
+    """
+    if workers < 1:
+        raise errors.ConfigurationError(f"workers must be at least 1, got {workers}")
+    resource_id = resource.resource_id
+    progress = _Progress(resource_id)
+    # spawn, so workers don't share the database connections of this process
+    mp_context = multiprocessing.get_context("spawn")
+    with ctx.index_uow as index_uw:
+        if index_name is None:
+            index_uw.repo.create_index(resource_id, resource.config)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(context_factory,),
+        ) as transformers, concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers
+        ) as indexers:
+            transforming = {}
+            indexing = {}
+            chunks = _ChunkCheckpoints(on_chunk_indexed)
+
+            def index_transformed(done):
+                for future in done:
+                    seq = transforming.pop(future)
+                    indexing[
+                        indexers.submit(
+                            _add_entries,
+                            index_uw,
+                            resource_id,
+                            future.result(),
+                            index_name,
+                        )
+                    ] = seq
+
+            def collect_indexed(done):
+                for future in done:
+                    seq = indexing.pop(future)
+                    num_entries, failed_entry_ids = future.result()
+                    progress.add(num_entries, failed_entry_ids)
+                    chunks.indexed(seq, failed_entry_ids)
+
+            with ctx.entry_uows.get(resource_id) as entries_uw:
+                for seq, chunk in enumerate(
+                    _chunks(
+                        entries_uw.repo.iter_entries(
+                            chunk_size=chunk_size, after_entry_id=after_entry_id
+                        ),
+                        chunk_size,
+                    )
+                ):
+                    while len(transforming) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                        done, _ = concurrent.futures.wait(
+                            transforming, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        index_transformed(done)
+                    collect_indexed([future for future in indexing if future.done()])
+                    chunks.read(seq, chunk)
+                    transforming[
+                        transformers.submit(_transform_chunk, resource_id, chunk)
+                    ] = seq
+            index_transformed(concurrent.futures.wait(transforming).done)
+            collect_indexed(concurrent.futures.wait(indexing).done)
+        index_uw.commit()
+    return progress.report()
+
+
+def _chunks(entries, chunk_size: int):
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _ChunkCheckpoints:
+    """Report the indexed chunks in the order they were read."""
+
+    def __init__(
+        self, on_chunk_indexed: Optional[Callable[[str, int, List[str]], None]]
+    ):
+        self.on_chunk_indexed = on_chunk_indexed
+        self.next_seq = 0
+        # seq -> (last entry id, number of entries) of the chunks being indexed
+        self.pending: Dict[int, Tuple[str, int]] = {}
+        # seq -> failed entry ids of the indexed chunks not yet reported
+        self.done: Dict[int, List[str]] = {}
+
+    def read(self, seq: int, chunk: List[model.Entry]):
+        self.pending[seq] = (chunk[-1].entry_id, len(chunk))
+
+    def indexed(self, seq: int, failed_entry_ids: List[str]):
+        self.done[seq] = failed_entry_ids
+        while self.next_seq in self.done:
+            failed = self.done.pop(self.next_seq)
+            last_entry_id, num_entries = self.pending.pop(self.next_seq)
+            self.next_seq += 1
+            if self.on_chunk_indexed is not None:
+                self.on_chunk_indexed(last_entry_id, num_entries, failed)
+
+
+def _init_worker(context_factory: Callable[[], context.Context]):
+    global _worker_ctx
+    _worker_ctx = context_factory()
+
+
+def _transform_chunk(
+    resource_id: str, entries: List[model.Entry]
+) -> List[index.IndexEntry]:
+    from karp.services import index_handlers
+
+    ctx = _worker_ctx
+    with ctx.resource_uow:
+        resource = ctx.resource_uow.repo.by_resource_id(resource_id)
+        if not resource:
+            raise errors.ResourceNotFound(resource_id=resource_id)
+        return index_handlers.transform_to_index_entries(resource, entries, ctx)
+
+
+def _add_entries(
+    index_uw,
+    resource_id: str,
+    entries: List[index.IndexEntry],
+    index_name: Optional[str] = None,
+) -> Tuple[int, List[str]]:
+    try:
+        index_uw.repo.add_entries(
+            resource_id, entries, refresh=False, index_name=index_name
+        )
+    except errors.IndexingFailed as err:
+        return len(entries), err.entry_ids
+    return len(entries), []
+
+
+class _Progress:
+    def __init__(self, resource_id: str):
+        self.resource_id = resource_id
+        self.indexed = 0
+        self.failed_entry_ids: List[str] = []
+        self.started_at = time.perf_counter()
+
+    def add(self, num_entries: int, failed_entry_ids: List[str]):
+        self.indexed += num_entries
+        self.failed_entry_ids.extend(failed_entry_ids)
+        logger.info(
+            "Indexed %d entries of '%s' (%.0f entries/s)",
+            self.indexed,
+            self.resource_id,
+            self.indexed / self.elapsed(),
+        )
+
+    def elapsed(self) -> float:
+        return max(time.perf_counter() - self.started_at, 1e-9)
+
+    def report(self) -> Dict:
+        elapsed = self.elapsed()
+        return {
+            "entries": self.indexed,
+            "failed_entry_ids": self.failed_entry_ids,
+            "seconds": elapsed,
+            "entries_per_second": self.indexed / elapsed,
+        }
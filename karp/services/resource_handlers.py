@@ -13,7 +13,7 @@ import fastjsonschema  # pyre-ignore
 from sb_json_tools import jsondiff
 
 from karp.domain import commands, model, errors, events
-from . import context
+from . import context, entry_validators, reference_graph, transform_plan
 from karp.domain.models.resource import Resource
 
 # from karp.domain.services import indexing
@@ -210,6 +210,13 @@ def setup_existing_resources(evt: events.AppStarted, ctx: context.Context):
                 entry_repository_settings=resource.entry_repository_settings,
             )
             ctx.entry_uows.set_uow(resource_id, entry_repo_uow)
+            entry_validators.warm(resource)
+            transform_plan.warm(resource)
+        reference_graph.get_graph(ctx.resource_uow)
+
+
+def invalidate_cached_resource(evt: events.Event, ctx: context.Context):
+    ctx.resource_uow.invalidate_cached(evt.resource_id)
 
 
 def create_new_resource(config_file: IO, config_dir=None) -> Resource:
@@ -405,6 +412,8 @@ def publish_resource(cmd: commands.PublishResource, ctx: context.Context):
         resource.publish(user=cmd.user, message=cmd.message, timestamp=cmd.timestamp)
         ctx.resource_uow.repo.update(resource)
         ctx.resource_uow.commit()
+    entry_validators.warm(resource)
+    transform_plan.warm(resource)
     # print("calling indexing.publish_index ...")
     # indexing.publish_index(ctx.search_service, ctx.resource_repo, resource)
     # print("index published")
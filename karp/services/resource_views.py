@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from karp.domain import model
 from . import context
@@ -7,3 +7,10 @@ from . import context
 def get_published_resources(ctx: context.Context) -> List[model.Resource]:
     with ctx.resource_uow:
         return ctx.resource_uow.resources.get_published_resources()
+
+
+def get_reindex_jobs(
+    ctx: context.Context, resource_id: Optional[str] = None
+) -> List[model.ReindexJob]:
+    with ctx.resource_uow:
+        return ctx.resource_uow.repo.reindex_jobs(resource_id)
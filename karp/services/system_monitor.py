@@ -1,3 +1,5 @@
+from typing import Dict, Optional
+
 from karp.application import schemas
 from karp.services import context
 from karp.domain.errors import RepositoryStatusError
@@ -15,3 +17,8 @@ def check_database_status(ctx: context.Context) -> schemas.SystemResponse:
         return schemas.SystemNotOk(message=str(e))
 
     return schemas.SystemOk()
+
+
+def get_index_writer_metrics(ctx: context.Context) -> Optional[Dict]:
+    """Return the flush latencies and batch sizes of buffered index writes."""
+    return ctx.index_uow.repo.writer_metrics()
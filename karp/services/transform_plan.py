@@ -0,0 +1,500 @@
+"""Resource field configs compiled to plans for transforming entries.
+
+A plan is a list of ops, one or more for each field, that are closures over
+the parts of the field config they need. Nested fields and the fields of
+referenced entries get plans of their own, so transforming an entry doesn't
+interpret the config again.
+
+Fields that look up other entries also get a collector. Running the
+collectors over a batch of entries gathers what the batch refers to in a
+PrefetchedRefs, which then fetches it with one query per target resource (and
+field) before the ops run. Plugin fields are collected the same way, and
+computed with one call to the plugin per batch.
+"""
+import collections
+import logging
+import typing
+from typing import Callable, Dict, List, Optional, Tuple
+
+from karp import pluginmanager
+from karp.domain import index, model
+from karp.services import context
+
+
+logger = logging.getLogger("karp")
+
+
+class TransformEnv:
+    """What the ops of a plan use while transforming a batch of entries.
+
+    Resources are looked up once per batch, and entries referred to are
+    looked up in prefetched before they are queried for.
+    """
+
+    __slots__ = ("ctx", "prefetched", "index_repo", "_resources")
+
+    def __init__(self, ctx: context.Context, prefetched=None):
+        self.ctx = ctx
+        self.prefetched = prefetched
+        self.index_repo = ctx.index_uow.repo
+        self._resources: Dict[Tuple[str, Optional[int]], model.Resource] = {}
+
+    def resource(
+        self, resource_id: str, version: Optional[int]
+    ) -> Optional[model.Resource]:
+        key = (resource_id, version)
+        if key not in self._resources:
+            self._resources[key] = self.ctx.resource_uow.repo.by_resource_id(
+                resource_id, version=version
+            )
+        return self._resources[key]
+
+
+# op(resource, src_entry, index_entry, env)
+Op = Callable[[model.Resource, Dict, index.IndexEntry, TransformEnv], None]
+# collect(resource, src_entry, env), adds to env.prefetched
+Collector = Callable[[model.Resource, Dict, TransformEnv], None]
+
+
+class TransformPlan:
+    """The compiled transform of one level of fields."""
+
+    def __init__(self, ops: List[Op], collectors: Optional[List[Collector]] = None):
+        self.ops = ops
+        self.collectors = collectors or []
+
+    def collect(self, resource: model.Resource, src_entry: Dict, env: TransformEnv):
+        """Add the entries that src_entry refers to to env.prefetched."""
+        for collect in self.collectors:
+            collect(resource, src_entry, env)
+
+    def apply(
+        self,
+        resource: model.Resource,
+        src_entry: Dict,
+        index_entry: index.IndexEntry,
+        env: TransformEnv,
+    ):
+        """Transform the fields of src_entry into index_entry.
+
+        resource is the resource that references without a resource_id refer
+        to.
+        """
+        for op in self.ops:
+            op(resource, src_entry, index_entry, env)
+
+
+# Keyed by the resource's entity id and version
+_plans: Dict[Tuple[str, int], TransformPlan] = {}
+
+
+def get_plan(resource: model.Resource) -> TransformPlan:
+    """Return the transform plan of the resource, compiling it only once."""
+    key = (str(resource.id), resource.version)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = compile_fields(resource.config["fields"].items())
+        _plans[key] = plan
+    return plan
+
+
+def warm(resource: model.Resource) -> None:
+    get_plan(resource)
+    logger.debug(
+        "Transform plan for resource '%s' version %d ready",
+        resource.resource_id,
+        resource.version,
+    )
+
+
+def clear() -> None:
+    _plans.clear()
+
+
+def compile_fields(fields: typing.Iterable[Tuple[str, Dict]]) -> TransformPlan:
+    ops = []
+    collectors = []
+    copied: List[str] = []
+    for field_name, field_conf in fields:
+        if field_conf.get("virtual"):
+            op, collect = _compile_virtual(field_name, field_conf["function"])
+        elif field_conf.get("ref"):
+            if field_conf["ref"].get("resource_id"):
+                op, collect = _compile_external_ref(field_name, field_conf["ref"])
+            else:
+                op, collect = _compile_internal_ref(field_name, field_conf["ref"])
+        else:
+            op = collect = None
+        if op is not None:
+            if copied:
+                ops.append(_compile_copy(copied))
+                copied = []
+            ops.append(op)
+        if collect is not None:
+            collectors.append(collect)
+        if field_conf["type"] == "object":
+            if copied:
+                ops.append(_compile_copy(copied))
+                copied = []
+            # Virtual objects have no fields of their own
+            op, collect = _compile_object(
+                field_name, field_conf.get("fields", {}).items()
+            )
+            ops.append(op)
+            if collect is not None:
+                collectors.append(collect)
+        else:
+            copied.append(field_name)
+    if copied:
+        ops.append(_compile_copy(copied))
+    return TransformPlan(ops, collectors)
+
+
+def _compile_copy(field_names: List[str]) -> Op:
+    field_names = tuple(field_names)
+
+    def copy(resource, src_entry, index_entry, env):
+        for field_name in field_names:
+            field_content = src_entry.get(field_name)
+            if field_content:
+                env.index_repo.assign_field(index_entry, field_name, field_content)
+
+    return copy
+
+
+def _compile_object(field_name: str, fields) -> Tuple[Op, Optional[Collector]]:
+    plan = compile_fields(fields)
+
+    def transform_object(resource, src_entry, index_entry, env):
+        if field_name not in src_entry:
+            return
+        field_content = env.index_repo.create_empty_object()
+        plan.apply(resource, src_entry[field_name], field_content, env)
+        if field_content:
+            env.index_repo.assign_field(index_entry, field_name, field_content)
+
+    def collect_object(resource, src_entry, env):
+        field_content = src_entry.get(field_name)
+        if isinstance(field_content, dict):
+            plan.collect(resource, field_content, env)
+
+    return transform_object, collect_object if plan.collectors else None
+
+
+def _compile_ref_field(field_name: str, ref_field: Dict):
+    """Compile the transform of a referenced entry, stored as field_name."""
+    plan = compile_fields(((field_name, ref_field["field"]),))
+
+    def transform_ref(resource, ref_entry: model.Entry, env):
+        ref_index_entry = env.index_repo.create_empty_object()
+        plan.apply(resource, {field_name: ref_entry.body}, ref_index_entry, env)
+        return ref_index_entry.entry[field_name]
+
+    return transform_ref
+
+
+def _compile_external_ref(
+    field_name: str, ref_field: Dict
+) -> Tuple[Op, Optional[Collector]]:
+    ref_resource_id = ref_field["resource_id"]
+    ref_resource_version = ref_field["resource_version"]
+    v_field_name = "v_" + field_name
+    if not ref_field["field"].get("collection"):
+
+        def not_implemented(resource, src_entry, index_entry, env):
+            raise NotImplementedError()
+
+        return not_implemented, None
+
+    transform_ref = _compile_ref_field(field_name, ref_field)
+
+    def external_ref(resource, src_entry, index_entry, env):
+        ref_resource = env.resource(ref_resource_id, ref_resource_version)
+        ref_objs = []
+        if ref_resource:
+            ref_ids = src_entry[field_name]
+            ref_entries = get_ref_entries(
+                ref_resource.resource_id, ref_ids, env.ctx, env.prefetched
+            )
+            for ref_id in ref_ids:
+                ref_entry = ref_entries.get(str(ref_id))
+                if ref_entry:
+                    ref_objs.append(transform_ref(resource, ref_entry, env))
+        env.index_repo.assign_field(index_entry, v_field_name, ref_objs)
+
+    def collect_external_ref(resource, src_entry, env):
+        ref_ids = src_entry.get(field_name)
+        if not ref_ids:
+            return
+        ref_resource = env.resource(ref_resource_id, ref_resource_version)
+        if ref_resource:
+            env.prefetched.add_entry_ids(ref_resource.resource_id, ref_ids)
+
+    return external_ref, collect_external_ref
+
+
+def _compile_internal_ref(
+    field_name: str, ref_field: Dict
+) -> Tuple[Op, Optional[Collector]]:
+    is_collection = ref_field["field"].get("collection", False)
+    v_field_name = "v_" + field_name
+    transform_ref = _compile_ref_field(field_name, ref_field)
+
+    def internal_ref(resource, src_entry, index_entry, env):
+        ref_ids = src_entry.get(field_name)
+        if not ref_ids:
+            return
+        if not is_collection:
+            ref_ids = [ref_ids]
+        ref_entries = get_ref_entries(
+            resource.resource_id, ref_ids, env.ctx, env.prefetched
+        )
+        for ref_id in ref_ids:
+            ref_entry = ref_entries.get(str(ref_id))
+            if ref_entry:
+                env.index_repo.assign_field(
+                    index_entry, v_field_name, transform_ref(resource, ref_entry, env)
+                )
+
+    def collect_internal_ref(resource, src_entry, env):
+        ref_ids = src_entry.get(field_name)
+        if not ref_ids:
+            return
+        if not is_collection:
+            ref_ids = [ref_ids]
+        env.prefetched.add_entry_ids(resource.resource_id, ref_ids)
+
+    return internal_ref, collect_internal_ref
+
+
+def _compile_virtual(
+    field_name: str, function_conf: Dict
+) -> Tuple[Op, Optional[Collector]]:
+    v_field_name = "v_" + field_name
+    collect = None
+    if "multi_ref" in function_conf:
+        evaluate, collect = _compile_multi_ref(function_conf["multi_ref"])
+    elif "plugin" in function_conf:
+        evaluate, collect = _compile_plugin(function_conf["plugin"])
+    else:
+        evaluate = _not_implemented
+
+    def virtual(resource, src_entry, index_entry, env):
+        res = evaluate(resource, src_entry, env)
+        if res:
+            env.index_repo.assign_field(index_entry, v_field_name, res)
+
+    return virtual, collect
+
+
+def _not_implemented(resource, src_entry, env):
+    raise NotImplementedError()
+
+
+def _compile_multi_ref(function_conf: Dict):
+    """Compile a multi_ref, the entries whose field matches a field of self.
+
+    The collector gathers the self values of a batch, so that the entries of
+    the whole batch are fetched with one query and the evaluation only picks
+    its entries out of the result.
+    """
+    target_field = function_conf["field"]
+    target_resource_id = function_conf.get("resource_id")
+    target_resource_version = function_conf.get("resource_version")
+    if "test" not in function_conf:
+        return _not_implemented, None
+    operator, args = list(function_conf["test"].items())[0]
+    if operator not in ["equals", "contains"]:
+        return _not_implemented, None
+    if not args or any("self" not in arg for arg in args):
+        return _not_implemented, None
+    # Each arg sets the same filter, so the last one is the one tested
+    self_field = args[-1]["self"]
+    plan = compile_fields((("tmp", function_conf["result"]),))
+
+    def get_target_resource(src_resource, env):
+        if target_resource_id:
+            return env.resource(target_resource_id, target_resource_version)
+        return src_resource
+
+    def multi_ref(src_resource, src_entry, env):
+        target_resource = get_target_resource(src_resource, env)
+        if target_resource is None:
+            logger.warning(
+                "Didn't find the resource with resource_id='%s'",
+                target_resource_id,
+            )
+            return env.index_repo.create_empty_list()
+        value = src_entry[self_field]
+        target_entries = None
+        if env.prefetched is not None:
+            target_entries = env.prefetched.by_referenceable(
+                target_resource.resource_id, target_field, value
+            )
+        if target_entries is None:
+            target_entries = _query_referenceable(
+                target_resource.resource_id, target_field, value, env.ctx
+            )
+
+        res = env.index_repo.create_empty_list()
+        for entry in target_entries:
+            index_entry = env.index_repo.create_empty_object()
+            plan.apply(target_resource, {"tmp": entry.body}, index_entry, env)
+            env.index_repo.add_to_list_field(res, index_entry.entry["tmp"])
+        return res
+
+    def collect_multi_ref(src_resource, src_entry, env):
+        if self_field not in src_entry:
+            return
+        target_resource = get_target_resource(src_resource, env)
+        if target_resource is not None:
+            env.prefetched.add_value(
+                target_resource.resource_id, target_field, src_entry[self_field]
+            )
+
+    return multi_ref, collect_multi_ref
+
+
+def _query_referenceable(
+    resource_id: str, field_name: str, value, ctx: context.Context
+) -> List[model.Entry]:
+    """Query the entries of one value that wasn't collected."""
+    filters = {"discarded": False}
+    with ctx.entry_uows.get(resource_id) as entries_uw:
+        if isinstance(value, typing.Hashable):
+            entries = entries_uw.repo.by_referenceable_values(
+                field_name, [value], filters
+            ).get(value, [])
+        else:
+            entries = entries_uw.repo.by_referenceable({**filters, field_name: value})
+        entries_uw.commit()
+    return entries
+
+
+def _compile_plugin(plugin_id: str):
+    """Compile a plugin field, computed by the plugin for a batch at a time.
+
+    The collector gathers the entries of a batch, so that the plugin is called
+    once for all of them, and the evaluation picks out the result of its entry.
+    """
+
+    def plugin(src_resource, src_entry, env):
+        if env.prefetched is not None:
+            found, result = env.prefetched.plugin_result(
+                plugin_id, src_resource, src_entry
+            )
+            if found:
+                return result
+        return pluginmanager.apply_plugin_function(
+            plugin_id, src_resource.id, src_resource.version, src_entry
+        )
+
+    def collect_plugin(src_resource, src_entry, env):
+        env.prefetched.add_plugin_entry(plugin_id, src_resource, src_entry)
+
+    return plugin, collect_plugin
+
+
+def get_ref_entries(
+    resource_id: str,
+    entry_ids: typing.Iterable,
+    ctx: context.Context,
+    prefetched=None,
+) -> Dict[str, model.Entry]:
+    """Fetch the referenced entries, from prefetched if they were collected."""
+    entry_ids = [str(entry_id) for entry_id in entry_ids]
+    if prefetched is not None:
+        ref_entries = prefetched.by_entry_ids(resource_id, entry_ids)
+        if ref_entries is not None:
+            return ref_entries
+    with ctx.entry_uows.get(resource_id) as entries_uw:
+        ref_entries = entries_uw.repo.by_entry_ids(entry_ids)
+        entries_uw.commit()
+    return ref_entries
+
+
+class PrefetchedRefs:
+    """Entries referred to by a batch of source entries.
+
+    Lookups of keys that weren't collected return None, and the caller
+    queries for them instead.
+    """
+
+    def __init__(self):
+        self._entry_ids: Dict[str, set] = collections.defaultdict(set)
+        self._values: Dict[Tuple[str, str], set] = collections.defaultdict(set)
+        self._entries: Dict[str, Dict[str, model.Entry]] = {}
+        self._referenceable: Dict[Tuple[str, str], Dict] = {}
+        # The source entries of each plugin and resource, by their id
+        self._plugin_entries: Dict[Tuple, Dict[int, Dict]] = collections.defaultdict(
+            dict
+        )
+        self._plugin_results: Dict[Tuple, Dict[int, typing.Any]] = {}
+
+    def add_entry_ids(self, resource_id: str, entry_ids: typing.Iterable):
+        self._entry_ids[resource_id].update(str(entry_id) for entry_id in entry_ids)
+
+    def add_value(self, resource_id: str, field_name: str, value):
+        if isinstance(value, typing.Hashable):
+            self._values[(resource_id, field_name)].add(value)
+
+    def add_plugin_entry(self, plugin_id: str, resource: model.Resource, src_entry):
+        key = (plugin_id, resource.id, resource.version)
+        self._plugin_entries[key][id(src_entry)] = src_entry
+
+    def fetch(self, ctx: context.Context):
+        for resource_id, entry_ids in self._entry_ids.items():
+            with ctx.entry_uows.get(resource_id) as entries_uw:
+                self._entries[resource_id] = entries_uw.repo.by_entry_ids(entry_ids)
+                entries_uw.commit()
+        for (resource_id, field_name), values in self._values.items():
+            with ctx.entry_uows.get(resource_id) as entries_uw:
+                self._referenceable[
+                    (resource_id, field_name)
+                ] = entries_uw.repo.by_referenceable_values(
+                    field_name, values, {"discarded": False}
+                )
+                entries_uw.commit()
+        for key, src_entries in self._plugin_entries.items():
+            results = pluginmanager.apply_plugin_function_batch(
+                *key, list(src_entries.values())
+            )
+            self._plugin_results[key] = dict(zip(src_entries, results))
+
+    def by_entry_ids(
+        self, resource_id: str, entry_ids: List[str]
+    ) -> Optional[Dict[str, model.Entry]]:
+        if resource_id not in self._entries or not self._entry_ids[
+            resource_id
+        ].issuperset(entry_ids):
+            return None
+        entries = self._entries[resource_id]
+        return {
+            entry_id: entries[entry_id] for entry_id in entry_ids if entry_id in entries
+        }
+
+    def by_referenceable(
+        self, resource_id: str, field_name: str, value
+    ) -> Optional[List[model.Entry]]:
+        key = (resource_id, field_name)
+        if (
+            key not in self._referenceable
+            or not isinstance(value, typing.Hashable)
+            or value not in self._values[key]
+        ):
+            return None
+        return self._referenceable[key].get(value, [])
+
+    def plugin_result(
+        self, plugin_id: str, resource: model.Resource, src_entry
+    ) -> Tuple[bool, typing.Any]:
+        """Return whether src_entry was collected for the plugin, and its result."""
+        key = (plugin_id, resource.id, resource.version)
+        results = self._plugin_results.get(key)
+        # The source entries are kept in _plugin_entries, so their ids are not reused
+        if (
+            results is None
+            or self._plugin_entries[key].get(id(src_entry)) is not src_entry
+        ):
+            return False, None
+        return True, results[id(src_entry)]
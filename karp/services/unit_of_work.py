@@ -48,6 +48,20 @@ class ResourceUnitOfWork(UnitOfWork[repository.ResourceRepository]):
     def resources(self) -> repository.ResourceRepository:
         return self.repo
 
+    def invalidate_cached(self, resource_id: str):
+        """Drop any cached versions of the resource, no need to enter the uow."""
+        return
+
+
+class OutboxUnitOfWork(UnitOfWork[repository.OutboxRepository]):
+    @property
+    def outbox(self) -> repository.OutboxRepository:
+        return self.repo
+
+    def collect_new_events(self) -> typing.Iterable:
+        # Outbox events are already handled, they are only waiting to be indexed
+        return []
+
 
 class EntryUnitOfWork(UnitOfWork[repository.EntryRepository]):
     _registry = {}
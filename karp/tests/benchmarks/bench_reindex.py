@@ -0,0 +1,68 @@
+"""Throughput of reindexing a generated resource with 1, 2, 4 and 8 workers.
+
+Run with `python -m karp.tests.benchmarks.bench_reindex [NUM_ENTRIES]`.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from karp.services import index_handlers, reindex_pipeline
+from karp.tests.generated_resource import (
+    DB_URL_VAR,
+    RESOURCE_ID,
+    generate_resource,
+    worker_context,
+)
+
+
+def report(line: str):
+    # The index handlers print to stdout
+    print(line, file=sys.stderr)
+
+
+class CountingIndex:
+    """Stands in for the search index, so only the pipeline is measured."""
+
+    def __init__(self, index_uow):
+        self.index_uow = index_uow
+        self.indexed = 0
+        index_uow.repo.add_entries = self.add_entries
+
+    def add_entries(self, resource_id, entries, *, refresh=True, index_name=None):
+        self.indexed += len(list(entries))
+
+
+def main(num_entries: int = 20000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url = f"sqlite:///{tmp_dir}/bench.db"
+        os.environ[DB_URL_VAR] = db_url
+        ctx = generate_resource(db_url, num_entries)
+        with ctx.resource_uow as uw:
+            resource = uw.repo.by_resource_id(RESOURCE_ID)
+        report(f"{num_entries} entries, {os.cpu_count()} cpus")
+        for workers in (1, 2, 4, 8):
+            counter = CountingIndex(ctx.index_uow)
+            started_at = time.perf_counter()
+            if workers == 1:
+                with ctx.index_uow:
+                    index_entries = index_handlers.pre_process_resource(
+                        RESOURCE_ID, ctx
+                    )
+                    ctx.index_uow.repo.add_entries(
+                        RESOURCE_ID, index_entries, refresh=False
+                    )
+            else:
+                reindex_pipeline.reindex_resource(
+                    resource, ctx, workers=workers, context_factory=worker_context
+                )
+            elapsed = time.perf_counter() - started_at
+            assert counter.indexed == num_entries
+            report(
+                f"workers={workers}: {elapsed:.1f}s, "
+                f"{num_entries / elapsed:.0f} entries/s"
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
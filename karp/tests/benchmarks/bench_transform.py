@@ -0,0 +1,105 @@
+"""Per-entry cost of transforming the test `places` entries to index entries.
+
+Measured one entry at a time with the referenced entries fetched up front, so
+that only the transform is measured, and as one batch including the queries
+for referenced entries.
+Run with `python -m karp.tests.benchmarks.bench_transform [ROUNDS]`.
+"""
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from karp.domain import model
+from karp.infrastructure.sql import sql_unit_of_work
+from karp.infrastructure.sql.db import metadata
+from karp.services import context, index_handlers, transform_plan, unit_of_work
+from karp.utility import unique_id
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+def load_resource(ctx, session_factory, resource_id: str, data_file: str):
+    with open(os.path.join(DATA_DIR, "config", f"{resource_id}.json")) as fp:
+        config = json.load(fp)
+    resource = model.Resource(
+        entity_id=unique_id.make_unique_id(),
+        resource_id=resource_id,
+        name=resource_id,
+        config=config,
+        message="added",
+        version=1,
+        is_published=True,
+    )
+    with ctx.resource_uow as uw:
+        uw.repo.put(resource)
+        uw.commit()
+    entry_uow = sql_unit_of_work.SqlEntryUnitOfWork(
+        {"resource_id": resource_id, "table_name": resource_id},
+        resource_config=config,
+        session_factory=session_factory,
+    )
+    ctx.entry_uows.set_uow(resource_id, entry_uow)
+    with open(os.path.join(DATA_DIR, data_file)) as fp:
+        entries = [
+            model.create_entry(
+                entity_id=unique_id.make_unique_id(),
+                entry_id=str(body["code"]),
+                body=body,
+                resource_id=resource_id,
+            )
+            for body in map(json.loads, fp)
+        ]
+    with entry_uow as uw:
+        uw.repo.put_many(entries)
+        uw.commit()
+    return resource, entries
+
+
+def main(rounds: int = 5):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{tmp_dir}/bench.db")
+        metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine)
+        ctx = context.Context(
+            sql_unit_of_work.SqlResourceUnitOfWork(session_factory),
+            unit_of_work.EntriesUnitOfWork(),
+            sql_unit_of_work.SqlIndexUnitOfWork(session_factory),
+            None,
+        )
+        load_resource(ctx, session_factory, "municipalities", "municipality.jsonl")
+        places, entries = load_resource(ctx, session_factory, "places", "places.jsonl")
+        with ctx.resource_uow, contextlib.redirect_stdout(open(os.devnull, "w")):
+            prefetched = transform_plan.PrefetchedRefs()
+            env = transform_plan.TransformEnv(ctx, prefetched)
+            for entry in entries:
+                transform_plan.get_plan(places).collect(places, entry.body, env)
+            prefetched.fetch(ctx)
+            single = []
+            batch = []
+            for _ in range(rounds):
+                started_at = time.perf_counter()
+                for entry in entries:
+                    index_handlers.transform_to_index_entry(
+                        places, entry, ctx, prefetched=prefetched
+                    )
+                single.append(time.perf_counter() - started_at)
+                started_at = time.perf_counter()
+                index_handlers.transform_to_index_entries(places, entries, ctx)
+                batch.append(time.perf_counter() - started_at)
+    for name, timings in (("prefetched, one at a time", single), ("batch", batch)):
+        print(
+            f"{name}: {1e6 * min(timings) / len(entries):.1f} us/entry "
+            f"(best of {rounds}, {len(entries)} entries)",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -39,7 +39,8 @@ from karp import config
 
 from karp.utility import unique_id
 
-from karp.tests import common_data, utils
+from karp.tests import common_data, generated_resource, utils
+from karp.tests.unit import adapters
 
 
 from karp.infrastructure.sql.db import metadata
@@ -58,6 +59,27 @@ def sqlite_session_factory(in_memory_sqlite_db):
     yield sessionmaker(bind=in_memory_sqlite_db)
 
 
+@pytest.fixture(name="generated_ctx")
+def fixture_generated_ctx(tmp_path, monkeypatch):
+    """Return a function creating the generated resource with num_entries.
+
+    The resource is stored in a database file, that reindex workers can open,
+    and indexed by a RecordingIndex. The function returns the context and
+    the index.
+    """
+
+    def generate(num_entries: int):
+        db_url = f"sqlite:///{tmp_path}/generated.db"
+        monkeypatch.setenv(generated_resource.DB_URL_VAR, db_url)
+        index = adapters.RecordingIndex()
+        ctx = generated_resource.generate_resource(
+            db_url, num_entries, adapters.FakeIndexUnitOfWork(index)
+        )
+        return ctx, index
+
+    return generate
+
+
 # @pytest.fixture(name="db_setup")
 # def fixture_db_setup():
 #     print("running alembic upgrade ...")
@@ -0,0 +1,142 @@
+"""A generated resource of entries that refer to each other.
+
+Used by the tests and benchmarks of indexing that need a resource in a real
+database, e.g. for reindex workers in other processes.
+"""
+import os
+import random
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from karp.domain import model
+from karp.infrastructure.sql import sql_unit_of_work
+from karp.infrastructure.sql.db import metadata
+from karp.services import context, unit_of_work
+from karp.utility import unique_id
+
+
+DB_URL_VAR = "KARP_BENCH_REINDEX_DB_URL"
+
+RESOURCE_ID = "generated"
+
+CONFIG = {
+    "resource_id": RESOURCE_ID,
+    "id": "code",
+    "fields": {
+        "code": {"type": "integer"},
+        "name": {"type": "string"},
+        "parent": {
+            "type": "integer",
+            "ref": {
+                "field": {
+                    "type": "object",
+                    "fields": {"code": {"type": "integer"}, "name": {"type": "string"}},
+                }
+            },
+        },
+        "children": {
+            "virtual": True,
+            "type": "object",
+            "collection": True,
+            "function": {
+                "multi_ref": {
+                    "field": "parent",
+                    "result": {
+                        "type": "object",
+                        "fields": {
+                            "code": {"type": "integer"},
+                            "name": {"type": "string"},
+                        },
+                    },
+                    "test": {"equals": [{"self": "code"}]},
+                }
+            },
+        },
+    },
+    "referenceable": ["code", "parent"],
+}
+
+
+def create_context(
+    db_url: str, index_uow: Optional[unit_of_work.IndexUnitOfWork] = None
+) -> context.Context:
+    """A context of the resources in the database at db_url.
+
+    The sql index is used unless index_uow is given.
+    """
+    session_factory = sessionmaker(bind=create_engine(db_url))
+    if index_uow is None:
+        index_uow = sql_unit_of_work.SqlIndexUnitOfWork(session_factory)
+    ctx = context.Context(
+        sql_unit_of_work.SqlResourceUnitOfWork(session_factory),
+        unit_of_work.EntriesUnitOfWork(),
+        index_uow,
+        None,
+        outbox_uow=sql_unit_of_work.SqlOutboxUnitOfWork(session_factory),
+    )
+    with ctx.resource_uow as uw:
+        for resource in uw.repo.get_published_resources():
+            ctx.entry_uows.set_uow(
+                resource.resource_id,
+                sql_unit_of_work.SqlEntryUnitOfWork(
+                    {
+                        "resource_id": resource.resource_id,
+                        "table_name": resource.resource_id,
+                    },
+                    resource_config=resource.config,
+                    session_factory=session_factory,
+                ),
+            )
+    return ctx
+
+
+def worker_context() -> context.Context:
+    """The context of a reindex worker, of the database in DB_URL_VAR."""
+    return create_context(os.environ[DB_URL_VAR])
+
+
+def generate_resource(
+    db_url: str,
+    num_entries: int,
+    index_uow: Optional[unit_of_work.IndexUnitOfWork] = None,
+) -> context.Context:
+    """Create a published resource of num_entries entries in the database.
+
+    Each entry refers to a random parent entry, and has the entries referring
+    to it as children. Returns a context of the resource.
+    """
+    metadata.create_all(create_engine(db_url))
+    resource = model.Resource(
+        entity_id=unique_id.make_unique_id(),
+        resource_id=RESOURCE_ID,
+        name=RESOURCE_ID,
+        config=CONFIG,
+        message="generated",
+        version=1,
+        is_published=True,
+    )
+    ctx = create_context(db_url, index_uow)
+    with ctx.resource_uow as uw:
+        uw.repo.put(resource)
+        uw.commit()
+    ctx = create_context(db_url, index_uow)
+    rnd = random.Random(num_entries)
+    entries = [
+        model.create_entry(
+            entity_id=unique_id.make_unique_id(),
+            entry_id=str(code),
+            body={
+                "code": code,
+                "name": f"entry {code}",
+                "parent": rnd.randrange(num_entries),
+            },
+            resource_id=RESOURCE_ID,
+        )
+        for code in range(num_entries)
+    ]
+    with ctx.entry_uows.get(RESOURCE_ID) as uw:
+        uw.repo.put_many(entries)
+        uw.commit()
+    return ctx
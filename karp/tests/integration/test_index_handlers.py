@@ -0,0 +1,152 @@
+import json
+
+from sqlalchemy import event
+
+from karp.domain import model
+from karp.infrastructure.sql import sql_unit_of_work
+from karp.services import context, index_handlers, unit_of_work
+from karp.utility import unique_id
+
+
+def load_resource(resource_id: str, data_file: str, ctx, session_factory):
+    with open(f"karp/tests/data/config/{resource_id}.json") as fp:
+        config = json.load(fp)
+    resource = model.Resource(
+        entity_id=unique_id.make_unique_id(),
+        resource_id=resource_id,
+        name=resource_id,
+        config=config,
+        message="added",
+        version=1,
+        is_published=True,
+    )
+    with ctx.resource_uow as uw:
+        uw.repo.put(resource)
+        uw.commit()
+
+    entry_uow = sql_unit_of_work.SqlEntryUnitOfWork(
+        {"resource_id": resource_id, "table_name": resource_id},
+        resource_config=config,
+        session_factory=session_factory,
+    )
+    ctx.entry_uows.set_uow(resource_id, entry_uow)
+    with open(f"karp/tests/data/{data_file}") as fp:
+        entries = [
+            model.create_entry(
+                entity_id=unique_id.make_unique_id(),
+                entry_id=str(body["code"]),
+                body=body,
+                resource_id=resource_id,
+            )
+            for body in map(json.loads, fp)
+        ]
+    with entry_uow as uw:
+        uw.repo.put_many(entries)
+        uw.commit()
+    return resource, entries
+
+
+def normalized(index_entry):
+    return {
+        **index_entry,
+        "v_smaller_places": sorted(
+            index_entry.get("v_smaller_places", []), key=lambda place: place["code"]
+        ),
+    }
+
+
+def test_transform_to_index_entries_prefetches_refs(
+    sqlite_session_factory, in_memory_sqlite_db
+):
+    ctx = context.Context(
+        sql_unit_of_work.SqlResourceUnitOfWork(sqlite_session_factory),
+        unit_of_work.EntriesUnitOfWork(),
+        sql_unit_of_work.SqlIndexUnitOfWork(sqlite_session_factory),
+        None,
+    )
+    load_resource(
+        "municipalities", "municipality.jsonl", ctx, sqlite_session_factory
+    )
+    places, entries = load_resource(
+        "places", "places.jsonl", ctx, sqlite_session_factory
+    )
+    entries = entries[:200]
+
+    statements = []
+
+    def count_selects(conn, cursor, statement, *args):
+        # Resources are cached, count the queries for entries
+        if statement.lstrip().startswith("SELECT") and "resources" not in statement:
+            statements.append(statement)
+
+    event.listen(in_memory_sqlite_db, "before_cursor_execute", count_selects)
+    try:
+        with ctx.resource_uow:
+            batch = index_handlers.transform_to_index_entries(places, entries, ctx)
+            batch_selects = len(statements)
+            statements.clear()
+            single = [
+                index_handlers.transform_to_index_entry(places, entry, ctx)
+                for entry in entries
+            ]
+            single_selects = len(statements)
+    finally:
+        event.remove(in_memory_sqlite_db, "before_cursor_execute", count_selects)
+
+    # The order of multi_ref results is not defined
+    assert [normalized(e.entry) for e in batch] == [normalized(e.entry) for e in single]
+    assert any("v_municipality" in e.entry for e in batch)
+    assert any("v_larger_place" in e.entry for e in batch)
+    assert any("v_smaller_places" in e.entry for e in batch)
+    # One query each for municipality, larger_place and smaller_places
+    assert batch_selects == 3
+    assert single_selects > len(entries)
+
+
+def test_transform_to_index_entries_batches_multi_refs(
+    sqlite_session_factory, in_memory_sqlite_db
+):
+    ctx = context.Context(
+        sql_unit_of_work.SqlResourceUnitOfWork(sqlite_session_factory),
+        unit_of_work.EntriesUnitOfWork(),
+        sql_unit_of_work.SqlIndexUnitOfWork(sqlite_session_factory),
+        None,
+    )
+    municipalities, entries = load_resource(
+        "municipalities", "municipality.jsonl", ctx, sqlite_session_factory
+    )
+    load_resource("places", "places.jsonl", ctx, sqlite_session_factory)
+
+    statements = []
+
+    def count_selects(conn, cursor, statement, *args):
+        if statement.lstrip().startswith("SELECT") and "resources" not in statement:
+            statements.append(statement)
+
+    event.listen(in_memory_sqlite_db, "before_cursor_execute", count_selects)
+    try:
+        with ctx.resource_uow:
+            batch = index_handlers.transform_to_index_entries(
+                municipalities, entries, ctx
+            )
+            batch_selects = len(statements)
+            statements.clear()
+            single = [
+                index_handlers.transform_to_index_entry(municipalities, entry, ctx)
+                for entry in entries
+            ]
+            single_selects = len(statements)
+    finally:
+        event.remove(in_memory_sqlite_db, "before_cursor_execute", count_selects)
+
+    def sorted_places(index_entry):
+        return sorted(index_entry.get("v_places", []), key=lambda place: place["code"])
+
+    assert [sorted_places(e.entry) for e in batch] == [
+        sorted_places(e.entry) for e in single
+    ]
+    assert any("v_places" in e.entry for e in batch)
+    # The places of all municipalities are found by one query on the child
+    # table of the collection field `municipality`
+    assert batch_selects == 1
+    assert single_selects == len(entries)
@@ -0,0 +1,139 @@
+import pytest
+
+from karp.domain import commands, model
+from karp.services import index_handlers, messagebus
+from karp.utility import unique_id
+
+from karp.tests.generated_resource import RESOURCE_ID
+
+
+@pytest.fixture(name="outbox_ctx")
+def fixture_outbox_ctx(generated_ctx):
+    ctx, index = generated_ctx(20)
+    ctx.entry_uows.get(RESOURCE_ID).index_outbox = True
+    return ctx, index
+
+
+def outbox_events(ctx):
+    with ctx.outbox_uow as uw:
+        return uw.repo.outbox_events(100)
+
+
+def test_entry_events_are_indexed_from_outbox(outbox_ctx):
+    ctx, index = outbox_ctx
+    bus = messagebus.MessageBus(
+        ctx.resource_uow,
+        ctx.entry_uows,
+        ctx.index_uow,
+        None,
+        raise_on_all_errors=True,
+        index_outbox=True,
+        outbox_uow=ctx.outbox_uow,
+    )
+
+    bus.handle(
+        commands.AddEntry(
+            resource_id=RESOURCE_ID,
+            id=unique_id.make_unique_id(),
+            entry={"code": 50, "name": "entry 50", "parent": 3},
+            user="user",
+            message="added",
+        )
+    )
+    bus.handle(
+        commands.UpdateEntry(
+            resource_id=RESOURCE_ID,
+            entry_id="3",
+            version=1,
+            entry={"code": 3, "name": "renamed", "parent": 1},
+            user="user",
+            message="renamed",
+        )
+    )
+    bus.handle(
+        commands.UpdateEntry(
+            resource_id=RESOURCE_ID,
+            entry_id="3",
+            version=2,
+            entry={"code": 3, "name": "renamed again", "parent": 1},
+            user="user",
+            message="renamed",
+        )
+    )
+    bus.handle(commands.DeleteEntry(resource_id=RESOURCE_ID, entry_id="4", user="user"))
+
+    # Nothing is indexed while handling the commands
+    assert index.calls == []
+    assert [(evt.entry_id, evt.op) for evt in outbox_events(ctx)] == [
+        ("50", model.EntryOp.ADDED),
+        ("3", model.EntryOp.UPDATED),
+        ("3", model.EntryOp.UPDATED),
+        ("4", model.EntryOp.DELETED),
+    ]
+
+    index.fail_after = 0
+    with pytest.raises(ConnectionError):
+        bus.handle(commands.IndexOutboxEvents())
+    assert len(outbox_events(ctx)) == 4
+
+    index.fail_after = None
+    indexed = index.current_index(RESOURCE_ID)
+    indexed["4"] = "stale"
+    assert bus.handle(commands.IndexOutboxEvents()) == 4
+
+    assert outbox_events(ctx) == []
+    assert indexed["50"].entry["name"] == "entry 50"
+    assert indexed["3"].entry["name"] == "renamed again"
+    assert "4" not in indexed
+    assert bus.handle(commands.IndexOutboxEvents()) == 0
+
+
+def test_outbox_events_are_written_with_the_entries(outbox_ctx):
+    ctx, _ = outbox_ctx
+    with ctx.entry_uows.get(RESOURCE_ID) as uw:
+        entry = uw.repo.by_entry_id("3")
+        entry.body = {**entry.body, "name": "renamed"}
+        entry.stamp("user", message="renamed")
+        uw.repo.update(entry)
+        # Rolled back with the entry
+
+    assert outbox_events(ctx) == []
+
+    with ctx.entry_uows.get(RESOURCE_ID) as uw:
+        entry = uw.repo.by_entry_id("3")
+        entry.body = {**entry.body, "name": "renamed"}
+        entry.stamp("user", message="renamed")
+        uw.repo.update(entry)
+        uw.commit()
+        # Committing again doesn't write the event twice
+        uw.commit()
+
+    assert [evt.entry_id for evt in outbox_events(ctx)] == ["3"]
+
+
+def test_rejected_entries_dont_keep_other_events_from_being_indexed(outbox_ctx):
+    ctx, index = outbox_ctx
+    with ctx.entry_uows.get(RESOURCE_ID) as uw:
+        entry = uw.repo.by_entry_id("3")
+        entry.body = {**entry.body, "name": "renamed"}
+        entry.stamp("user", message="renamed")
+        uw.repo.update(entry)
+        uw.commit()
+    messagebus.MessageBus(
+        ctx.resource_uow,
+        ctx.entry_uows,
+        ctx.index_uow,
+        None,
+        raise_on_all_errors=True,
+        index_outbox=True,
+        outbox_uow=ctx.outbox_uow,
+    ).handle(commands.DeleteEntry(resource_id=RESOURCE_ID, entry_id="4", user="user"))
+    indexed = index.current_index(RESOURCE_ID)
+    indexed["4"] = "stale"
+    index.reject = {"3"}
+
+    assert index_handlers.index_outbox_events(commands.IndexOutboxEvents(), ctx) == 2
+
+    assert outbox_events(ctx) == []
+    assert "3" not in indexed
+    assert "4" not in indexed
@@ -0,0 +1,152 @@
+import pytest
+
+from karp.domain import commands, errors, model
+from karp.services import index_handlers, resource_views
+from karp.utility import time, unique_id
+
+from karp.tests.generated_resource import RESOURCE_ID
+
+
+def write_changes(ctx):
+    """Update entry 3, discard entry 4 and add entry 50."""
+    resource_id = RESOURCE_ID
+    with ctx.entry_uows.get(resource_id) as uw:
+        updated = uw.repo.by_entry_id("3")
+        updated.body = {**updated.body, "name": "renamed"}
+        updated.stamp("user", message="renamed")
+        uw.repo.update(updated)
+        discarded = uw.repo.by_entry_id("4")
+        discarded.discard(user="user", timestamp=discarded.last_modified + 1)
+        uw.repo.delete(discarded)
+        uw.repo.put(
+            model.create_entry(
+                entity_id=unique_id.make_unique_id(),
+                entry_id="50",
+                body={"code": 50, "name": "entry 50", "parent": 3},
+                resource_id=resource_id,
+            )
+        )
+        uw.commit()
+
+
+def assert_indexed(ctx, index_entries):
+    assert sorted(index_entries, key=int) == [str(i) for i in range(51) if i != 4]
+    assert index_entries["3"].entry["name"] == "renamed"
+    expected = {
+        entry.id: entry
+        for entry in index_handlers.pre_process_resource(RESOURCE_ID, ctx)
+    }
+    assert index_entries == expected
+
+
+def test_reindex_online_replays_writes_made_during_load(generated_ctx):
+    ctx, index = generated_ctx(50)
+    index.on_add = lambda: write_changes(ctx)
+
+    index_handlers.reindex_resource(
+        commands.ReindexResource(resource_id=RESOURCE_ID), ctx
+    )
+
+    (job,) = resource_views.get_reindex_jobs(ctx, RESOURCE_ID)
+    assert index.current[RESOURCE_ID] == job.index_name
+    assert_indexed(ctx, index.current_index(RESOURCE_ID))
+
+
+@pytest.mark.parametrize("mark", ["since_history_id", "since_timestamp"])
+def test_reindex_changed_entries(generated_ctx, mark):
+    ctx, index = generated_ctx(50)
+    resource_id = RESOURCE_ID
+    index.add_entries(
+        resource_id, index_handlers.pre_process_resource(resource_id, ctx)
+    )
+    with ctx.entry_uows.get(resource_id) as uw:
+        marks = {
+            "since_history_id": uw.repo.history_high_water_mark(),
+            "since_timestamp": time.utc_now(),
+        }
+    write_changes(ctx)
+    index.calls.clear()
+
+    new_mark = index_handlers.reindex_changed_entries(
+        commands.ReindexChangedEntries(resource_id=resource_id, **{mark: marks[mark]}),
+        ctx,
+    )
+
+    assert resource_id not in index.current
+    assert_indexed(ctx, index.current_index(resource_id))
+    assert new_mark == marks["since_history_id"] + 3
+    # Only the changed entries and the entries referring to them
+    assert {"3", "50"} <= set(index.added)
+    assert len(index.added) < 10
+
+
+def start_failing_job(ctx, index, fail_after_chunks):
+    index.fail_after = fail_after_chunks
+    with pytest.raises(ConnectionError):
+        index_handlers.reindex_resource(
+            commands.ReindexResource(resource_id=RESOURCE_ID, chunk_size=10), ctx
+        )
+    index.fail_after = None
+    (job,) = resource_views.get_reindex_jobs(ctx, RESOURCE_ID)
+    return job
+
+
+def test_resume_reindex_job(generated_ctx):
+    ctx, index = generated_ctx(50)
+    job = start_failing_job(ctx, index, fail_after_chunks=2)
+
+    assert job.status == model.ReindexJobStatus.FAILED
+    assert job.indexed == 20
+    assert RESOURCE_ID not in index.current
+    index.calls.clear()
+    write_changes(ctx)
+
+    index_handlers.resume_reindex_job(commands.ResumeReindexJob(job_id=job.id), ctx)
+
+    (job,) = resource_views.get_reindex_jobs(ctx)
+    assert job.status == model.ReindexJobStatus.FINISHED
+    assert index.current[RESOURCE_ID] == job.index_name
+    assert_indexed(ctx, index.indices[job.index_name])
+    # Only the entries after the checkpoint and the replayed changes
+    assert len(index.added) < 40
+    with pytest.raises(errors.ReindexJobNotResumable):
+        index_handlers.resume_reindex_job(commands.ResumeReindexJob(job_id=job.id), ctx)
+
+
+def test_abandon_reindex_job(generated_ctx):
+    ctx, index = generated_ctx(50)
+    job = start_failing_job(ctx, index, fail_after_chunks=1)
+
+    index_handlers.abandon_reindex_job(commands.AbandonReindexJob(job_id=job.id), ctx)
+
+    (job,) = resource_views.get_reindex_jobs(ctx)
+    assert job.status == model.ReindexJobStatus.ABANDONED
+    assert job.index_name not in index.indices
+    assert RESOURCE_ID not in index.current
+    with pytest.raises(errors.ReindexJobNotResumable):
+        index_handlers.resume_reindex_job(commands.ResumeReindexJob(job_id=job.id), ctx)
+
+
+def test_reindex_job_with_rejected_entries_does_not_switch(generated_ctx):
+    ctx, index = generated_ctx(50)
+    resource_id = RESOURCE_ID
+    index.reject = {"7"}
+    with pytest.raises(errors.IndexingFailed):
+        index_handlers.reindex_resource(
+            commands.ReindexResource(resource_id=resource_id, chunk_size=10), ctx
+        )
+
+    (job,) = resource_views.get_reindex_jobs(ctx, resource_id)
+    assert job.status == model.ReindexJobStatus.FAILED
+    assert job.failed_entry_ids == ["7"]
+    assert job.indexed == 50
+    assert resource_id not in index.current
+
+    index.reject.clear()
+    index_handlers.resume_reindex_job(commands.ResumeReindexJob(job_id=job.id), ctx)
+
+    (job,) = resource_views.get_reindex_jobs(ctx, resource_id)
+    assert job.status == model.ReindexJobStatus.FINISHED
+    assert job.failed_entry_ids == []
+    assert index.current[resource_id] == job.index_name
+    assert "7" in index.indices[job.index_name]
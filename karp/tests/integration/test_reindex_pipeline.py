@@ -0,0 +1,48 @@
+from karp.services import index_handlers, reindex_pipeline
+
+from karp.tests.generated_resource import RESOURCE_ID, worker_context
+
+
+def test_reindex_with_workers(generated_ctx):
+    ctx, index = generated_ctx(250)
+    with ctx.resource_uow as uw:
+        resource = uw.repo.by_resource_id(RESOURCE_ID)
+
+    report = reindex_pipeline.reindex_resource(
+        resource,
+        ctx,
+        workers=2,
+        chunk_size=40,
+        context_factory=worker_context,
+    )
+
+    assert report["entries"] == 250
+    expected = index_handlers.pre_process_resource(resource.resource_id, ctx)
+    assert index.indices[index.current[RESOURCE_ID]] == {
+        entry.id: entry for entry in expected
+    }
+
+
+def test_reindex_with_workers_reports_chunks_in_read_order(generated_ctx):
+    ctx, index = generated_ctx(250)
+    with ctx.resource_uow as uw:
+        resource = uw.repo.by_resource_id(RESOURCE_ID)
+    with ctx.entry_uows.get(RESOURCE_ID) as uw:
+        entry_ids = [entry.entry_id for entry in uw.repo.iter_entries()]
+
+    checkpoints = []
+    reindex_pipeline.reindex_resource(
+        resource,
+        ctx,
+        workers=2,
+        chunk_size=40,
+        context_factory=worker_context,
+        after_entry_id=entry_ids[9],
+        on_chunk_indexed=lambda *checkpoint: checkpoints.append(checkpoint),
+    )
+
+    assert sorted(index.added) == sorted(entry_ids[10:])
+    assert checkpoints == [
+        (entry_ids[min(start + 40, 250) - 1], min(40, 250 - start), [])
+        for start in range(10, 250, 40)
+    ]
@@ -1,4 +1,9 @@
+import json
+import zlib
+
 import pytest
+from sqlalchemy import event
+from sb_json_tools import jsondiff
 
 from karp.domain.models.entry import (
     create_entry,
@@ -8,6 +13,7 @@ from karp.domain.models.entry import (
 from karp.domain import repository
 
 # from karp.infrastructure.unit_of_work import unit_of_work
+from karp.infrastructure.sql import compression
 from karp.infrastructure.sql.sql_entry_repository import SqlEntryRepository
 from karp.utility import unique_id
 
@@ -65,6 +71,180 @@ def test_put_entry_to_entry_repo(entry_repo):
     assert entry_repo.by_entry_id(entry_id).id == entity_id
 
 
+def test_put_many_entries_to_entry_repo(sqlite_session_factory):
+    session = sqlite_session_factory()
+    resource_config = {
+        "fields": {
+            "code": {"type": "integer"},
+            "larger_place": {"type": "integer"},
+            "municipality": {"type": "integer", "collection": True},
+        },
+        "referenceable": ["code", "larger_place", "municipality"],
+    }
+    entry_repo = SqlEntryRepository.from_dict(
+        settings={"table_name": "test_many", "resource_id": "test_many"},
+        resource_config=resource_config,
+        session=session,
+    )
+    entries = [
+        create_entry(
+            body={"code": code, "municipality": [1, code]},
+            entry_id=str(code),
+            entity_id=unique_id.make_unique_id(),
+            resource_id="test_many",
+        )
+        for code in range(2, 12)
+    ]
+    entries[0].body["larger_place"] = 3
+    entry_repo.put_many(entries)
+
+    assert sorted(entry_repo.entry_ids()) == sorted(e.entry_id for e in entries)
+    for entry in entries:
+        assert entry_repo.by_entry_id(entry.entry_id).id == entry.id
+        assert entry in entry_repo.seen
+    assert len(entry_repo.by_referenceable({"municipality": 1})) == 10
+    assert [e.entry_id for e in entry_repo.by_referenceable({"larger_place": 3})] == [
+        "2"
+    ]
+    assert [e.entry_id for e in entry_repo.by_referenceable({"municipality": 5})] == [
+        "5"
+    ]
+
+    entry_repo.teardown()
+
+
+def test_by_entry_id_reads_current_version_from_runtime(entry_repo):
+    entity_id = unique_id.make_unique_id()
+    entry = create_entry(
+        body={"a": 1}, entry_id="a", entity_id=entity_id, resource_id="test_name"
+    )
+    entry_repo.put(entry)
+    for value in (2, 3):
+        entry = entry_repo.by_entry_id("a")
+        entry.body = {"a": value}
+        entry.stamp("user", message="changed")
+        entry_repo.update(entry)
+
+    current = entry_repo.by_entry_id("a")
+    assert current.version == 3
+    assert current.body == {"a": 3}
+    assert entry_repo.by_entry_id("a", version=2).body == {"a": 2}
+
+    current.discard(user="user", timestamp=current.last_modified + 1)
+    entry_repo.update(current)
+    assert entry_repo.by_entry_id("a").discarded
+
+
+def test_by_entry_id_reads_deleted_version(entry_repo):
+    entry = create_entry(
+        body={"a": 1},
+        entry_id="a",
+        entity_id=unique_id.make_unique_id(),
+        resource_id="test_name",
+    )
+    entry_repo.put(entry)
+
+    entry = entry_repo.by_entry_id("a")
+    entry.discard(user="user", timestamp=entry.last_modified + 1)
+    entry_repo.delete(entry)
+
+    deleted = entry_repo.by_entry_id("a")
+    assert deleted.discarded
+    assert deleted.version == 2
+
+
+def test_by_entry_ids(entry_repo, monkeypatch):
+    from karp.infrastructure.sql import sql_entry_repository
+
+    monkeypatch.setattr(sql_entry_repository, "IN_CLAUSE_CHUNK_SIZE", 2)
+    entries = [
+        create_entry(
+            body={"id": entry_id},
+            entry_id=entry_id,
+            entity_id=unique_id.make_unique_id(),
+            resource_id="test_name",
+        )
+        for entry_id in ["a", "b", "c", "d", "e"]
+    ]
+    entry_repo.put_many(entries)
+
+    result = entry_repo.by_entry_ids(["e", "a", "missing", "c", "a", "d"])
+    assert sorted(result.keys()) == ["a", "c", "d", "e"]
+    assert result["c"].id == entries[2].id
+    assert entry_repo.by_entry_ids([]) == {}
+
+
+def test_get_history_with_cursor(entry_repo):
+    entries = [
+        create_entry(
+            body={"id": entry_id},
+            entry_id=entry_id,
+            entity_id=unique_id.make_unique_id(),
+            resource_id="test_name",
+            last_modified_by="user1" if entry_id in "ace" else "user2",
+        )
+        for entry_id in ["a", "b", "c", "d", "e"]
+    ]
+    entry_repo.put_many(entries)
+
+    page, total, cursor = entry_repo.get_history(limit=2)
+    assert [entry.entry_id for entry in page] == ["a", "b"]
+    assert total == 5
+    assert cursor is not None
+
+    page, total, cursor = entry_repo.get_history(
+        limit=2, cursor=cursor, with_total=False
+    )
+    assert [entry.entry_id for entry in page] == ["c", "d"]
+    assert total is None
+
+    page, total, cursor = entry_repo.get_history(limit=2, cursor=cursor)
+    assert [entry.entry_id for entry in page] == ["e"]
+    assert total == 5
+    assert cursor is None
+
+    page, total, cursor = entry_repo.get_history(user_id="user1", limit=2)
+    assert [entry.entry_id for entry in page] == ["a", "c"]
+    page, total, cursor = entry_repo.get_history(
+        user_id="user1", limit=2, cursor=cursor
+    )
+    assert [entry.entry_id for entry in page] == ["e"]
+    assert total == 3
+
+
+def test_iter_entries_yields_current_entries_in_chunks(entry_repo):
+    entries = [
+        create_entry(
+            body={"n": 0},
+            entry_id=entry_id,
+            entity_id=unique_id.make_unique_id(),
+            resource_id="test_name",
+        )
+        for entry_id in ["c", "a", "e", "b", "d"]
+    ]
+    entry_repo.put_many(entries)
+
+    entry_b = entry_repo.by_entry_id("b")
+    entry_b.body = {"n": 1}
+    entry_b.stamp("user", message="changed")
+    entry_repo.update(entry_b)
+
+    entry_d = entry_repo.by_entry_id("d")
+    entry_d.discard(user="user", timestamp=entry_d.last_modified + 1)
+    entry_repo.update(entry_d)
+
+    result = list(entry_repo.iter_entries(chunk_size=2))
+    assert [entry.entry_id for entry in result] == ["a", "b", "c", "e"]
+    assert result[1].body == {"n": 1}
+    assert result[1].version == 2
+    assert [entry.entry_id for entry in entry_repo.all_entries()] == [
+        "a",
+        "b",
+        "c",
+        "e",
+    ]
+
+
 #         uw.commit()
 
 #         assert uw.entry_ids() == ["a"]
@@ -78,6 +258,253 @@ def test_put_entry_to_entry_repo(entry_repo):
 #         assert entry_copy_from_str.id == entry.id
 
 
+def test_create_missing_indexes(entry_repo):
+    history_table = entry_repo.history_model.__table__
+    index_names = sorted(index.name for index in history_table.indexes)
+    assert len(index_names) == 4
+    assert entry_repo.create_missing_indexes() == []
+
+    bind = entry_repo._session.bind
+    for index in history_table.indexes:
+        index.drop(bind=bind)
+
+    assert entry_repo.create_missing_indexes() == index_names
+    assert entry_repo.create_missing_indexes() == []
+
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd"])
+def test_put_entry_with_compressed_body(sqlite_session_factory, codec):
+    pytest.importorskip("zstandard")
+    table_name = f"test_compressed_{codec}"
+    session = sqlite_session_factory()
+    entry_repo = SqlEntryRepository.from_dict(
+        settings={
+            "table_name": table_name,
+            "resource_id": table_name,
+            "body_compression": codec,
+        },
+        resource_config={},
+        session=session,
+    )
+    body = {"name": "å" * 100}
+    entry_repo.put(
+        create_entry(
+            body=body,
+            entry_id="a",
+            entity_id=unique_id.make_unique_id(),
+            resource_id=table_name,
+        )
+    )
+
+    (stored,) = session.execute(f"SELECT body FROM {table_name}").one()
+    assert isinstance(stored, bytes)
+    assert len(stored) < len(json.dumps(body))
+    assert entry_repo.by_entry_id("a").body == body
+
+
+def test_migrate_body_storage(sqlite_session_factory):
+    session = sqlite_session_factory()
+    entry_repo = SqlEntryRepository.from_dict(
+        settings={
+            "table_name": "test_migrate",
+            "resource_id": "test_migrate",
+            "body_compression": "zlib",
+        },
+        resource_config={},
+        session=session,
+    )
+    entry_repo.put(
+        create_entry(
+            body={"a": 1},
+            entry_id="a",
+            entity_id=unique_id.make_unique_id(),
+            resource_id="test_migrate",
+        )
+    )
+    # A body stored before compression was turned on
+    session.execute(
+        """UPDATE test_migrate SET body = '{"a": 2}' WHERE entry_id = 'a'"""
+    )
+    assert entry_repo.by_entry_id("a").body == {"a": 2}
+
+    stats = entry_repo.migrate_body_storage(chunk_size=1)
+
+    assert stats["rows"] == 1
+    (stored,) = session.execute("SELECT body FROM test_migrate").one()
+    assert zlib.decompress(stored) == b'{"a":2}'
+    assert entry_repo.by_entry_id("a").body == {"a": 2}
+
+
+def test_migrate_body_storage_from_other_dictionary(sqlite_session_factory, tmp_path):
+    dictionary_path = tmp_path / "bodies.dict"
+    dictionary_path.write_bytes(b'{"baseform":"","pos":"nn"}' * 10)
+    session = sqlite_session_factory()
+    entry_repo = SqlEntryRepository.from_dict(
+        settings={
+            "table_name": "test_migrate_dict",
+            "resource_id": "test_migrate_dict",
+            "body_compression": "zlib",
+            "history_storage": "delta",
+            "history_snapshot_interval": 2,
+        },
+        resource_config={},
+        session=session,
+    )
+    entry = create_entry(
+        body={"baseform": "hus", "pos": "nn"},
+        entry_id="a",
+        entity_id=unique_id.make_unique_id(),
+        resource_id="test_migrate_dict",
+    )
+    entry_repo.put(entry)
+    entry = entry_repo.by_entry_id("a")
+    entry.body = {"baseform": "huset", "pos": "nn"}
+    entry.stamp("user", message="changed")
+    entry_repo.update(entry)
+    # Bodies stored before the dictionary was dropped from the settings
+    old_codec = compression.ZlibCodec(dictionary=dictionary_path.read_bytes())
+    for name in ("body", "delta", "diff"):
+        for history_id, value in session.execute(
+            f"SELECT history_id, {name} FROM test_migrate_dict"
+        ).all():
+            if value is not None:
+                session.execute(
+                    f"UPDATE test_migrate_dict SET {name} = :value"
+                    " WHERE history_id = :history_id",
+                    {
+                        "value": compression.encode_body(
+                            compression.decode_body(value), old_codec
+                        ),
+                        "history_id": history_id,
+                    },
+                )
+
+    stats = entry_repo.migrate_body_storage(
+        source_settings={
+            "body_compression": "zlib",
+            "body_compression_dictionary": str(dictionary_path),
+        }
+    )
+
+    assert stats["rows"] == 2
+    rows = session.execute(
+        "SELECT body, delta, diff FROM test_migrate_dict ORDER BY history_id"
+    ).all()
+    assert json.loads(zlib.decompress(rows[0].body)) == {
+        "baseform": "hus",
+        "pos": "nn",
+    }
+    assert rows[1].body is None
+    assert json.loads(zlib.decompress(rows[1].delta))
+    assert json.loads(zlib.decompress(rows[1].diff))
+    assert entry_repo.by_entry_id("a").body == {"baseform": "huset", "pos": "nn"}
+
+
+def test_delta_history(sqlite_session_factory):
+    session = sqlite_session_factory()
+    entry_repo = SqlEntryRepository.from_dict(
+        settings={
+            "table_name": "test_delta",
+            "resource_id": "test_delta",
+            "history_storage": "delta",
+            "history_snapshot_interval": 3,
+        },
+        resource_config={},
+        session=session,
+    )
+    bodies = [
+        {"a": 1, "b": {"c": 1, "d": [1]}},
+        {"a": 2, "b": {"c": 1, "d": [1]}},
+        {"a": 2, "b": {"c": 0, "d": [1, 2]}},
+        {"a": 2, "b": {"d": [1, 2]}, "e": "x"},
+        {"b": {"d": []}, "e": "x"},
+        {"b": {"d": []}, "e": "y"},
+        {"a": 3},
+    ]
+    entry = create_entry(
+        body=bodies[0],
+        entry_id="a",
+        entity_id=unique_id.make_unique_id(),
+        resource_id="test_delta",
+    )
+    entry_repo.put(entry)
+    for body in bodies[1:]:
+        entry = entry_repo.by_entry_id("a")
+        entry.body = body
+        entry.stamp("user", message="changed")
+        entry_repo.update(entry)
+
+    stored = session.execute(
+        "SELECT version, body IS NOT NULL, snapshot_version"
+        " FROM test_delta ORDER BY version"
+    ).all()
+    assert stored == [
+        (1, 1, 1),
+        (2, 0, 1),
+        (3, 0, 1),
+        (4, 1, 4),
+        (5, 0, 4),
+        (6, 0, 4),
+        (7, 1, 7),
+    ]
+    for version, body in enumerate(bodies, start=1):
+        assert entry_repo.by_entry_id("a", version=version).body == body
+        assert entry_repo.by_id(entry.id, version=version).body == body
+    assert entry_repo.by_entry_id("a").body == bodies[-1]
+    assert entry_repo.by_entry_ids(["a"])["a"].body == bodies[-1]
+
+    history, total, _ = entry_repo.get_history_with_diffs(entry_id="a")
+    assert total == 7
+    assert [entry.body for entry, _ in history] == bodies
+    assert history[0][1] == jsondiff.compare({}, bodies[0])
+    for (_, diff), previous, body in zip(history[1:], bodies, bodies[1:]):
+        assert diff == jsondiff.compare(previous, body)
+
+
+def test_delta_history_reads_previous_versions_of_batch_at_once(
+    sqlite_session_factory,
+):
+    session = sqlite_session_factory()
+    entry_repo = SqlEntryRepository.from_dict(
+        settings={
+            "table_name": "test_delta_batch",
+            "resource_id": "test_delta_batch",
+            "history_storage": "delta",
+            "history_snapshot_interval": 3,
+        },
+        resource_config={},
+        session=session,
+    )
+    entry_repo.put_many(
+        create_entry(
+            body={"n": n},
+            entry_id=str(n),
+            entity_id=unique_id.make_unique_id(),
+            resource_id="test_delta_batch",
+        )
+        for n in range(5)
+    )
+    entries = list(entry_repo.by_entry_ids([str(n) for n in range(5)]).values())
+    for entry in entries:
+        entry.body = {"n": entry.body["n"], "changed": True}
+        entry.stamp("user", message="changed")
+    statements = []
+
+    @event.listens_for(session.bind, "before_cursor_execute")
+    def receive_before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        statements.append(statement)
+
+    entry_repo._insert_history_many(entries)
+
+    event.remove(session.bind, "before_cursor_execute", receive_before_cursor_execute)
+    # The previous versions, the insert and the new history ids
+    assert len(statements) == 3
+    for entry in entries:
+        assert entry_repo.by_id(entry.id, version=2).body == entry.body
+
+
 def test_create_entry_repository2(entry_repo2):
     assert entry_repo2.entry_ids() == []
 
@@ -12,7 +12,7 @@ from karp.domain.errors import IntegrityError
 # from karp.domain.models.lexical_resource import LexicalResource
 # from karp.infrastructure.unit_of_work import unit_of_work
 from karp.services import handlers
-from karp.infrastructure.sql import db
+from karp.infrastructure.sql import db, sql_models
 from karp.infrastructure.sql.sql_resource_repository import SqlResourceRepository
 from karp.utility import unique_id, time
 
@@ -31,6 +31,27 @@ def test_sql_resource_repo_empty(resource_repo):
     assert resource_repo.history_by_resource_id("test_id") == []
 
 
+def test_sql_resource_repo_history_stamp_changes_with_resources(resource_repo):
+    assert resource_repo.history_stamp() is None
+
+    resource = model.create_resource(
+        entity_id=unique_id.make_unique_id(),
+        resource_id="test_id",
+        config={"resource_id": "test_id", "resource_name": "Test"},
+        message="add resource",
+        created_by="kristoff@example.com",
+    )
+    resource_repo.put(resource)
+    resource_repo._session.commit()
+    stamp = resource_repo.history_stamp()
+    assert stamp is not None
+
+    resource.publish(user="kristoff@example.com", message="publish")
+    resource_repo.update(resource)
+    resource_repo._session.commit()
+    assert resource_repo.history_stamp() != stamp
+
+
 def test_sql_resource_repo_put_resource(resource_repo):
     resource_id = "test_id"
     resource_name = "Test"
@@ -344,3 +365,44 @@ def test_sql_resource_repo_put_another_resource(resource_repo):
 
 
 # def test_sql_resource_repo_
+
+
+def test_sql_resource_repo_caches_resources(resource_repo, in_memory_sqlite_db):
+    resource_id = "test_cached"
+    resource = model.create_resource(
+        entity_id=unique_id.make_unique_id(),
+        resource_id=resource_id,
+        config={"resource_id": resource_id, "resource_name": "Test"},
+        message="add resource",
+        created_by="kristoff@example.com",
+    )
+    resource_repo.put(resource)
+    resource_repo._session.commit()
+    resource_repo.invalidate_changed()
+    first = resource_repo.by_resource_id(resource_id)
+
+    statements = []
+
+    @db.event.listens_for(in_memory_sqlite_db, "before_cursor_execute")
+    def receive_before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        statements.append(statement)
+
+    second = resource_repo.by_resource_id(resource_id)
+    assert resource_repo.by_resource_id(resource_id, version=1).version == 1
+    assert statements == []
+    assert second is not first
+    assert second.id == first.id
+    assert second.config == first.config
+
+    # A new version written by another process
+    other = SqlResourceRepository(resource_repo._session)
+    other_resource = resource_repo.by_resource_id(resource_id)
+    other_resource.stamp(user="other", message="changed")
+    resource_repo._session.add(sql_models.ResourceDTO.from_entity(other_resource))
+    resource_repo._session.commit()
+    assert resource_repo.by_resource_id(resource_id).version == 1
+
+    resource_repo._cache.stamp_ttl = 0
+    assert other.by_resource_id(resource_id).version == 2
@@ -1,7 +1,9 @@
 import pytest
+from sqlalchemy import event
 
 from karp.domain import model
 from karp.infrastructure.sql import sql_unit_of_work
+from karp.infrastructure.sql.db import metadata
 from karp.utility import unique_id
 
 
@@ -51,6 +53,30 @@ class TestSqlResourceUnitOfWork:
         rows = list(new_session.execute('SELECT * FROM "resources"'))
         assert rows == []
 
+    def test_caches_committed_resources_only(self, sqlite_session_factory):
+        uow = sql_unit_of_work.SqlResourceUnitOfWork(sqlite_session_factory)
+        with uow:
+            uow.resources.put(random_resource())
+            uow.commit()
+        with uow:
+            cached = uow.resources.by_resource_id("abc")
+            cached.config["fields"]["name"] = {"type": "string"}
+            assert uow.resources.by_resource_id("abc").config == {"fields": {}}
+            cached.stamp(user="user", message="changed")
+            uow.resources.update(cached)
+            # The changed resource is read from this session
+            assert uow.resources.by_resource_id("abc").version == 2
+            with sql_unit_of_work.SqlResourceUnitOfWork(
+                sqlite_session_factory
+            ) as other_uow:
+                assert other_uow.resources.by_resource_id("abc").version == 1
+            uow.commit()
+
+        with uow:
+            resource = uow.resources.by_resource_id("abc")
+            assert resource.version == 2
+            assert resource.config == {"fields": {"name": {"type": "string"}}}
+
 
 class TestSqlEntryUnitOfWork:
     def test_rolls_back_uncommitted_work_by_default(self, sqlite_session_factory):
@@ -85,3 +111,51 @@ class TestSqlEntryUnitOfWork:
         new_session = sqlite_session_factory()
         rows = list(new_session.execute('SELECT * FROM "resources"'))
         assert rows == []
+
+    def test_creates_tables_once(self, sqlite_session_factory, in_memory_sqlite_db):
+        uow = sql_unit_of_work.SqlEntryUnitOfWork(
+            {"resource_id": "abc", "table_name": "abc"},
+            resource_config={"resource_id": "abc", "config": {}},
+            session_factory=sqlite_session_factory,
+        )
+        statements = []
+
+        @event.listens_for(in_memory_sqlite_db, "before_cursor_execute")
+        def receive_before_cursor_execute(
+            conn, cursor, statement, parameters, context, executemany
+        ):
+            statements.append(statement)
+
+        with uow:
+            uow.entries.put(random_entry(resource_id="abc"))
+            uow.commit()
+        with uow:
+            assert uow.entries.entry_ids() == ["abc..1"]
+
+        assert not [
+            statement
+            for statement in statements
+            if statement.lstrip().upper().startswith(("CREATE", "PRAGMA"))
+        ]
+
+    def test_creates_dropped_tables_again(
+        self, sqlite_session_factory, in_memory_sqlite_db
+    ):
+        def create_uow():
+            return sql_unit_of_work.SqlEntryUnitOfWork(
+                {"resource_id": "abc", "table_name": "abc"},
+                resource_config={"resource_id": "abc", "config": {}},
+                session_factory=sqlite_session_factory,
+            )
+
+        with create_uow() as uow:
+            uow.entries.put(random_entry(resource_id="abc"))
+            uow.commit()
+
+        metadata.drop_all(bind=in_memory_sqlite_db)
+
+        with create_uow() as uow:
+            uow.entries.put(random_entry(resource_id="abc"))
+            uow.commit()
+        with create_uow() as uow:
+            assert uow.entries.entry_ids() == ["abc..1"]
@@ -0,0 +1,135 @@
+import collections
+
+import pytest
+
+from karp.application import config
+from karp.domain import commands, model
+from karp.services import index_handlers, network_handlers
+
+from karp.tests.generated_resource import RESOURCE_ID
+
+
+@pytest.fixture(name="refs_ctx")
+def fixture_refs_ctx(generated_ctx):
+    return generated_ctx(100)
+
+
+def get_resource_and_entries(ctx):
+    with ctx.resource_uow as uw:
+        resource = uw.repo.by_resource_id(RESOURCE_ID)
+    with ctx.entry_uows.get(RESOURCE_ID) as uw:
+        entries = uw.repo.by_entry_ids(str(code) for code in range(30))
+    return resource, list(entries.values())
+
+
+def related_entry_ids(resource, entries, ctx) -> collections.Counter:
+    """The related entries, found one entry at a time."""
+    related = collections.Counter()
+    for entry in entries:
+        for field_ref in network_handlers.get_referenced_entries(
+            resource, None, entry.entry_id, ctx
+        ):
+            related[field_ref["entry"].entry_id] += 1
+    return related
+
+
+def test_update_references_indexes_each_related_entry_once(refs_ctx):
+    ctx, index = refs_ctx
+    resource, entries = get_resource_and_entries(ctx)
+
+    with ctx.index_uow:
+        index_handlers._update_references(resource, entries, ctx)
+
+    related = related_entry_ids(resource, entries, ctx)
+    assert len(index.calls) == 1
+    assert sorted(index.added, key=int) == sorted(related, key=int)
+    # Entries related to several of entries would have been indexed once each
+    assert len(index.added) < sum(related.values())
+
+
+def test_update_references_skips_discarded_referrers(refs_ctx):
+    ctx, index = refs_ctx
+    resource, entries = get_resource_and_entries(ctx)
+    with ctx.entry_uows.get(RESOURCE_ID) as uw:
+        referrer = next(
+            entry
+            for entry in uw.repo.all_entries()
+            if entry.body["parent"] == int(entries[0].entry_id)
+        )
+        referrer.discard(user="user", timestamp=referrer.last_modified + 1)
+        uw.repo.delete(referrer)
+        uw.commit()
+
+    with ctx.index_uow:
+        index_handlers._update_references(resource, entries[:1], ctx)
+
+    assert referrer.entry_id not in index.added
+
+
+def test_update_references_chunks_at_fanout_limit(refs_ctx, monkeypatch):
+    ctx, index = refs_ctx
+    monkeypatch.setattr(config, "INDEX_REFERENCE_FANOUT_LIMIT", 5)
+    resource, entries = get_resource_and_entries(ctx)
+
+    with ctx.index_uow:
+        index_handlers._update_references(resource, entries, ctx)
+
+    assert len(index.calls) > 1
+    assert all(len(entry_ids) <= 5 for _, entry_ids in index.calls)
+    assert set(index.added) == set(related_entry_ids(resource, entries, ctx))
+    assert len(index.added) == len(set(index.added))
+
+
+def test_update_references_leaves_overflow_to_index_worker(refs_ctx, monkeypatch):
+    ctx, index = refs_ctx
+    monkeypatch.setattr(config, "INDEX_REFERENCE_FANOUT_LIMIT", 5)
+    ctx.index_outbox = True
+    resource, entries = get_resource_and_entries(ctx)
+
+    with ctx.index_uow:
+        index_handlers._update_references(resource, entries, ctx)
+
+    related = related_entry_ids(resource, entries, ctx)
+    assert len(index.added) == 5
+    with ctx.outbox_uow as uw:
+        outbox_events = uw.repo.outbox_events(1000)
+    assert collections.Counter(
+        (evt.op, evt.references_only) for evt in outbox_events
+    ) == {(model.EntryOp.UPDATED, True): len(related) - 5}
+    assert set(index.added) | {evt.entry_id for evt in outbox_events} == set(related)
+
+    num_events = index_handlers.index_outbox_events(commands.IndexOutboxEvents(), ctx)
+
+    assert num_events == len(outbox_events)
+    assert {evt.entry_id for evt in outbox_events} <= set(index.added)
+
+    with ctx.outbox_uow as uw:
+        assert uw.repo.outbox_events(1000) == []
+
+
+def test_index_worker_drains_overflow_of_related_entries(refs_ctx, monkeypatch):
+    ctx, index = refs_ctx
+    monkeypatch.setattr(config, "INDEX_REFERENCE_FANOUT_LIMIT", 5)
+    ctx.index_outbox = True
+    resource, entries = get_resource_and_entries(ctx)
+
+    with ctx.index_uow:
+        index_handlers._update_references(resource, entries, ctx)
+        # Related entries already in the outbox aren't put there again
+        index_handlers._update_references(resource, entries, ctx)
+
+    related = related_entry_ids(resource, entries, ctx)
+    with ctx.outbox_uow as uw:
+        assert len(uw.repo.outbox_events(1000)) == len(related) - 5
+
+    for _ in range(len(related)):
+        if not index_handlers.index_outbox_events(
+            commands.IndexOutboxEvents(batch_size=10), ctx
+        ):
+            break
+
+    with ctx.outbox_uow as uw:
+        assert uw.repo.outbox_events(1000) == []
+    assert set(index.added) == set(related)
+    # The first 5 were indexed by both calls, the rest by the index worker
+    assert len(index.added) == len(related) + 5
@@ -2,7 +2,7 @@ import dataclasses
 import typing
 from typing import List
 from karp import bootstrap
-from karp.domain import index, repository, model
+from karp.domain import errors, index, repository, model
 from karp.services import messagebus, unit_of_work
 
 
@@ -10,6 +10,7 @@ class FakeResourceRepository(repository.ResourceRepository):
     def __init__(self):
         super().__init__()
         self.resources = set()
+        self.jobs = {}
 
     def check_status(self):
         pass
@@ -37,6 +38,19 @@ class FakeResourceRepository(repository.ResourceRepository):
     def resource_ids(self) -> typing.Iterable[str]:
         return (res.resource_id for res in self.resources)
 
+    def put_reindex_job(self, job):
+        self.jobs[job.id] = job
+
+    def reindex_job_by_id(self, job_id):
+        return self.jobs.get(job_id)
+
+    def reindex_jobs(self, resource_id=None):
+        return [
+            job
+            for job in self.jobs.values()
+            if resource_id is None or job.resource_id == resource_id
+        ]
+
 
 class FakeEntryRepository(repository.EntryRepository, repository_type="fake"):
     def __init__(self):
@@ -75,6 +89,9 @@ class FakeEntryRepository(repository.EntryRepository, repository_type="fake"):
     ):
         return next((r for r in self.entries if r.entry_id == entry_id), None)
 
+    def _by_entry_ids(self, entry_ids):
+        return {r.entry_id: r for r in self.entries if r.entry_id in entry_ids}
+
     def __len__(self):
         return len(self.entries)
 
@@ -103,15 +120,28 @@ class FakeIndex(index.Index, index_type="fake"):
         super().__init__()
         self.indicies = {}
 
-    def create_index(self, resource_id: str, config: typing.Dict):
-        self.indicies[resource_id] = FakeIndex.Index(config=config)
+    def create_index(
+        self, resource_id: str, config: typing.Dict, *, make_current: bool = True
+    ):
+        index_name = resource_id
+        if not make_current:
+            index_name = f"{resource_id}_{len(self.indicies)}"
+        self.indicies[index_name] = FakeIndex.Index(config=config)
+        return index_name
 
     def publish_index(self, alias_name: str, index_name: str = None):
         self.indicies[alias_name].published = True
 
-    def add_entries(self, resource_id: str, entries: typing.List[index.IndexEntry]):
+    def add_entries(
+        self,
+        resource_id: str,
+        entries: typing.List[index.IndexEntry],
+        *,
+        refresh: bool = True,
+        index_name: typing.Optional[str] = None,
+    ):
         for entry in entries:
-            self.indicies[resource_id].entries[entry.id] = entry
+            self.indicies[index_name or resource_id].entries[entry.id] = entry
 
     def delete_entry(
         self,
@@ -119,8 +149,16 @@ class FakeIndex(index.Index, index_type="fake"):
         *,
         entry_id: typing.Optional[str],
         # entry: typing.Optional[model.Entry]
+        index_name: typing.Optional[str] = None,
     ):
-        del self.indicies[resource_id].entries[entry_id]
+        self.indicies[index_name or resource_id].entries.pop(entry_id, None)
+
+    def delete_index(self, resource_id: str, index_name: str):
+        self.indicies.pop(index_name, None)
+
+    def switch_index(self, resource_id: str, index_name: str):
+        self.indicies[resource_id] = self.indicies.pop(index_name)
+        self.indicies[resource_id].published = True
 
     def search_ids(self, resource_id: str, entry_ids: str):
         return {}
@@ -135,6 +173,86 @@ class FakeIndex(index.Index, index_type="fake"):
         return {}
 
 
+class RecordingIndex(FakeIndex, index_type="recording"):
+    """Keeps the entries of each index and records the writes.
+
+    The current index of a resource is named after it until a new index is
+    switched to. add_entries raises ConnectionError once fail_after calls are
+    made, rejects the entries in reject with IndexingFailed, and calls
+    on_add once after the first call.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.indices: typing.Dict[str, typing.Dict[str, index.IndexEntry]] = {}
+        self.current: typing.Dict[str, str] = {}
+        self.calls: typing.List[typing.Tuple[str, typing.List[str]]] = []
+        self.fail_after: typing.Optional[int] = None
+        self.reject: typing.Set[str] = set()
+        self.on_add: typing.Optional[typing.Callable[[], None]] = None
+
+    @property
+    def added(self) -> typing.List[str]:
+        return [entry_id for _, entry_ids in self.calls for entry_id in entry_ids]
+
+    def current_index(self, resource_id: str) -> typing.Dict[str, index.IndexEntry]:
+        return self.indices.setdefault(self.current.get(resource_id, resource_id), {})
+
+    def create_index(
+        self, resource_id: str, config: typing.Dict, *, make_current: bool = True
+    ):
+        index_name = f"{resource_id}_{len(self.indices)}"
+        self.indices[index_name] = {}
+        if make_current:
+            self.current[resource_id] = index_name
+        return index_name
+
+    def add_entries(
+        self,
+        resource_id: str,
+        entries: typing.Iterable[index.IndexEntry],
+        *,
+        refresh: bool = True,
+        index_name: typing.Optional[str] = None,
+    ):
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            raise ConnectionError("index is down")
+        entries = list(entries)
+        accepted = [entry for entry in entries if entry.id not in self.reject]
+        self.calls.append((resource_id, [entry.id for entry in accepted]))
+        if index_name is None:
+            target = self.current_index(resource_id)
+        else:
+            target = self.indices[index_name]
+        target.update((entry.id, entry) for entry in accepted)
+        if self.on_add is not None:
+            on_add, self.on_add = self.on_add, None
+            on_add()
+        if len(accepted) < len(entries):
+            raise errors.IndexingFailed(
+                resource_id, [entry.id for entry in entries if entry.id in self.reject]
+            )
+
+    def delete_entry(
+        self,
+        resource_id: str,
+        *,
+        entry_id: typing.Optional[str] = None,
+        index_name: typing.Optional[str] = None,
+    ):
+        if index_name is None:
+            target = self.current_index(resource_id)
+        else:
+            target = self.indices[index_name]
+        target.pop(entry_id, None)
+
+    def delete_index(self, resource_id: str, index_name: str):
+        del self.indices[index_name]
+
+    def switch_index(self, resource_id: str, index_name: str):
+        self.current[resource_id] = index_name
+
+
 class FakeUnitOfWork:
     def start(self):
         self.was_committed = False
@@ -182,8 +300,8 @@ class FakeResourceUnitOfWork(FakeUnitOfWork, unit_of_work.ResourceUnitOfWork):
 class FakeIndexUnitOfWork(
     FakeUnitOfWork, unit_of_work.IndexUnitOfWork, index_type="fake_index"
 ):
-    def __init__(self):
-        self._index = FakeIndex()
+    def __init__(self, fake_index: typing.Optional[index.Index] = None):
+        self._index = fake_index if fake_index is not None else FakeIndex()
 
     @property
     def repo(self) -> index.Index:
@@ -154,6 +154,27 @@ class TestAddEntry:
     # assert entry.op == EntryOp.ADDED
 
 
+class TestAddEntries:
+    def test_add_entries_in_chunks(self):
+        resource_id = "abc"
+        bus = bootstrap_test_app([resource_id])
+        bus.handle(make_create_resource_command(resource_id))
+        bus.handle(
+            commands.AddEntries(
+                resource_id=resource_id,
+                entries=({"id": f"r{i}"} for i in range(5)),
+                message="added",
+                user="user",
+                chunk_size=2,
+            )
+        )
+
+        uow = bus.ctx.entry_uows.get(resource_id)
+        assert uow.was_committed
+        assert len(uow.repo) == 5
+        assert len(bus.ctx.index_uow.repo.indicies[resource_id].entries) == 5
+
+
 class TestUpdateEntry:
     def test_update_entry(self):
         resource_id = "abc"
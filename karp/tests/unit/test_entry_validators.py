@@ -0,0 +1,53 @@
+import pytest
+
+from karp.domain import model
+from karp.services import entry_validators
+from karp.utility.unique_id import make_unique_id
+
+
+SCHEMA = {
+    "type": "object",
+    "properties": {"baseform": {"type": "string"}},
+    "required": ["baseform"],
+}
+
+
+def random_resource(version: int = 1) -> model.Resource:
+    return model.Resource(
+        entity_id=make_unique_id(),
+        resource_id="test_resource",
+        name="Test resource",
+        config={"fields": {"baseform": {"type": "string", "required": True}}},
+        message="added",
+        version=version,
+    )
+
+
+def test_get_validator_compiles_once_per_version(monkeypatch):
+    resource = random_resource()
+    validator = entry_validators.get_validator(resource)
+    assert validator({"baseform": "a"}) == {"baseform": "a"}
+
+    def fail(*args, **kwargs):
+        raise AssertionError("compiled again")
+
+    with monkeypatch.context() as m:
+        m.setattr(entry_validators, "compile_validator", fail)
+        assert entry_validators.get_validator(resource) is validator
+
+    resource.stamp(user="user")
+    assert entry_validators.get_validator(resource) is not validator
+
+
+def test_compile_validator_persists_source(tmp_path, monkeypatch):
+    validator = entry_validators.compile_validator(SCHEMA, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("karp_validator_*.py"))) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("generated again")
+
+    monkeypatch.setattr(entry_validators.fastjsonschema, "compile_to_code", fail)
+    loaded = entry_validators.compile_validator(SCHEMA, cache_dir=tmp_path)
+    assert loaded({"baseform": "a"}) == validator({"baseform": "a"})
+    with pytest.raises(entry_validators.fastjsonschema.JsonSchemaException):
+        loaded({})
@@ -0,0 +1,184 @@
+import types
+
+import pytest
+
+from karp.domain import errors as domain_errors
+from karp.domain.index import IndexEntry
+from karp.infrastructure.elasticsearch6 import es6_index
+
+
+class FakeEs:
+    def __init__(self):
+        self.refreshed = []
+        self.deleted = []
+        self.indices = types.SimpleNamespace(
+            refresh=lambda index: self.refreshed.append(index),
+            delete=lambda index, ignore: self.deleted.append(index),
+        )
+
+        self.gets = []
+        self.index_names = {}
+        self.pending_index_names = {}
+
+    def get(self, index, id, doc_type):
+        self.gets.append(id)
+        return {
+            "_source": {
+                "index_name": self.index_names.get(id, f"{id}_index"),
+                "pending_index_name": self.pending_index_names.get(id),
+            }
+        }
+
+    def update(self, index, id, doc_type, body, ignore):
+        self.pending_index_names[id] = body["doc"]["pending_index_name"]
+
+
+def create_index(bulk_chunk_size: int = 2) -> es6_index.Es6Index:
+    # Skip connecting to Elasticsearch
+    es_index = es6_index.Es6Index.__new__(es6_index.Es6Index)
+    es_index.es = FakeEs()
+    es_index.bulk_chunk_size = bulk_chunk_size
+    es_index.bulk_max_bytes = 1000
+    es_index.bulk_threads = 1
+    es_index.writer = None
+    es_index.index_name_ttl = 5
+    es_index._index_names = {}
+    return es_index
+
+
+def test_add_entries_streams_and_reports_errors(monkeypatch):
+    read = []
+
+    def entries():
+        for i in range(5):
+            read.append(i)
+            yield IndexEntry(id=str(i), entry={"i": i})
+
+    def streaming_bulk(client, actions, chunk_size, max_chunk_bytes, **kwargs):
+        assert (chunk_size, max_chunk_bytes) == (2, 1000)
+        assert kwargs == {"raise_on_error": False, "raise_on_exception": False}
+        for action in actions:
+            # Entries are read as they are sent
+            assert read[-1] == int(action["_id"])
+            assert action["_index"] == "places_index"
+            ok = action["_id"] != "3"
+            yield ok, {"index": {"_id": action["_id"], "status": 200 if ok else 400}}
+
+    monkeypatch.setattr(
+        es6_index.elasticsearch.helpers, "streaming_bulk", streaming_bulk
+    )
+    es_index = create_index()
+
+    with pytest.raises(domain_errors.IndexingFailed) as exc_info:
+        es_index.add_entries("places", entries(), refresh=False)
+
+    # The failure doesn't stop the other entries
+    assert read == [0, 1, 2, 3, 4]
+    assert exc_info.value.entry_ids == ["3"]
+    assert es_index.es.refreshed == []
+
+    es_index.add_entries("places", [])
+    assert es_index.es.refreshed == ["places_index"]
+
+
+def test_add_entries_buffers_small_writes_in_the_writer(monkeypatch):
+    submitted = []
+
+    class Writer:
+        max_docs = 2
+
+        def submit(self, actions, *, wait=False):
+            submitted.append(([action["_id"] for action in actions], wait))
+            return []
+
+        def flush(self):
+            submitted.append("flush")
+
+    def streaming_bulk(client, actions, **kwargs):
+        for action in actions:
+            yield True, {"index": {"_id": action["_id"], "status": 200}}
+
+    monkeypatch.setattr(
+        es6_index.elasticsearch.helpers, "streaming_bulk", streaming_bulk
+    )
+    es_index = create_index()
+    es_index.writer = Writer()
+
+    es_index.add_entries("places", [IndexEntry(id="1")])
+    es_index.add_entries("places", [IndexEntry(id="2")], refresh=False)
+    # Larger batches and writes to other indices are sent at once
+    es_index.add_entries("places", [IndexEntry(id=str(i)) for i in range(3)])
+    es_index.add_entries(
+        "places", [IndexEntry(id="4")], refresh=False, index_name="places_new"
+    )
+
+    assert submitted == [(["1"], True), (["2"], False), "flush"]
+    assert es_index.es.refreshed == ["places_index"]
+
+
+def test_single_entry_write_is_one_request_with_cached_index_name(monkeypatch):
+    bulk_requests = []
+
+    def streaming_bulk(client, actions, **kwargs):
+        actions = list(actions)
+        bulk_requests.append(([action["_index"] for action in actions], kwargs))
+        for action in actions:
+            yield True, {"index": {"_id": action["_id"], "status": 200}}
+
+    now = [100.0]
+    monkeypatch.setattr(
+        es6_index.elasticsearch.helpers, "streaming_bulk", streaming_bulk
+    )
+    monkeypatch.setattr(es6_index.time, "monotonic", lambda: now[0])
+    es_index = create_index()
+
+    es_index.add_entries("places", [IndexEntry(id="1")])
+    es_index.add_entries("places", [IndexEntry(id="2")])
+
+    assert es_index.es.gets == ["places"]
+    assert [indices for indices, _ in bulk_requests] == [
+        ["places_index"],
+        ["places_index"],
+    ]
+    # The bulk requests refresh, instead of a refresh request of their own
+    assert all(kwargs.get("refresh") == "true" for _, kwargs in bulk_requests)
+    assert es_index.es.refreshed == []
+
+    # Another process switches the index, seen after the ttl
+    es_index.es.index_names["places"] = "places_new"
+    now[0] += 4
+    es_index.add_entries("places", [IndexEntry(id="3")], refresh=False)
+    now[0] += 2
+    es_index.add_entries("places", [IndexEntry(id="4")], refresh=False)
+
+    assert es_index.es.gets == ["places", "places"]
+    assert [indices for indices, _ in bulk_requests[2:]] == [
+        ["places_index"],
+        ["places_new"],
+    ]
+
+
+def test_index_name_is_not_cached_while_a_new_index_is_built(monkeypatch):
+    monkeypatch.setattr(
+        es6_index.elasticsearch.helpers,
+        "streaming_bulk",
+        lambda client, actions, **kwargs: (
+            (True, {"index": {"_id": action["_id"]}}) for action in actions
+        ),
+    )
+    es_index = create_index()
+    es_index.add_entries("places", [IndexEntry(id="1")])
+    assert es_index.es.gets == ["places"]
+
+    es_index._set_pending_index_name("places", "places_new")
+    es_index.add_entries("places", [IndexEntry(id="2")])
+    es_index.add_entries("places", [IndexEntry(id="3")])
+    assert es_index.es.gets == ["places"] * 3
+
+    # Abandoning the new index lets the index name be cached again
+    es_index.delete_index("places", "places_new")
+    es_index.add_entries("places", [IndexEntry(id="4")])
+    es_index.add_entries("places", [IndexEntry(id="5")])
+    assert es_index.es.deleted == ["places_new"]
+    assert es_index.es.pending_index_names == {"places": None}
+    assert es_index.es.gets == ["places"] * 5
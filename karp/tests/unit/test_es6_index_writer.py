@@ -0,0 +1,152 @@
+import threading
+
+import pytest
+
+from karp.infrastructure.elasticsearch6 import es6_index_writer
+
+
+class FakeEs:
+    def __init__(self, fail_ids=()):
+        self.bulks = []
+        self.fail_ids = set(fail_ids)
+        self.error = None
+
+    def bulk(self, body, refresh):
+        if self.error:
+            raise self.error
+        self.bulks.append((body, refresh))
+        items = []
+        for line in body:
+            ((op_type, meta),) = line.items()
+            if op_type not in ("index", "delete"):
+                continue
+            status = 400 if meta["_id"] in self.fail_ids else 200
+            items.append(
+                {
+                    op_type: {
+                        "_index": meta["_index"],
+                        "_id": meta["_id"],
+                        "status": status,
+                    }
+                }
+            )
+        return {"errors": bool(self.fail_ids), "items": items}
+
+
+def index_action(entry_id, name):
+    return {
+        "_index": "places_1",
+        "_id": entry_id,
+        "_type": "entry",
+        "_source": {"name": name},
+    }
+
+
+def delete_action(entry_id):
+    return {
+        "_op_type": "delete",
+        "_index": "places_1",
+        "_type": "entry",
+        "_id": entry_id,
+    }
+
+
+@pytest.fixture(name="writer")
+def fixture_writer():
+    writer = es6_index_writer.Es6IndexWriter(FakeEs(), max_delay=0.2, max_docs=100)
+    yield writer
+    writer.close()
+
+
+def test_writer_coalesces_concurrent_writes_into_one_bulk(writer):
+    writer.submit([index_action("1", "a")])
+    writer.submit([index_action("2", "b"), index_action("1", "a2")])
+    writer.submit([delete_action("3")])
+    results = []
+    waiting = [
+        threading.Thread(target=lambda: results.append(writer.submit([], wait=True)))
+        for _ in range(3)
+    ]
+    for thread in waiting:
+        thread.start()
+    writer.submit([index_action("2", "b2")], wait=True)
+    for thread in waiting:
+        thread.join()
+
+    ((body, refresh),) = writer.es.bulks
+    assert refresh == "true"
+    assert body == [
+        {"index": {"_index": "places_1", "_type": "entry", "_id": "1"}},
+        {"name": "a2"},
+        {"index": {"_index": "places_1", "_type": "entry", "_id": "2"}},
+        {"name": "b2"},
+        {"delete": {"_index": "places_1", "_type": "entry", "_id": "3"}},
+    ]
+    assert results == [[], [], []]
+    metrics = writer.metrics.snapshot()
+    assert metrics["submitted"] == 5
+    assert metrics["coalesced"] == 2
+    assert metrics["flushes"] == 1
+    assert metrics["written"] == 3
+    assert metrics["batch_size"] == {"mean": 3.0, "max": 3}
+    assert metrics["flush_latency_ms"]["max"] >= 200
+
+
+def test_writer_flushes_when_max_docs_are_buffered():
+    writer = es6_index_writer.Es6IndexWriter(FakeEs(), max_delay=60, max_docs=2)
+    try:
+        writer.submit([index_action("1", "a"), index_action("2", "b")], wait=True)
+        assert len(writer.es.bulks) == 1
+        writer.submit([index_action("3", "c")])
+        writer.flush()
+        assert len(writer.es.bulks) == 2
+    finally:
+        writer.close()
+
+
+def test_writer_returns_failures_to_the_callers_that_wait(writer):
+    writer.es.fail_ids = {"2"}
+    writer.submit([index_action("2", "b")])
+
+    failed = writer.submit([index_action("1", "a")], wait=True)
+
+    assert failed == []
+    assert writer.metrics.snapshot()["failed"] == 1
+    assert writer.submit([index_action("2", "b")], wait=True) == [
+        {"index": {"_index": "places_1", "_id": "2", "status": 400}}
+    ]
+
+    writer.es.error = ConnectionError("es is down")
+    with pytest.raises(ConnectionError):
+        writer.submit([index_action("1", "a")], wait=True)
+    assert writer.metrics.snapshot()["failed_flushes"] == 1
+
+
+def test_close_flushes_buffered_writes():
+    writer = es6_index_writer.Es6IndexWriter(FakeEs(), max_delay=60, max_docs=100)
+    writer.submit([index_action("1", "a")])
+
+    writer.close()
+
+    assert len(writer.es.bulks) == 1
+    with pytest.raises(RuntimeError):
+        writer.submit([index_action("1", "a")])
+
+
+def test_shared_writer_is_shared_per_client_until_closed():
+    es = FakeEs()
+    writer = es6_index_writer.shared_writer(es, max_delay=60, max_docs=100)
+    try:
+        assert es6_index_writer.shared_writer(es, max_delay=60, max_docs=100) is writer
+        assert (
+            es6_index_writer.shared_writer(FakeEs(), max_delay=60, max_docs=100)
+            is not writer
+        )
+    finally:
+        for other in list(es6_index_writer._shared_writers.values()):
+            other.close()
+
+    assert es6_index_writer._shared_writers == {}
+    new_writer = es6_index_writer.shared_writer(es, max_delay=60, max_docs=100)
+    assert new_writer is not writer
+    new_writer.close()
@@ -0,0 +1,39 @@
+import pytest
+
+from karp.utility import json_delta
+
+
+@pytest.mark.parametrize(
+    "old,new",
+    [
+        ({}, {}),
+        ({}, {"a": 1}),
+        ({"a": 1}, {}),
+        ({"a": 0}, {"a": 1}),
+        ({"a": [1, 2]}, {"a": [2]}),
+        ({"a": {"b": 1, "c": 2}}, {"a": {"b": 1, "d": None}}),
+        ({"a": {"b": 1}}, {"a": "b"}),
+        ({"a": False, "b": ""}, {"a": True, "c": {"d": [{}]}}),
+    ],
+)
+def test_apply_delta_recreates_new(old, new):
+    delta = json_delta.make_delta(old, new)
+
+    assert json_delta.apply_delta(old, delta) == new
+
+
+def test_apply_delta_leaves_old_unchanged():
+    old = {"a": {"b": 1}, "c": 2}
+    new = {"a": {"b": 2}}
+
+    json_delta.apply_delta(old, json_delta.make_delta(old, new))
+
+    assert old == {"a": {"b": 1}, "c": 2}
+
+
+def test_make_delta_only_holds_changes():
+    delta = json_delta.make_delta(
+        {"a": 1, "b": {"c": 1, "d": 1}}, {"a": 1, "b": {"c": 2, "d": 1}}
+    )
+
+    assert delta == {"patch": {"b": {"set": {"c": 2}}}}
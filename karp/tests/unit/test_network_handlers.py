@@ -1,7 +1,12 @@
-from karp.services import network_handlers
+import json
+
+from karp.domain import model
+from karp.services import context, network_handlers, reference_graph
 from karp.domain.models.entry import create_entry
 from karp.utility import unique_id
 
+from . import adapters
+
 
 def test__create_ref():
     resource_id = "resource_id"
@@ -23,3 +28,110 @@ def test__create_ref():
     # assert ref["entry"]["id"] == _id
     assert ref["entry"].entry_id == entry_id
     assert ref["entry"].body == entry_body
+
+
+def places_and_municipalities():
+    resources = []
+    for resource_id in ("places", "municipalities"):
+        with open(f"karp/tests/data/config/{resource_id}.json") as fp:
+            config = json.load(fp)
+        resources.append(
+            model.Resource(
+                entity_id=unique_id.make_unique_id(),
+                resource_id=resource_id,
+                name=resource_id,
+                config=config,
+                message="added",
+                version=1,
+                is_published=True,
+            )
+        )
+    return resources
+
+
+def test_reference_graph_refs():
+    places, municipalities = places_and_municipalities()
+    graph = reference_graph.ReferenceGraph.from_resources([places, municipalities])
+
+    assert [
+        (resource_id, version, field_name)
+        for resource_id, version, field_name, _ in graph.referring_fields(
+            "municipalities", 1
+        )
+    ] == [("places", 1, "municipality")]
+
+    refs, backrefs = graph.refs(municipalities, 1)
+    assert refs == []
+    assert [ref[:3] for ref in backrefs] == [
+        ("places", 1, "municipality"),
+    ]
+
+    refs, backrefs = graph.refs(places, None)
+    assert [ref[:3] for ref in refs] == [
+        ("municipalities", 1, "municipality"),
+        ("places", None, "larger_place"),
+    ]
+    assert [ref[:3] for ref in backrefs] == [("places", None, "larger_place")]
+
+
+def test_get_refs_uses_graph_until_invalidated(monkeypatch):
+    resource_uow = adapters.FakeResourceUnitOfWork()
+    for resource in places_and_municipalities():
+        resource_uow.repo.put(resource)
+    ctx = context.Context(resource_uow, None, None, None)
+
+    calls = []
+    get_published_resources = resource_uow.repo.get_published_resources
+    monkeypatch.setattr(
+        resource_uow.repo,
+        "get_published_resources",
+        lambda: calls.append(1) or get_published_resources(),
+    )
+
+    first = network_handlers.get_refs("municipalities", ctx, version=1)
+    assert network_handlers.get_refs("municipalities", ctx, version=1) == first
+    assert len(calls) == 1
+
+    network_handlers.invalidate_reference_graph(None, ctx)
+    assert network_handlers.get_refs("municipalities", ctx, version=1) == first
+    assert len(calls) == 2
+
+
+def test_reference_graph_is_persisted(tmp_path, monkeypatch):
+    path = tmp_path / "reference_graph.json"
+    monkeypatch.setattr(reference_graph.config, "REFERENCE_GRAPH_PATH", path)
+    resources = places_and_municipalities()
+    writer_uow = adapters.FakeResourceUnitOfWork()
+    for resource in resources:
+        writer_uow.repo.put(resource)
+
+    graph = reference_graph.get_graph(writer_uow)
+    assert path.exists()
+
+    # Another process only reads the stored graph
+    reader_uow = adapters.FakeResourceUnitOfWork()
+    loaded = reference_graph.get_graph(reader_uow)
+    assert loaded.to_dict() == graph.to_dict()
+    assert loaded.refs(resources[1], 1) == graph.refs(resources[1], 1)
+
+    reference_graph.invalidate(writer_uow)
+    assert not path.exists()
+    assert reference_graph.get_graph(reader_uow).referring_fields(
+        "municipalities", 1
+    ) == []
+
+
+def test_reference_graph_is_rebuilt_after_changes_by_other_processes(monkeypatch):
+    monkeypatch.setattr(reference_graph, "REFERENCE_GRAPH_STAMP_TTL", 0)
+    resource_uow = adapters.FakeResourceUnitOfWork()
+    for resource in places_and_municipalities():
+        resource_uow.repo.put(resource)
+    stamp = [1]
+    monkeypatch.setattr(resource_uow.repo, "history_stamp", lambda: stamp[0])
+
+    graph = reference_graph.get_graph(resource_uow)
+    assert reference_graph.get_graph(resource_uow) is graph
+
+    # Another process publishes a resource
+    stamp[0] = 2
+    assert reference_graph.get_graph(resource_uow) is not graph
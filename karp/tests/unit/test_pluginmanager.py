@@ -0,0 +1,95 @@
+import pytest
+
+from karp import errors, pluginmanager
+from karp.application import config
+
+
+class Plugin:
+    def __init__(self):
+        self.calls = []
+        self.initialized = False
+
+    def init(self):
+        self.initialized = True
+
+    def apply_plugin_function(self, resource_id, version, entry):
+        self.calls.append(entry["baseform"])
+        return {"upper": entry["baseform"].upper()}
+
+
+class BatchPlugin(Plugin):
+    reads = ["baseform"]
+
+    def apply_plugin_function_batch(self, resource_id, version, entries):
+        self.calls.append([entry["baseform"] for entry in entries])
+        return [{"upper": entry["baseform"].upper()} for entry in entries]
+
+
+class EntryPoint:
+    def __init__(self, name, plugin):
+        self.name = name
+        self.plugin = plugin
+        self.loaded = 0
+
+    def load(self):
+        self.loaded += 1
+        return self.plugin
+
+
+@pytest.fixture(name="registry")
+def fixture_registry(monkeypatch):
+    monkeypatch.setattr(pluginmanager, "plugins", {})
+    entry_points = [EntryPoint("upper", Plugin()), EntryPoint("batch", BatchPlugin())]
+    monkeypatch.setattr(pluginmanager, "_plugin_entry_points", lambda: entry_points)
+    pluginmanager.clear_cache()
+    yield {entry_point.name: entry_point for entry_point in entry_points}
+    pluginmanager.clear_cache()
+
+
+ENTRIES = [{"baseform": "hus"}, {"baseform": "hem", "pos": "nn"}, {"baseform": "hus"}]
+
+
+def test_plugins_are_loaded_when_first_used(registry):
+    assert pluginmanager.plugins == {}
+
+    plugin = pluginmanager.get_plugin("upper")
+
+    assert plugin.initialized
+    assert pluginmanager.get_plugin("upper") is plugin
+    assert registry["upper"].loaded == 1
+    assert registry["batch"].loaded == 0
+    with pytest.raises(errors.PluginNotFoundError):
+        pluginmanager.get_plugin("missing", "places")
+
+
+def test_apply_plugin_function_batch_falls_back_to_one_call_per_entry(registry):
+    results = pluginmanager.apply_plugin_function_batch("upper", "id", 1, ENTRIES)
+
+    assert results == [{"upper": "HUS"}, {"upper": "HEM"}, {"upper": "HUS"}]
+    # The plugin doesn't declare what it reads, so nothing is memoized
+    assert registry["upper"].plugin.calls == ["hus", "hem", "hus"]
+
+
+def test_apply_plugin_function_batch_memoizes_by_read_fields(registry):
+    plugin = registry["batch"].plugin
+
+    results = pluginmanager.apply_plugin_function_batch("batch", "id", 1, ENTRIES)
+    assert pluginmanager.apply_plugin_function(
+        "batch", "id", 1, {"baseform": "hem", "pos": "vb"}
+    ) == {"upper": "HEM"}
+
+    assert results == [{"upper": "HUS"}, {"upper": "HEM"}, {"upper": "HUS"}]
+    assert plugin.calls == [["hus", "hem"]]
+
+    pluginmanager.apply_plugin_function_batch("batch", "id", 2, ENTRIES)
+    assert plugin.calls == [["hus", "hem"], ["hus", "hem"]]
+
+
+def test_plugin_cache_size_bounds_memoized_results(registry, monkeypatch):
+    monkeypatch.setattr(config, "PLUGIN_CACHE_SIZE", 1)
+    plugin = registry["batch"].plugin
+
+    pluginmanager.apply_plugin_function_batch("batch", "id", 1, ENTRIES[:2])
+    pluginmanager.apply_plugin_function_batch("batch", "id", 1, ENTRIES)
+
+    assert plugin.calls == [["hus", "hem"], ["hus"]]
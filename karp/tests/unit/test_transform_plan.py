@@ -0,0 +1,126 @@
+from karp import pluginmanager
+from karp.domain import index, model
+from karp.services import transform_plan
+from karp.utility.unique_id import make_unique_id
+
+from . import adapters
+
+
+FIELDS = {
+    "baseform": {"type": "string"},
+    "pos": {"type": "string"},
+    "forms": {
+        "type": "object",
+        "fields": {"singular": {"type": "string"}, "plural": {"type": "string"}},
+    },
+    "see_also": {"type": "string", "ref": {"field": {"type": "string"}}},
+    "count": {"type": "integer"},
+}
+
+
+def random_resource(version: int = 1) -> model.Resource:
+    return model.Resource(
+        entity_id=make_unique_id(),
+        resource_id="test_resource",
+        name="Test resource",
+        config={"fields": FIELDS},
+        message="added",
+        version=version,
+    )
+
+
+def test_get_plan_compiles_once_per_version(monkeypatch):
+    resource = random_resource()
+    plan = transform_plan.get_plan(resource)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("compiled again")
+
+    with monkeypatch.context() as m:
+        m.setattr(transform_plan, "compile_fields", fail)
+        assert transform_plan.get_plan(resource) is plan
+
+    resource.stamp(user="user")
+    assert transform_plan.get_plan(resource) is not plan
+
+
+class Prefetched:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def by_entry_ids(self, resource_id, entry_ids):
+        return {entry_id: self.entries[entry_id] for entry_id in entry_ids}
+
+
+def test_plan_transforms_fields_in_config_order():
+    resource = random_resource()
+    plan = transform_plan.compile_fields(FIELDS.items())
+    # baseform and pos are copied by one op, see_also and count by another
+    assert len(plan.ops) == 4
+
+    ref_entry = model.create_entry(
+        "hem", {"baseform": "hem"}, entity_id=make_unique_id(), resource_id="test"
+    )
+    env = transform_plan.TransformEnv(
+        adapters.bootstrap_test_app().ctx, Prefetched({"hem": ref_entry})
+    )
+    index_entry = index.IndexEntry()
+    plan.apply(
+        resource,
+        {
+            "count": 3,
+            "see_also": "hem",
+            "baseform": "hus",
+            "forms": {"plural": "hus"},
+            "pos": "",
+        },
+        index_entry,
+        env,
+    )
+
+    assert list(index_entry.entry.items()) == [
+        ("baseform", "hus"),
+        ("forms", {"plural": "hus"}),
+        ("v_see_also", {"baseform": "hem"}),
+        ("see_also", "hem"),
+        ("count", 3),
+    ]
+
+
+def test_plugin_fields_are_computed_once_per_batch(monkeypatch):
+    calls = []
+
+    class Plugin:
+        def apply_plugin_function_batch(self, resource_id, version, entries):
+            calls.append([entry["baseform"] for entry in entries])
+            return [entry["baseform"].upper() for entry in entries]
+
+    monkeypatch.setattr(pluginmanager, "plugins", {"upper": Plugin()})
+    resource = random_resource()
+    plan = transform_plan.compile_fields(
+        [
+            ("baseform", {"type": "string"}),
+            (
+                "upper",
+                {"type": "string", "virtual": True, "function": {"plugin": "upper"}},
+            ),
+        ]
+    )
+    prefetched = transform_plan.PrefetchedRefs()
+    env = transform_plan.TransformEnv(adapters.bootstrap_test_app().ctx, prefetched)
+    src_entries = [{"baseform": "hus"}, {"baseform": "hem"}]
+    for src_entry in src_entries:
+        plan.collect(resource, src_entry, env)
+    prefetched.fetch(env.ctx)
+
+    index_entries = []
+    for src_entry in src_entries:
+        index_entry = index.IndexEntry()
+        plan.apply(resource, src_entry, index_entry, env)
+        index_entries.append(index_entry.entry)
+
+    assert index_entries == [
+        {"baseform": "hus", "v_upper": "HUS"},
+        {"baseform": "hem", "v_upper": "HEM"},
+    ]
+    assert calls == [["hus", "hem"]]
@@ -0,0 +1,39 @@
+"""Deltas between json objects that can be applied to recreate the newer one.
+
+A delta is a dict with (any of) the keys:
+
+- "set": keys whose value is added or replaced,
+- "unset": keys that are removed,
+- "patch": keys holding objects that are changed, mapped to their delta.
+"""
+import copy
+from typing import Dict
+
+
+def make_delta(old: Dict, new: Dict) -> Dict:
+    """Compute the delta that turns old into new."""
+    delta = {}
+    for key, value in new.items():
+        if key not in old:
+            delta.setdefault("set", {})[key] = value
+        elif old[key] != value:
+            if isinstance(old[key], dict) and isinstance(value, dict):
+                delta.setdefault("patch", {})[key] = make_delta(old[key], value)
+            else:
+                delta.setdefault("set", {})[key] = value
+    unset = [key for key in old if key not in new]
+    if unset:
+        delta["unset"] = unset
+    return delta
+
+
+def apply_delta(old: Dict, delta: Dict) -> Dict:
+    """Apply delta to old and return the result, old is left unchanged."""
+    new = dict(old)
+    for key in delta.get("unset", ()):
+        new.pop(key, None)
+    for key, value in delta.get("set", {}).items():
+        new[key] = copy.deepcopy(value)
+    for key, sub_delta in delta.get("patch", {}).items():
+        new[key] = apply_delta(new[key], sub_delta)
+    return new
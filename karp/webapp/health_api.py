@@ -33,5 +33,14 @@ def perform_health_check(
     return {"database": db_status.message}
 
 
+@router.get("/healthz/index-writer", include_in_schema=False)
+@wiring.inject
+def get_index_writer_metrics(
+    bus: MessageBus = Depends(wiring.Provide[WebAppContainer.context.bus]),
+):
+    """Metrics of the buffered index writes, null if writes aren't buffered."""
+    return system_monitor.get_index_writer_metrics(bus.ctx)
+
+
 def init_app(app):
     app.include_router(router)
@@ -92,6 +92,7 @@ def get_diff(
 
 @router.get(
     "/{resource_id}/history",
+    response_model=entry_views.EntryHistoryResponse,
 )
 @wiring.inject
 def get_history(
@@ -105,6 +106,8 @@ def get_history(
     from_version: Optional[int] = Query(None),
     current_page: int = Query(0),
     page_size: int = Query(100),
+    cursor: Optional[int] = Query(None),
+    with_total: Optional[bool] = Query(None),
     auth_service: AuthService = Depends(wiring.Provide[WebAppContainer.auth_service]),
     bus: MessageBus = Depends(wiring.Provide[WebAppContainer.context.bus]),
 ):
@@ -125,13 +128,14 @@ def get_history(
         entry_id=entry_id,
         from_version=from_version,
         to_version=to_version,
+        cursor=cursor,
+        with_total=with_total,
     )
-    history, total = entry_views.get_history(
+    return entry_views.get_history(
         resource_id,
         history_request,
         ctx=bus.ctx,
     )
-    return {"history": history, "total": total}
 
 
 @router.get("/{resource_id}/{entry_id}/{version}/history", response_model=schemas.Entry)